@@ -0,0 +1,189 @@
+"""
+Procesamiento masivo (backfill) de los objetos existentes bajo un prefijo del bucket.
+
+Lista el prefijo por páginas y entrega cada objeto a `process_file` a través de un
+planificador con carriles por tipo de archivo y clase de tamaño, con un número acotado
+de archivos pendientes. El
+avance se guarda en un punto de control en el almacenamiento, de modo que una ejecución
+interrumpida continúa desde la última página completada.
+
+Uso:
+    python backfill.py --bucket data_lake_sieve --prefix raw/storage/
+"""
+
+import time
+import logging
+import argparse
+import threading
+
+import config
+from main import process_file, DESTINATION_BUCKET
+from utils.checkpoint import load_checkpoint, save_checkpoint
+from utils.storage_backend import get_storage
+from utils.lane_scheduler import LaneScheduler, file_type_for
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FOLDER = "processed/_checkpoints/backfill/"
+
+def _checkpoint_blob_name(bucket_name: str, prefix: str) -> str:
+    safe_prefix = prefix.strip('/').replace('/', '_') or 'root'
+    return f"{CHECKPOINT_FOLDER}{bucket_name}/{safe_prefix}.json"
+
+
+class _Progress:
+    """
+    Contadores del backfill y registro del avance de las páginas en orden.
+
+    Una página se da por completada cuando terminan todos sus archivos y los de las
+    páginas anteriores; solo entonces su token de continuación pasa al punto de control.
+    """
+
+    def __init__(self, state: dict, save):
+        self._lock = threading.Lock()
+        self._save = save
+        self.state = state
+        self.state.setdefault('counts', {})
+        self._pages = {}
+        self._next_page = 0
+        self._next_to_commit = 0
+        self.files_done = 0
+        self.bytes_done = 0
+
+    def add_page(self, next_page_token: str) -> int:
+        with self._lock:
+            page = self._next_page
+            self._pages[page] = {'token': next_page_token, 'pending': 1}
+            self._next_page += 1
+            return page
+
+    def close_page(self, page: int):
+        """
+        Marca que ya se enviaron todos los archivos de la página.
+        """
+        self._release(page)
+
+    def add_file(self, page: int):
+        with self._lock:
+            self._pages[page]['pending'] += 1
+
+    def finished(self, page: int, file_type: str, outcome: str, size: int):
+        with self._lock:
+            counts = self.state['counts'].setdefault(file_type, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+            self.files_done += 1
+            self.bytes_done += size
+        self._release(page)
+
+    def _release(self, page: int):
+        with self._lock:
+            self._pages[page]['pending'] -= 1
+            committed = None
+            while self._next_to_commit in self._pages and self._pages[self._next_to_commit]['pending'] == 0:
+                committed = self._pages.pop(self._next_to_commit)
+                self._next_to_commit += 1
+            if committed is None:
+                return
+            self.state['page_token'] = committed['token']
+            self.state['done'] = committed['token'] is None
+            # Se guarda dentro del candado para que los puntos de control no se reordenen
+            self._save(self.state)
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return self.files_done, self.bytes_done
+
+
+def _report_throughput(progress: _Progress, lanes: LaneScheduler, stop: threading.Event):
+    """
+    Registra periódicamente el rendimiento del backfill hasta que se indique detenerse.
+    """
+    started_at = time.monotonic()
+    last_files, last_bytes, last_at = 0, 0, started_at
+    while not stop.wait(config.BACKFILL_REPORT_INTERVAL):
+        files, size = progress.snapshot()
+        now = time.monotonic()
+        interval = max(now - last_at, 1e-6)
+        logger.info(
+            f"Backfill: {files} archivo(s) en {now - started_at:.0f}s | "
+            f"{(files - last_files) / interval:.2f} archivos/s, "
+            f"{(size - last_bytes) / interval / 1024 / 1024:.2f} MB/s | carriles: {lanes.stats()}"
+        )
+        last_files, last_bytes, last_at = files, size, now
+
+
+def run_backfill(bucket_name: str, prefix: str, workers: int = None, page_size: int = None, restart: bool = False) -> dict:
+    """
+    Procesa con `process_file` todos los objetos bajo un prefijo del bucket.
+
+    Args:
+        bucket_name (str): Bucket con los archivos originales.
+        prefix (str): Prefijo a procesar, por ejemplo 'raw/storage/'.
+        workers (int): Número de hilos de trabajo repartidos entre los carriles (opcional).
+        page_size (int): Objetos por página del listado (opcional).
+        restart (bool): Ignora el punto de control y comienza desde el inicio.
+
+    Returns:
+        dict: El estado final del punto de control.
+    """
+    workers = workers or config.BACKFILL_WORKERS
+    page_size = page_size or config.BACKFILL_PAGE_SIZE
+
+    checkpoint_blob = _checkpoint_blob_name(bucket_name, prefix)
+    state = {} if restart else load_checkpoint(DESTINATION_BUCKET, checkpoint_blob)
+    if state.get('done'):
+        logger.info(f"El backfill de gs://{bucket_name}/{prefix} ya se completó. Usa `restart` para repetirlo.")
+        return state
+
+    progress = _Progress(state, lambda current: save_checkpoint(DESTINATION_BUCKET, checkpoint_blob, current))
+    # Cada carril (tipo de archivo, clase de tamaño) tiene su propio límite de concurrencia
+    lanes = LaneScheduler(workers, config.LANE_CONCURRENCY, config.LANE_SMALL_FILE_BYTES, name="backfill")
+    # Acota los archivos listados y aún no terminados para no adelantarse demasiado al listado
+    slots = threading.BoundedSemaphore(config.BACKFILL_MAX_PENDING)
+
+    def _run(page: int, file_type: str, file_name: str, size: int):
+        outcome = 'failed'
+        try:
+            _, status = process_file(bucket_name, file_name)
+            outcome = {200: 'processed', 202: 'deferred'}.get(status, 'failed')
+        except Exception as e:
+            logger.error(f"Error no controlado en el backfill de {file_name}: {e}")
+        finally:
+            progress.finished(page, file_type, outcome, size)
+            slots.release()
+
+    stop = threading.Event()
+    reporter = threading.Thread(target=_report_throughput, args=(progress, lanes, stop), daemon=True)
+    reporter.start()
+    logger.info(f"Iniciando backfill de gs://{bucket_name}/{prefix} con {workers} hilo(s) de trabajo.")
+    try:
+        pages = get_storage().list_pages(bucket_name, prefix=prefix, page_size=page_size, page_token=state.get('page_token'))
+        for blobs, next_page_token in pages:
+            page = progress.add_page(next_page_token)
+            for blob in blobs:
+                if blob.name.endswith('/'):
+                    continue
+                file_type = file_type_for(blob.name)
+                slots.acquire()
+                progress.add_file(page)
+                lanes.submit(file_type, blob.size, _run, page, file_type, blob.name, blob.size or 0)
+            progress.close_page(page)
+    finally:
+        lanes.shutdown(wait=True)
+        stop.set()
+        reporter.join()
+
+    files, size = progress.snapshot()
+    logger.info(f"Backfill finalizado: {files} archivo(s), {size / 1024 / 1024:.1f} MB. Resultados: {state['counts']}")
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Procesa los objetos existentes bajo un prefijo del bucket.")
+    parser.add_argument("--bucket", default=config.BUCKET_NAME)
+    parser.add_argument("--prefix", default=config.PATHS['raw_storage'])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--page-size", type=int, default=None)
+    parser.add_argument("--restart", action="store_true")
+    args = parser.parse_args()
+    run_backfill(args.bucket, args.prefix, args.workers, args.page_size, args.restart)
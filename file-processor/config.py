@@ -52,4 +52,144 @@ PATHS = {
     'processed_results': 'processed/processed_results/',
     'processed_stacks': 'processed/stacks/',
     'processed_raw_reports': 'processed/raw_reports/'
-}
\ No newline at end of file
+}
+
+# Empaquetado de documentos pequeños en una sola solicitud a Gemini
+PROMPT_PACKING_ENABLED = os.environ.get("PROMPT_PACKING_ENABLED", "false").lower() == "true"
+PROMPT_PACKING_WINDOW_SECONDS = float(os.environ.get("PROMPT_PACKING_WINDOW_SECONDS", 0.5))
+PROMPT_PACKING_MAX_DOCUMENTS = int(os.environ.get("PROMPT_PACKING_MAX_DOCUMENTS", 10))
+PROMPT_PACKING_MAX_DOCUMENT_CHARS = int(os.environ.get("PROMPT_PACKING_MAX_DOCUMENT_CHARS", 4000))
+PROMPT_PACKING_MAX_BATCH_CHARS = int(os.environ.get("PROMPT_PACKING_MAX_BATCH_CHARS", 40000))
+PROMPT_PACKING_MIME_TYPES = ['text/plain', 'application/json']
+
+# Detección de documentos casi idénticos para reutilizar extracciones previas
+DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED", "false").lower() == "true"
+DEDUP_MAX_ENTRIES = int(os.environ.get("DEDUP_MAX_ENTRIES", 2000))
+DEDUP_NUM_PERM = int(os.environ.get("DEDUP_NUM_PERM", 128))
+DEDUP_BANDS = int(os.environ.get("DEDUP_BANDS", 32))
+DEDUP_SHINGLE_SIZE = int(os.environ.get("DEDUP_SHINGLE_SIZE", 5))
+DEDUP_MAX_TEXT_CHARS = int(os.environ.get("DEDUP_MAX_TEXT_CHARS", 200000))
+DEDUP_DELTA_THRESHOLD = float(os.environ.get("DEDUP_DELTA_THRESHOLD", 0.7))  # Envía solo las diferencias
+
+# Formato de los stacks procesados: 'csv', 'parquet' o 'both' (Parquet y CSV)
+STACK_FORMAT = os.environ.get("STACK_FORMAT", "both").lower()
+PARQUET_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")
+
+# Tamaño de cada parte de las cargas reanudables (múltiplo de 256 KB)
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024))
+CSV_WRITE_CHUNK_ROWS = int(os.environ.get("CSV_WRITE_CHUNK_ROWS", 10000))
+
+# Selección del motor de análisis: 'auto', 'pandas' o 'bigframes'
+ANALYSIS_ENGINE = os.environ.get("ANALYSIS_ENGINE", "auto").lower()
+LOCAL_ANALYSIS_MAX_BYTES = int(os.environ.get("LOCAL_ANALYSIS_MAX_BYTES", 50 * 1024 * 1024))  # 50MB
+LOCAL_ANALYSIS_MAX_ROWS = int(os.environ.get("LOCAL_ANALYSIS_MAX_ROWS", 200000))
+
+# Muestreo de filas para el prompt del análisis: 'head' o 'stratified'
+ANALYSIS_SAMPLE_ROWS = int(os.environ.get("ANALYSIS_SAMPLE_ROWS", 10))
+ANALYSIS_SAMPLE_STRATEGY = os.environ.get("ANALYSIS_SAMPLE_STRATEGY", "head").lower()
+ANALYSIS_PROMPT_MAX_CHARS = int(os.environ.get("ANALYSIS_PROMPT_MAX_CHARS", 2000))
+
+# Pronósticos base locales para los reportes Foresight
+FORECAST_HORIZON = int(os.environ.get("FORECAST_HORIZON", 6))
+FORECAST_MAX_PAIRS = int(os.environ.get("FORECAST_MAX_PAIRS", 10))
+
+# Segundos mínimos entre verificaciones de salud de la sesión de BigFrames
+BIGFRAMES_HEALTH_CHECK_INTERVAL = float(os.environ.get("BIGFRAMES_HEALTH_CHECK_INTERVAL", 300))
+
+# Agrupación de prompts de reportes en una sola llamada a predict de BigFrames
+REPORT_BATCH_WINDOW_SECONDS = float(os.environ.get("REPORT_BATCH_WINDOW_SECONDS", 1.0))
+REPORT_BATCH_MAX_PROMPTS = int(os.environ.get("REPORT_BATCH_MAX_PROMPTS", 20))
+
+# Tamaño objetivo de cada parte Parquet de la compactación
+COMPACTION_TARGET_FILE_BYTES = int(os.environ.get("COMPACTION_TARGET_FILE_BYTES", 128 * 1024 * 1024))  # 128MB
+# Duración del turno exclusivo de una compactación; las partes temporales más antiguas se descartan
+COMPACTION_LEASE_SECONDS = float(os.environ.get("COMPACTION_LEASE_SECONDS", 7200))
+
+# Conjunto de datos unificado: cada stack deja una parte pendiente que la compactación fusiona
+UNIFIED_DATASET_ENABLED = os.environ.get("UNIFIED_DATASET_ENABLED", "false").lower() == "true"
+UNIFIED_SKETCH_SIZE = int(os.environ.get("UNIFIED_SKETCH_SIZE", 64))  # Valores por bosquejo KMV
+
+# Índice de identificadores entre archivos, particionado por hash y fusionado por la compactación
+IDENTIFIER_INDEX_ENABLED = os.environ.get("IDENTIFIER_INDEX_ENABLED", "true").lower() == "true"
+IDENTIFIER_INDEX_COLUMNS = ['client_id', 'product_id', 'order_number']
+IDENTIFIER_BLOOM_FP_RATE = float(os.environ.get("IDENTIFIER_BLOOM_FP_RATE", 0.01))
+IDENTIFIER_INDEX_REFRESH_SECONDS = float(os.environ.get("IDENTIFIER_INDEX_REFRESH_SECONDS", 60))
+IDENTIFIER_INDEX_PARTITIONS = int(os.environ.get("IDENTIFIER_INDEX_PARTITIONS", 64))
+IDENTIFIER_INDEX_CACHED_RUNS = int(os.environ.get("IDENTIFIER_INDEX_CACHED_RUNS", 16))
+
+# Rematerialización masiva de stacks y reportes desde los resultados guardados
+REMATERIALIZE_WORKERS = int(os.environ.get("REMATERIALIZE_WORKERS", 8))
+REMATERIALIZE_PAGE_SIZE = int(os.environ.get("REMATERIALIZE_PAGE_SIZE", 500))
+
+# Ejecución masiva (backfill) sobre un prefijo existente del bucket
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", 16))  # Hilos de trabajo
+BACKFILL_PAGE_SIZE = int(os.environ.get("BACKFILL_PAGE_SIZE", 1000))
+BACKFILL_REPORT_INTERVAL = float(os.environ.get("BACKFILL_REPORT_INTERVAL", 30))  # Segundos entre reportes de avance
+BACKFILL_MAX_PENDING = int(os.environ.get("BACKFILL_MAX_PENDING", 200))  # Archivos listados y aún no terminados
+
+# Backend de almacenamiento: 'gcs' (Cloud Storage) o 'local' (un directorio del disco)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "gcs").lower()
+LOCAL_STORAGE_ROOT = os.environ.get("LOCAL_STORAGE_ROOT", "./local_storage")
+
+# Modo trabajador con extracción continua (streaming pull) de Pub/Sub
+PUBSUB_SUBSCRIPTION = os.environ.get("PUBSUB_SUBSCRIPTION", "file-processor-sub")
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", 8))
+WORKER_MAX_MESSAGES = int(os.environ.get("WORKER_MAX_MESSAGES", WORKER_THREADS * 4))  # Mensajes pendientes de confirmar
+WORKER_MAX_BYTES = int(os.environ.get("WORKER_MAX_BYTES", 10 * 1024 * 1024))  # 10MB
+WORKER_MAX_LEASE_SECONDS = int(os.environ.get("WORKER_MAX_LEASE_SECONDS", 3600))  # Extensión máxima del plazo de confirmación
+
+# Carriles de ejecución por tipo de archivo y clase de tamaño
+LANE_WORKERS = int(os.environ.get("LANE_WORKERS", 8))  # Hilos compartidos por los carriles de las solicitudes HTTP
+LANE_SMALL_FILE_BYTES = int(os.environ.get("LANE_SMALL_FILE_BYTES", 1024 * 1024))  # 1MB
+LANE_CONCURRENCY = {
+    'audio': {'small': int(os.environ.get("LANE_AUDIO_SMALL", 2)), 'large': int(os.environ.get("LANE_AUDIO_LARGE", 1))},
+    'image': {'small': int(os.environ.get("LANE_IMAGE_SMALL", 4)), 'large': int(os.environ.get("LANE_IMAGE_LARGE", 2))},
+    'text': {'small': int(os.environ.get("LANE_TEXT_SMALL", 4)), 'large': int(os.environ.get("LANE_TEXT_LARGE", 2))},
+    'data': {'small': int(os.environ.get("LANE_DATA_SMALL", 8)), 'large': int(os.environ.get("LANE_DATA_LARGE", 2))},
+    'other': {'small': int(os.environ.get("LANE_OTHER_SMALL", 2)), 'large': int(os.environ.get("LANE_OTHER_LARGE", 1))},
+}
+
+# Servidor de producción con procesos pre-creados (gunicorn)
+SERVER_PORT = int(os.environ.get("PORT", 8080))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 2))  # Procesos de trabajo
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", LANE_WORKERS))  # Hilos por proceso para solicitudes simultáneas
+SERVER_TIMEOUT = int(os.environ.get("SERVER_TIMEOUT", 0))  # Segundos; 0 deja el límite a Cloud Run
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "true").lower() == "true"  # Calienta cada proceso antes de atender
+WARMUP_BIGFRAMES = os.environ.get("WARMUP_BIGFRAMES", "true").lower() == "true"  # Incluye la sesión de BigFrames
+
+# Plazo total por evento, repartido entre las etapas del procesamiento
+PROCESS_DEADLINE_SECONDS = float(os.environ.get("PROCESS_DEADLINE_SECONDS", 540))  # Límite de la plataforma para la solicitud
+DEADLINE_RESERVE_SECONDS = float(os.environ.get("DEADLINE_RESERVE_SECONDS", 20))  # Tiempo reservado para guardar el estado parcial
+DEADLINE_MIN_STAGE_SECONDS = float(os.environ.get("DEADLINE_MIN_STAGE_SECONDS", 5))  # Una etapa con menos tiempo se difiere
+DEADLINE_MAX_DEFERRALS = int(os.environ.get("DEADLINE_MAX_DEFERRALS", 5))  # Aplazamientos antes de enviar a cuarentena
+DEADLINE_STAGE_SECONDS = {
+    'validation': float(os.environ.get("DEADLINE_VALIDATION_SECONDS", 30)),
+    'extraction': float(os.environ.get("DEADLINE_EXTRACTION_SECONDS", 120)),
+    'ocr': float(os.environ.get("DEADLINE_OCR_SECONDS", 60)),
+    'transcription': float(os.environ.get("DEADLINE_TRANSCRIPTION_SECONDS", 480)),
+    'gemini': float(os.environ.get("DEADLINE_GEMINI_SECONDS", 180)),
+    'outputs': float(os.environ.get("DEADLINE_OUTPUTS_SECONDS", 60)),
+    'analysis': float(os.environ.get("DEADLINE_ANALYSIS_SECONDS", 240)),
+}
+
+# Interruptores de circuito por dependencia y cola de archivos diferidos durante caídas
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))  # Fallos consecutivos que abren el interruptor
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", 30))  # Espera antes de la llamada de prueba
+CIRCUIT_MAX_RESET_SECONDS = float(os.environ.get("CIRCUIT_MAX_RESET_SECONDS", 600))
+DEFERRED_DRAIN_ENABLED = os.environ.get("DEFERRED_DRAIN_ENABLED", "true").lower() == "true"
+DEFERRED_DRAIN_INTERVAL = float(os.environ.get("DEFERRED_DRAIN_INTERVAL", 60))  # Segundos entre revisiones de la cola
+DEFERRED_DRAIN_BATCH = int(os.environ.get("DEFERRED_DRAIN_BATCH", 50))  # Archivos reintentados por revisión
+DEFERRED_BASE_BACKOFF_SECONDS = float(os.environ.get("DEFERRED_BASE_BACKOFF_SECONDS", 60))
+DEFERRED_MAX_BACKOFF_SECONDS = float(os.environ.get("DEFERRED_MAX_BACKOFF_SECONDS", 3600))
+DEFERRED_CLAIM_SECONDS = float(os.environ.get("DEFERRED_CLAIM_SECONDS", PROCESS_DEADLINE_SECONDS + 60))  # Reserva de un archivo en reintento
+
+# Reprocesamiento masivo de los archivos en cuarentena
+QUARANTINE_REPROCESS_WORKERS = int(os.environ.get("QUARANTINE_REPROCESS_WORKERS", 8))
+QUARANTINE_REPROCESS_RATE = float(os.environ.get("QUARANTINE_REPROCESS_RATE", 5))  # Archivos por segundo
+QUARANTINE_PERMANENT_REASONS = ['Tipo MIME no soportado', 'Extensión no válida']  # Categorías que no se reintentan por defecto
+
+# Trazas por etapa (duración, bytes y tokens)
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "true").lower() == "true"
+TRACING_EXPORTERS = [name.strip() for name in os.environ.get("TRACING_EXPORTERS", "json,otel").lower().split(",") if name.strip()]  # 'json' y/o 'otel'
+TRACING_JSON_PATH = os.environ.get("TRACING_JSON_PATH", "")  # Vacío: líneas JSON en la salida estándar
+TRACING_SAMPLE_RATE = float(os.environ.get("TRACING_SAMPLE_RATE", 1.0))  # Fracción de archivos trazados
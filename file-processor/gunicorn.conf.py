@@ -0,0 +1,29 @@
+"""
+Configuración de gunicorn para el servidor de producción.
+
+Los módulos (pandas, Vertex AI, BigFrames) se cargan una sola vez en el proceso maestro
+y los procesos de trabajo los heredan al crearse. Cada proceso se calienta antes de
+aceptar solicitudes, de modo que la primera solicitud de una instancia nueva cuesta lo
+mismo que las siguientes.
+"""
+
+import config
+
+bind = f"0.0.0.0:{config.SERVER_PORT}"
+workers = config.SERVER_WORKERS
+threads = config.SERVER_THREADS
+worker_class = "gthread"
+timeout = config.SERVER_TIMEOUT
+graceful_timeout = 30
+preload_app = True
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    """
+    Calienta los clientes del proceso de trabajo después del `fork` y antes de atender.
+    """
+    if not config.WARMUP_ON_START:
+        return
+    import server
+    server.warm_up()
@@ -6,8 +6,6 @@ import logging
 import base64
 import json
 import os
-import pandas as pd
-from google.cloud import storage
 from google.api_core.exceptions import NotFound
 import functions_framework
 
@@ -20,6 +18,27 @@ from utils.data_processor import process_data
 from utils.file_mover import move_to_quarantine
 # Importa el nuevo módulo para el análisis de BigFrames
 from utils.bigframes_processor import analyze_data_with_bigframes
+# Importa la construcción y el guardado de los stacks tipados
+from utils.stack_writer import build_stack_dataframe, save_stack, save_json
+# Importa el conjunto de datos unificado que se actualiza con cada stack
+from utils.unified_dataset import append_to_unified_dataset
+# Importa el índice de identificadores entre archivos
+from utils.identifier_index import index_stack
+# Importa la construcción del reporte de texto inicial
+from utils.report_builder import build_raw_report
+# Importa el backend de almacenamiento configurado (Cloud Storage o disco local)
+from utils.storage_backend import get_storage
+# Importa el planificador con carriles por tipo de archivo y tamaño
+from utils.lane_scheduler import LaneScheduler, file_type_for
+# Importa el plazo por evento y el guardado del estado parcial
+from utils.deadline import Deadline, DeadlineExceeded
+from utils.checkpoint import save_checkpoint
+# Importa los interruptores por dependencia y la cola de archivos diferidos durante caídas
+from utils.circuit_breaker import DependencyUnavailable
+from utils.deferred_queue import defer_file, start_deferred_drainer, DEFERRED_STATUS
+# Importa las trazas por etapa
+from utils import tracing
+import config
 
 # Configuración del registro
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +51,10 @@ PROCESSED_RESULTS_FOLDER = "processed/processed_results/"
 PROCESSED_STACKS_FOLDER = "processed/stacks/"
 PROCESSED_RAW_REPORTS_FOLDER = "processed/raw_reports/"
 FINAL_REPORTS_FOLDER = "final_reports/"
+PARTIAL_STATE_FOLDER = "processed/_partial/"
+
+# Carriles compartidos por las solicitudes HTTP concurrentes
+request_lanes = LaneScheduler(config.LANE_WORKERS, config.LANE_CONCURRENCY, config.LANE_SMALL_FILE_BYTES, name="solicitudes")
 
 
 def _save_as_json(data: dict, file_name: str):
@@ -39,12 +62,8 @@ def _save_as_json(data: dict, file_name: str):
     Guarda los datos procesados como un archivo JSON en Cloud Storage.
     """
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(DESTINATION_BUCKET)
-        blob = bucket.blob(file_name)
-
-        json_string = json.dumps(data)
-        blob.upload_from_string(json_string, content_type='application/json')
+        # Serializa el JSON directamente en la carga, sin construir la cadena completa
+        save_json(data, DESTINATION_BUCKET, file_name)
         logger.info(f"Archivo JSON guardado en: {file_name}")
     except Exception as e:
         logger.error(f"Error al guardar el archivo JSON en {file_name}: {e}")
@@ -53,39 +72,42 @@ def _save_as_json(data: dict, file_name: str):
 
 def _process_and_save_as_csv(json_data: dict, original_file_name: str):
     """
-    Procesa un diccionario JSON y lo convierte a un archivo CSV en Cloud Storage.
+    Procesa un diccionario JSON y lo guarda como stack (CSV y/o Parquet) en Cloud Storage.
+
+    Returns:
+        tuple: La ruta del stack guardado y el DataFrame ya tipado, o (None, None) si no
+        se pudo crear el DataFrame.
     """
     try:
-        if isinstance(json_data, dict) and 'dataframe_package' in json_data and 'data' in json_data['dataframe_package']:
-            table_data = json_data['dataframe_package']['data']
-            if not table_data:
-                logger.warning(f"La estructura 'dataframe_package' está vacía después de la limpieza para el archivo {original_file_name}. No se puede crear el DataFrame.")
-                return None
-            
-            df = pd.DataFrame.from_dict(table_data)
-        elif isinstance(json_data, list):
-            df = pd.DataFrame(json_data)
-        elif isinstance(json_data, dict) and 'data' in json_data:
-            df = pd.DataFrame.from_dict(json_data['data'])
-        else:
-            logger.warning(f"Estructura JSON no reconocida para el archivo {original_file_name}. No se puede crear el DataFrame.")
-            return None
+        df = build_stack_dataframe(json_data, original_file_name)
+        if df is None:
+            return None, None
 
         logger.info(f"DataFrame creado con {df.shape[0]} filas y {df.shape[1]} columnas.")
 
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(DESTINATION_BUCKET)
-
         base_name = os.path.basename(original_file_name)
         base_name_without_ext = os.path.splitext(base_name)[0]
-        destination_blob_name = f"{PROCESSED_STACKS_FOLDER}{base_name_without_ext}.csv"
 
-        csv_string = df.to_csv(index=False)
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_string(csv_string, content_type='text/csv')
+        # Guarda el stack en los formatos configurados (Parquet y/o CSV)
+        destination_blob_name = save_stack(df, DESTINATION_BUCKET, f"{PROCESSED_STACKS_FOLDER}{base_name_without_ext}")
 
-        logger.info(f"DataFrame convertido y guardado como CSV en: {destination_blob_name}")
-        return destination_blob_name
+        logger.info(f"DataFrame convertido y guardado en: {destination_blob_name}")
+
+        # Guarda el stack como parte pendiente del conjunto unificado; un fallo aquí no detiene el procesamiento
+        if config.UNIFIED_DATASET_ENABLED:
+            try:
+                append_to_unified_dataset(DESTINATION_BUCKET, df, base_name_without_ext)
+            except Exception as e:
+                logger.error(f"No se pudo agregar el stack de {original_file_name} al conjunto unificado: {e}")
+
+        # Indexa los identificadores del stack para las búsquedas entre archivos
+        if config.IDENTIFIER_INDEX_ENABLED:
+            try:
+                index_stack(DESTINATION_BUCKET, df, destination_blob_name)
+            except Exception as e:
+                logger.error(f"No se pudieron indexar los identificadores de {original_file_name}: {e}")
+
+        return destination_blob_name, df
 
     except Exception as e:
         logger.error(f"Error en la conversión y guardado del DataFrame para {original_file_name}: {e}")
@@ -101,38 +123,116 @@ def _save_text_report(json_data: dict, original_file_name: str, report_content:
         if report_content:
             report_to_save = report_content
             folder = FINAL_REPORTS_FOLDER
-        elif 'generated_report' in json_data and 'findings' in json_data.get('generated_report', {}):
-            report_data = json_data['generated_report']
-            findings_data = report_data['findings']
-            report_to_save = (
-                f"Tipo de Reporte: {report_data.get('report_type', 'N/A')}\n"
-                "--------------------------------------\n"
-                "Observaciones:\n"
-                f"{findings_data.get('observations', 'No hay observaciones.')}\n\n"
-                "Puntos Clave:\n"
-            )
-            key_points = findings_data.get('key_points', [])
-            report_to_save += "\n".join([f"- {point}" for point in key_points]) if key_points else "No se encontraron puntos clave.\n"
-            folder = PROCESSED_RAW_REPORTS_FOLDER
         else:
+            report_to_save = build_raw_report(json_data)
+            folder = PROCESSED_RAW_REPORTS_FOLDER
+
+        if not report_to_save:
             logger.warning(f"El JSON no contiene las claves 'generated_report' o 'findings' y no se proporcionó un reporte para el archivo {original_file_name}.")
             return
 
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(DESTINATION_BUCKET)
-
         base_name = os.path.basename(original_file_name)
         base_name_without_ext = os.path.splitext(base_name)[0]
         destination_blob_name = f"{folder}{base_name_without_ext}_report.txt"
 
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_string(report_to_save, content_type='text/plain')
+        get_storage().write(DESTINATION_BUCKET, destination_blob_name, report_to_save, content_type='text/plain')
         logger.info(f"Informe de texto guardado en: {destination_blob_name}")
     except Exception as e:
         logger.error(f"Error al guardar el informe de texto para {original_file_name}: {e}")
         raise
 
 
+def _partial_state_blob_name(bucket_name: str, file_name: str) -> str:
+    return f"{PARTIAL_STATE_FOLDER}{bucket_name}/{file_name}.json"
+
+
+def _load_partial_state(blob_name: str) -> dict:
+    """
+    Carga el estado parcial guardado por un intento anterior que agotó su plazo.
+    """
+    try:
+        state = json.loads(get_storage().read_text(DESTINATION_BUCKET, blob_name))
+    except NotFound:
+        return {}
+    logger.info(f"Reanudando desde el estado parcial {blob_name} (etapa '{state.get('stage')}').")
+    return state
+
+
+def _clear_partial_state(blob_name: str):
+    try:
+        get_storage().delete(DESTINATION_BUCKET, blob_name)
+    except NotFound:
+        pass
+
+
+def _defer(bucket_name: str, file_name: str, partial_blob_name: str, partial: dict, error: DeadlineExceeded,
+           redelivery: bool = False):
+    """
+    Guarda el estado parcial de un archivo cuyo plazo se agotó. Si quien llama vuelve a
+    entregar el evento (Pub/Sub), retorna 503; si no, agrega el archivo a la cola de
+    diferidos y retorna 202. Tras `DEADLINE_MAX_DEFERRALS` aplazamientos, el archivo se
+    envía a cuarentena.
+    """
+    state = {**partial, **error.partial, 'stage': error.stage, 'deferrals': partial.get('deferrals', 0) + 1}
+    if state['deferrals'] > config.DEADLINE_MAX_DEFERRALS:
+        logger.error(f"{file_name} agotó su plazo {state['deferrals']} veces en la etapa '{error.stage}'.")
+        _clear_partial_state(partial_blob_name)
+        move_to_quarantine(bucket_name, file_name, f"Plazo agotado repetidamente en la etapa '{error.stage}'", DESTINATION_BUCKET)
+        return (f"Error de procesamiento: {error}", 500)
+
+    _save_partial_state(file_name, partial_blob_name, state)
+    logger.warning(f"{error} Se difiere {file_name} (aplazamiento {state['deferrals']}).")
+    if redelivery:
+        return (f"Deferred: {error}", 503)
+    try:
+        # Sin reentrega de Pub/Sub, la cola de diferidos es la que retoma el archivo
+        defer_file(bucket_name, file_name, None, str(error))
+    except Exception as e:
+        logger.error(f"No se pudo diferir {file_name}: {e}")
+        return (f"Deferred: {error}", 503)
+    return (f"Deferred: {error}", DEFERRED_STATUS)
+
+
+def _save_partial_state(file_name: str, blob_name: str, state: dict):
+    try:
+        save_checkpoint(DESTINATION_BUCKET, blob_name, state)
+    except Exception as e:
+        logger.error(f"No se pudo guardar el estado parcial de {file_name}: {e}")
+
+
+def _park(bucket_name: str, file_name: str, partial_blob_name: str, partial: dict, error: DependencyUnavailable):
+    """
+    Envía a la cola de diferidos un archivo cuya dependencia no está disponible, en lugar
+    de ponerlo en cuarentena. El estado parcial alcanzado se guarda para reanudarlo.
+    """
+    if error.partial:
+        _save_partial_state(file_name, partial_blob_name, {**partial, **error.partial, 'stage': error.dependency})
+    try:
+        defer_file(bucket_name, file_name, error.dependency, str(error), error.retry_after)
+    except Exception as e:
+        # Sin la cola, el reintento queda a cargo de Pub/Sub
+        logger.error(f"No se pudo diferir {file_name}: {e}")
+        return (f"Deferred: {error}", 503)
+    return (f"Deferred: {error}", DEFERRED_STATUS)
+
+
+def parse_storage_event(data) -> tuple:
+    """
+    Extrae el bucket y el nombre del archivo de una notificación de Cloud Storage.
+
+    Args:
+        data (bytes | str): El contenido del mensaje de Pub/Sub, ya decodificado de base64.
+
+    Returns:
+        tuple: (bucket_name, file_name, size); cualquiera puede ser None si falta.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    cloud_storage_event = json.loads(data)
+    size = cloud_storage_event.get('size')
+    return cloud_storage_event.get('bucket'), cloud_storage_event.get('name'), int(size) if size is not None else None
+
+
 @functions_framework.http
 def file_processor(request):
     """
@@ -149,13 +249,9 @@ def file_processor(request):
             logger.error("Error: El mensaje de Pub/Sub no contiene datos.")
             return ('Bad Request: Missing data in Pub/Sub message', 400)
 
-        decoded_data = base64.b64decode(message_data).decode('utf-8')
-        cloud_storage_event = json.loads(decoded_data)
-
-        bucket_name = cloud_storage_event.get('bucket')
-        file_name = cloud_storage_event.get('name')
+        bucket_name, file_name, file_size = parse_storage_event(base64.b64decode(message_data))
 
-    except (KeyError, json.JSONDecodeError, TypeError) as e:
+    except (KeyError, json.JSONDecodeError, TypeError, ValueError) as e:
         logger.error(f"Error fatal al procesar el evento de Cloud Storage: {e}")
         return ('Bad Request: Failed to parse event', 400)
 
@@ -163,69 +259,115 @@ def file_processor(request):
         logger.error("Faltan datos esenciales del evento (bucket o nombre del archivo).")
         return ('Bad Request: Missing essential data', 400)
 
-    return process_file(bucket_name, file_name)
+    # Los archivos diferidos por caídas se reintentan en segundo plano en este proceso
+    start_deferred_drainer(process_file, request_lanes)
 
+    # El plazo comienza al recibir el evento e incluye la espera en el carril
+    deadline = Deadline(config.PROCESS_DEADLINE_SECONDS)
+    # Cada solicitud espera su turno en el carril de su tipo de archivo y tamaño
+    return request_lanes.run(file_type_for(file_name), file_size, process_file, bucket_name, file_name, deadline, True)
 
-def process_file(bucket_name, file_name):
+
+@tracing.traced('process_file', result_attributes=lambda result: {'status_code': result[1]})
+def process_file(bucket_name, file_name, deadline=None, redelivery: bool = False):
     """
     Función auxiliar para procesar el archivo.
+
+    Args:
+        bucket_name (str): Nombre del bucket.
+        file_name (str): Nombre del archivo.
+        deadline (Deadline): Plazo del evento (opcional). Si una etapa no puede terminar a
+            tiempo, su estado parcial se guarda y el siguiente intento continúa desde ese punto.
+        redelivery (bool): Indica que quien llama vuelve a entregar el evento cuando se
+            retorna 503 (Pub/Sub). Sin reentrega, el archivo aplazado se agrega a la cola
+            de diferidos y se retorna 202.
     """
     if file_name.endswith('/') or file_name.startswith('quarantine/'):
         logger.info(f"Omitiendo evento para: {file_name}")
         return ('OK', 200)
 
     logger.info(f"Iniciando el procesamiento del archivo: {file_name} del bucket {bucket_name}")
+    tracing.set_attributes({'file.bucket': bucket_name, 'file.name': file_name})
+
+    deadline = deadline or Deadline(config.PROCESS_DEADLINE_SECONDS)
+    partial_blob_name = _partial_state_blob_name(bucket_name, file_name)
+    partial = {}
 
     try:
-        file_info = validate_file(bucket_name, file_name)
-
-        if not file_info['valid']:
-            logger.warning(f"Archivo inválido: {file_name}. Razón: {file_info['reason']}")
-            move_to_quarantine(bucket_name, file_name, file_info['reason'], DESTINATION_BUCKET)
-            return ('OK', 200)
-
-        processed_data_json = None
-        if file_info['file_type'] == 'audio':
-            processed_data_json = process_audio(bucket_name, file_name, file_info)
-        elif file_info['file_type'] == 'image':
-            extracted_text = process_image(bucket_name, file_name, file_info)
-            if extracted_text:
-                processed_data_json = process_data(bucket_name, file_name, file_info, text_content=extracted_text)
-            else:
-                logger.warning(f"No se extrajo texto de la imagen {file_name}.")
-                move_to_quarantine(bucket_name, file_name, "No se pudo extraer texto de la imagen", DESTINATION_BUCKET)
+        partial = _load_partial_state(partial_blob_name)
+        processed_data_json = partial.get('result')
+        if partial:
+            tracing.set_attributes({'resumed_from': partial.get('stage')})
+
+        if processed_data_json is None:
+            deadline.check('validation')
+            with tracing.span('validation'):
+                file_info = validate_file(bucket_name, file_name)
+            tracing.set_attributes({'file.type': file_info.get('file_type')})
+
+            if not file_info['valid']:
+                logger.warning(f"Archivo inválido: {file_name}. Razón: {file_info['reason']}")
+                move_to_quarantine(bucket_name, file_name, file_info['reason'], DESTINATION_BUCKET)
                 return ('OK', 200)
-        elif file_info['file_type'] in ['text', 'data']:
-            processed_data_json = process_data(bucket_name, file_name, file_info)
-        else:
-            raise ValueError(f"Tipo de archivo no manejado: {file_info['file_type']}")
+
+            if file_info['file_type'] == 'audio':
+                processed_data_json = process_audio(
+                    bucket_name, file_name, file_info, deadline=deadline, operation_name=partial.get('operation')
+                )
+            elif file_info['file_type'] == 'image':
+                extracted_text = partial.get('text') or process_image(bucket_name, file_name, file_info, deadline=deadline)
+                if extracted_text:
+                    processed_data_json = process_data(bucket_name, file_name, file_info, text_content=extracted_text, deadline=deadline)
+                else:
+                    logger.warning(f"No se extrajo texto de la imagen {file_name}.")
+                    move_to_quarantine(bucket_name, file_name, "No se pudo extraer texto de la imagen", DESTINATION_BUCKET)
+                    return ('OK', 200)
+            elif file_info['file_type'] in ['text', 'data']:
+                processed_data_json = process_data(bucket_name, file_name, file_info, text_content=partial.get('text'), deadline=deadline)
+            else:
+                raise ValueError(f"Tipo de archivo no manejado: {file_info['file_type']}")
 
         if processed_data_json:
-            json_file_name = f"{PROCESSED_RESULTS_FOLDER}{os.path.splitext(os.path.basename(file_name))[0]}.json"
-            _save_as_json(processed_data_json, json_file_name)
-            
-            # Crea el archivo CSV y obtén su ruta
-            csv_file_path = _process_and_save_as_csv(processed_data_json, file_name)
+            if partial.get('outputs_saved'):
+                # Un intento anterior ya guardó las salidas; solo falta el análisis
+                csv_file_path, stack_df = partial.get('stack'), None
+            else:
+                deadline.check('outputs', {'result': processed_data_json})
+                with tracing.span('outputs'):
+                    json_file_name = f"{PROCESSED_RESULTS_FOLDER}{os.path.splitext(os.path.basename(file_name))[0]}.json"
+                    _save_as_json(processed_data_json, json_file_name)
+                    
+                    # Crea el stack y obtén su ruta junto con el DataFrame ya tipado
+                    csv_file_path, stack_df = _process_and_save_as_csv(processed_data_json, file_name)
 
-            # Guarda el reporte inicial del JSON
-            _save_text_report(processed_data_json, file_name)
+                    # Guarda el reporte inicial del JSON
+                    _save_text_report(processed_data_json, file_name)
 
             # Si el CSV se creó exitosamente, realiza el análisis avanzado con BigFrames
             if csv_file_path:
-                bigframes_report_content = analyze_data_with_bigframes(csv_file_path)
-                # Vuelve a guardar el reporte final en la carpeta correcta
-                _save_text_report(processed_data_json, file_name, report_content=bigframes_report_content)
+                analysis_partial = {'result': processed_data_json, 'outputs_saved': True, 'stack': csv_file_path}
+                with tracing.span('analysis'):
+                    try:
+                        # El DataFrame se entrega en memoria; el stack guardado es solo una salida
+                        bigframes_report_content = analyze_data_with_bigframes(csv_file_path, dataframe=stack_df, deadline=deadline)
+                    except (DeadlineExceeded, DependencyUnavailable) as e:
+                        raise e.with_partial(analysis_partial) from e
+                    # Vuelve a guardar el reporte final en la carpeta correcta
+                    _save_text_report(processed_data_json, file_name, report_content=bigframes_report_content)
 
             # El archivo original debe ser borrado al final del proceso
-            storage_client = storage.Client()
-            source_bucket = storage_client.bucket(bucket_name)
-            source_blob = source_bucket.blob(file_name)
-            source_blob.delete()
+            get_storage().delete(bucket_name, file_name)
             logger.info(f"Archivo original eliminado: {file_name}")
 
+        if partial:
+            _clear_partial_state(partial_blob_name)
         logger.info(f"Procesamiento completado para: {file_name}")
         return ('OK', 200)
 
+    except DeadlineExceeded as e:
+        return _defer(bucket_name, file_name, partial_blob_name, partial, e, redelivery)
+    except DependencyUnavailable as e:
+        return _park(bucket_name, file_name, partial_blob_name, partial, e)
     except NotFound:
         logger.warning(f"Archivo no encontrado en el bucket de origen: {file_name}. Probablemente ya fue procesado.")
         return ('OK', 200)
@@ -248,32 +390,19 @@ def _save_text_report(json_data: dict, original_file_name: str, report_content:
         if report_content:
             report_to_save = report_content
             folder = FINAL_REPORTS_FOLDER
-        elif 'generated_report' in json_data and 'findings' in json_data.get('generated_report', {}):
-            report_data = json_data['generated_report']
-            findings_data = report_data['findings']
-            report_to_save = (
-                f"Tipo de Reporte: {report_data.get('report_type', 'N/A')}\n"
-                "--------------------------------------\n"
-                "Observaciones:\n"
-                f"{findings_data.get('observations', 'No hay observaciones.')}\n\n"
-                "Puntos Clave:\n"
-            )
-            key_points = findings_data.get('key_points', [])
-            report_to_save += "\n".join([f"- {point}" for point in key_points]) if key_points else "No se encontraron puntos clave.\n"
-            folder = PROCESSED_RAW_REPORTS_FOLDER
         else:
+            report_to_save = build_raw_report(json_data)
+            folder = PROCESSED_RAW_REPORTS_FOLDER
+
+        if not report_to_save:
             logger.warning(f"El JSON no contiene las claves 'generated_report' o 'findings' y no se proporcionó un reporte para el archivo {original_file_name}.")
             return
 
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(DESTINATION_BUCKET)
-
         base_name = os.path.basename(original_file_name)
         base_name_without_ext = os.path.splitext(base_name)[0]
         destination_blob_name = f"{folder}{base_name_without_ext}_report.txt"
 
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_string(report_to_save, content_type='text/plain')
+        get_storage().write(DESTINATION_BUCKET, destination_blob_name, report_to_save, content_type='text/plain')
         logger.info(f"Informe de texto guardado en: {destination_blob_name}")
     except Exception as e:
         logger.error(f"Error al guardar el informe de texto para {original_file_name}: {e}")
@@ -296,13 +425,9 @@ def file_processor(request):
             logger.error("Error: El mensaje de Pub/Sub no contiene datos.")
             return ('Bad Request: Missing data in Pub/Sub message', 400)
 
-        decoded_data = base64.b64decode(message_data).decode('utf-8')
-        cloud_storage_event = json.loads(decoded_data)
-
-        bucket_name = cloud_storage_event.get('bucket')
-        file_name = cloud_storage_event.get('name')
+        bucket_name, file_name, file_size = parse_storage_event(base64.b64decode(message_data))
 
-    except (KeyError, json.JSONDecodeError, TypeError) as e:
+    except (KeyError, json.JSONDecodeError, TypeError, ValueError) as e:
         logger.error(f"Error fatal al procesar el evento de Cloud Storage: {e}")
         return ('Bad Request: Failed to parse event', 400)
 
@@ -310,69 +435,115 @@ def file_processor(request):
         logger.error("Faltan datos esenciales del evento (bucket o nombre del archivo).")
         return ('Bad Request: Missing essential data', 400)
 
-    return process_file(bucket_name, file_name)
+    # Los archivos diferidos por caídas se reintentan en segundo plano en este proceso
+    start_deferred_drainer(process_file, request_lanes)
 
+    # El plazo comienza al recibir el evento e incluye la espera en el carril
+    deadline = Deadline(config.PROCESS_DEADLINE_SECONDS)
+    # Cada solicitud espera su turno en el carril de su tipo de archivo y tamaño
+    return request_lanes.run(file_type_for(file_name), file_size, process_file, bucket_name, file_name, deadline, True)
 
-def process_file(bucket_name, file_name):
+
+@tracing.traced('process_file', result_attributes=lambda result: {'status_code': result[1]})
+def process_file(bucket_name, file_name, deadline=None, redelivery: bool = False):
     """
     Función auxiliar para procesar el archivo.
+
+    Args:
+        bucket_name (str): Nombre del bucket.
+        file_name (str): Nombre del archivo.
+        deadline (Deadline): Plazo del evento (opcional). Si una etapa no puede terminar a
+            tiempo, su estado parcial se guarda y el siguiente intento continúa desde ese punto.
+        redelivery (bool): Indica que quien llama vuelve a entregar el evento cuando se
+            retorna 503 (Pub/Sub). Sin reentrega, el archivo aplazado se agrega a la cola
+            de diferidos y se retorna 202.
     """
     if file_name.endswith('/') or file_name.startswith('quarantine/'):
         logger.info(f"Omitiendo evento para: {file_name}")
         return ('OK', 200)
 
     logger.info(f"Iniciando el procesamiento del archivo: {file_name} del bucket {bucket_name}")
+    tracing.set_attributes({'file.bucket': bucket_name, 'file.name': file_name})
+
+    deadline = deadline or Deadline(config.PROCESS_DEADLINE_SECONDS)
+    partial_blob_name = _partial_state_blob_name(bucket_name, file_name)
+    partial = {}
 
     try:
-        file_info = validate_file(bucket_name, file_name)
-
-        if not file_info['valid']:
-            logger.warning(f"Archivo inválido: {file_name}. Razón: {file_info['reason']}")
-            move_to_quarantine(bucket_name, file_name, file_info['reason'], DESTINATION_BUCKET)
-            return ('OK', 200)
-
-        processed_data_json = None
-        if file_info['file_type'] == 'audio':
-            processed_data_json = process_audio(bucket_name, file_name, file_info)
-        elif file_info['file_type'] == 'image':
-            extracted_text = process_image(bucket_name, file_name, file_info)
-            if extracted_text:
-                processed_data_json = process_data(bucket_name, file_name, file_info, text_content=extracted_text)
-            else:
-                logger.warning(f"No se extrajo texto de la imagen {file_name}.")
-                move_to_quarantine(bucket_name, file_name, "No se pudo extraer texto de la imagen", DESTINATION_BUCKET)
+        partial = _load_partial_state(partial_blob_name)
+        processed_data_json = partial.get('result')
+        if partial:
+            tracing.set_attributes({'resumed_from': partial.get('stage')})
+
+        if processed_data_json is None:
+            deadline.check('validation')
+            with tracing.span('validation'):
+                file_info = validate_file(bucket_name, file_name)
+            tracing.set_attributes({'file.type': file_info.get('file_type')})
+
+            if not file_info['valid']:
+                logger.warning(f"Archivo inválido: {file_name}. Razón: {file_info['reason']}")
+                move_to_quarantine(bucket_name, file_name, file_info['reason'], DESTINATION_BUCKET)
                 return ('OK', 200)
-        elif file_info['file_type'] in ['text', 'data']:
-            processed_data_json = process_data(bucket_name, file_name, file_info)
-        else:
-            raise ValueError(f"Tipo de archivo no manejado: {file_info['file_type']}")
+
+            if file_info['file_type'] == 'audio':
+                processed_data_json = process_audio(
+                    bucket_name, file_name, file_info, deadline=deadline, operation_name=partial.get('operation')
+                )
+            elif file_info['file_type'] == 'image':
+                extracted_text = partial.get('text') or process_image(bucket_name, file_name, file_info, deadline=deadline)
+                if extracted_text:
+                    processed_data_json = process_data(bucket_name, file_name, file_info, text_content=extracted_text, deadline=deadline)
+                else:
+                    logger.warning(f"No se extrajo texto de la imagen {file_name}.")
+                    move_to_quarantine(bucket_name, file_name, "No se pudo extraer texto de la imagen", DESTINATION_BUCKET)
+                    return ('OK', 200)
+            elif file_info['file_type'] in ['text', 'data']:
+                processed_data_json = process_data(bucket_name, file_name, file_info, text_content=partial.get('text'), deadline=deadline)
+            else:
+                raise ValueError(f"Tipo de archivo no manejado: {file_info['file_type']}")
 
         if processed_data_json:
-            json_file_name = f"{PROCESSED_RESULTS_FOLDER}{os.path.splitext(os.path.basename(file_name))[0]}.json"
-            _save_as_json(processed_data_json, json_file_name)
-            
-            # Crea el archivo CSV y obtén su ruta
-            csv_file_path = _process_and_save_as_csv(processed_data_json, file_name)
+            if partial.get('outputs_saved'):
+                # Un intento anterior ya guardó las salidas; solo falta el análisis
+                csv_file_path, stack_df = partial.get('stack'), None
+            else:
+                deadline.check('outputs', {'result': processed_data_json})
+                with tracing.span('outputs'):
+                    json_file_name = f"{PROCESSED_RESULTS_FOLDER}{os.path.splitext(os.path.basename(file_name))[0]}.json"
+                    _save_as_json(processed_data_json, json_file_name)
+                    
+                    # Crea el stack y obtén su ruta junto con el DataFrame ya tipado
+                    csv_file_path, stack_df = _process_and_save_as_csv(processed_data_json, file_name)
 
-            # Guarda el reporte inicial del JSON
-            _save_text_report(processed_data_json, file_name)
+                    # Guarda el reporte inicial del JSON
+                    _save_text_report(processed_data_json, file_name)
 
             # Si el CSV se creó exitosamente, realiza el análisis avanzado con BigFrames
             if csv_file_path:
-                bigframes_report_content = analyze_data_with_bigframes(csv_file_path)
-                # Vuelve a guardar el reporte final en la carpeta correcta
-                _save_text_report(processed_data_json, file_name, report_content=bigframes_report_content)
+                analysis_partial = {'result': processed_data_json, 'outputs_saved': True, 'stack': csv_file_path}
+                with tracing.span('analysis'):
+                    try:
+                        # El DataFrame se entrega en memoria; el stack guardado es solo una salida
+                        bigframes_report_content = analyze_data_with_bigframes(csv_file_path, dataframe=stack_df, deadline=deadline)
+                    except (DeadlineExceeded, DependencyUnavailable) as e:
+                        raise e.with_partial(analysis_partial) from e
+                    # Vuelve a guardar el reporte final en la carpeta correcta
+                    _save_text_report(processed_data_json, file_name, report_content=bigframes_report_content)
 
             # El archivo original debe ser borrado al final del proceso
-            storage_client = storage.Client()
-            source_bucket = storage_client.bucket(bucket_name)
-            source_blob = source_bucket.blob(file_name)
-            source_blob.delete()
+            get_storage().delete(bucket_name, file_name)
             logger.info(f"Archivo original eliminado: {file_name}")
 
+        if partial:
+            _clear_partial_state(partial_blob_name)
         logger.info(f"Procesamiento completado para: {file_name}")
         return ('OK', 200)
 
+    except DeadlineExceeded as e:
+        return _defer(bucket_name, file_name, partial_blob_name, partial, e, redelivery)
+    except DependencyUnavailable as e:
+        return _park(bucket_name, file_name, partial_blob_name, partial, e)
     except NotFound:
         logger.warning(f"Archivo no encontrado en el bucket de origen: {file_name}. Probablemente ya fue procesado.")
         return ('OK', 200)
@@ -0,0 +1,238 @@
+"""
+Reprocesamiento masivo de los archivos en cuarentena.
+
+Lista `quarantine/`, agrupa los objetos por la categoría del motivo guardada en sus
+metadatos y vuelve a procesar con `process_file` los de las categorías elegidas. Cada
+archivo se mueve a una copia de trabajo en `REPROCESS_FOLDER` del mismo bucket y se
+procesa desde ahí; si vuelve a fallar, `process_file` lo devuelve a la cuarentena con el
+motivo nuevo y se conserva su ubicación original.
+
+Los reintentos se ejecutan en paralelo con los carriles por tipo de archivo y a una tasa
+máxima de archivos por segundo. Con `--dry-run` solo se genera el reporte de los grupos.
+
+Los archivos en cuarentena anteriores a los metadatos no tienen motivo ni ubicación
+original: se agrupan en 'Sin motivo registrado' y se registran con la ubicación de
+`--source-bucket` bajo `--source-prefix`.
+
+Los archivos no se restauran en el bucket de origen: su notificación generaría un evento
+y el archivo se procesaría dos veces, una por el evento y otra por este reprocesamiento.
+
+Uso:
+    python reprocess_quarantine.py --dry-run
+    python reprocess_quarantine.py --reason "Error de procesamiento" --rate 10
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+
+import config
+from main import process_file, DESTINATION_BUCKET
+from utils.file_mover import QUARANTINE_FOLDER, reason_category
+from utils.storage_backend import get_storage
+from utils.lane_scheduler import LaneScheduler, file_type_for
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_PER_GROUP = 5
+# Copias de trabajo de los archivos en reprocesamiento, fuera del bucket de origen
+REPROCESS_FOLDER = "_reprocess/"
+
+
+class _RateLimiter:
+    """
+    Espacia las llamadas para no superar `rate` por segundo.
+    """
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self._interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _origin(info, source_bucket: str, source_prefix: str) -> tuple:
+    """
+    Retorna el bucket y la ruta original de un objeto en cuarentena.
+    """
+    metadata = info.metadata or {}
+    if metadata.get('original_bucket') and metadata.get('original_name'):
+        return metadata['original_bucket'], metadata['original_name']
+    return source_bucket, f"{source_prefix}{os.path.basename(info.name)}"
+
+
+def list_quarantine(bucket_name: str) -> dict:
+    """
+    Agrupa los objetos en cuarentena por la categoría de su motivo.
+
+    Returns:
+        dict: categoría -> lista de `ObjectInfo`.
+    """
+    groups = {}
+    for info in get_storage().list(bucket_name, prefix=QUARANTINE_FOLDER):
+        if info.name.endswith('/'):
+            continue
+        metadata = info.metadata or {}
+        category = metadata.get('quarantine_category') or reason_category(metadata.get('quarantine_reason'))
+        groups.setdefault(category, []).append(info)
+    return groups
+
+
+def _is_eligible(category: str, reasons: list) -> bool:
+    if reasons:
+        return category in reasons
+    return category not in config.QUARANTINE_PERMANENT_REASONS
+
+
+def _stage(bucket_name: str, info, origin_bucket: str, origin_name: str) -> str:
+    """
+    Mueve un archivo de la cuarentena a su copia de trabajo. Retorna None si la copia ya
+    existe (otro reprocesamiento del archivo sigue en curso o quedó diferido).
+    """
+    staged_name = f"{REPROCESS_FOLDER}{origin_bucket}/{origin_name}"
+    if get_storage().exists(bucket_name, staged_name):
+        logger.warning(f"No se reprocesó {info.name}: ya existe la copia de trabajo {staged_name}.")
+        return None
+    get_storage().copy(bucket_name, info.name, bucket_name, staged_name)
+    get_storage().delete(bucket_name, info.name)
+    return staged_name
+
+
+def _keep_origin(staged_name: str, origin_bucket: str, origin_name: str):
+    """
+    Si el archivo volvió a la cuarentena, reemplaza en sus metadatos la copia de trabajo
+    por la ubicación original.
+    """
+    quarantined_name = f"{QUARANTINE_FOLDER}{os.path.basename(staged_name)}"
+    info = get_storage().metadata(DESTINATION_BUCKET, quarantined_name)
+    if info is None or (info.metadata or {}).get('original_name') != staged_name:
+        return
+    get_storage().update_metadata(
+        DESTINATION_BUCKET, quarantined_name, {'original_bucket': origin_bucket, 'original_name': origin_name}
+    )
+
+
+def reprocess_quarantine(bucket_name: str = DESTINATION_BUCKET, reasons: list = None, dry_run: bool = False,
+                         workers: int = None, rate: float = None, max_files: int = None, max_seconds: float = None,
+                         source_bucket: str = None, source_prefix: str = None) -> dict:
+    """
+    Vuelve a procesar los archivos en cuarentena de las categorías elegidas.
+
+    Args:
+        bucket_name (str): Bucket cuya carpeta `quarantine/` se revisa.
+        reasons (list): Categorías a reprocesar. Sin ellas, todas menos las de
+            `config.QUARANTINE_PERMANENT_REASONS`.
+        dry_run (bool): Solo genera el reporte, sin mover ni procesar archivos.
+        workers (int): Hilos de trabajo repartidos entre los carriles (opcional).
+        rate (float): Máximo de archivos iniciados por segundo (opcional).
+        max_files (int): Máximo de archivos a reprocesar en esta ejecución (opcional).
+        max_seconds (float): Deja de iniciar archivos tras este tiempo; los ya iniciados
+            terminan (opcional).
+        source_bucket (str): Bucket de origen de los archivos sin metadatos (opcional).
+        source_prefix (str): Carpeta de origen de los archivos sin metadatos (opcional).
+
+    Returns:
+        dict: El reporte por categoría.
+    """
+    workers = workers or config.QUARANTINE_REPROCESS_WORKERS
+    rate = config.QUARANTINE_REPROCESS_RATE if rate is None else rate
+    source_bucket = source_bucket or config.BUCKET_NAME
+    source_prefix = config.PATHS['raw_storage'] if source_prefix is None else source_prefix
+
+    groups = list_quarantine(bucket_name)
+    report = {}
+    for category, infos in sorted(groups.items(), key=lambda item: -len(item[1])):
+        report[category] = {
+            'files': len(infos),
+            'bytes': sum(info.size or 0 for info in infos),
+            'eligible': _is_eligible(category, reasons),
+            'samples': [
+                {'name': info.name, 'reason': (info.metadata or {}).get('quarantine_reason')}
+                for info in infos[:SAMPLES_PER_GROUP]
+            ],
+        }
+    if dry_run:
+        return report
+
+    lanes = LaneScheduler(workers, config.LANE_CONCURRENCY, config.LANE_SMALL_FILE_BYTES, name="cuarentena")
+    limiter = _RateLimiter(rate)
+    lock = threading.Lock()
+    # Acota los archivos restaurados y aún sin terminar
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def _run(category: str, staged_name: str, origin_bucket: str, origin_name: str):
+        outcome = 'failed'
+        try:
+            _, status = process_file(bucket_name, staged_name)
+            outcome = {200: 'processed', 202: 'deferred'}.get(status, 'failed')
+            # Un archivo inválido vuelve a la cuarentena aunque el estado sea 200
+            _keep_origin(staged_name, origin_bucket, origin_name)
+        except Exception as e:
+            logger.error(f"Error no controlado al reprocesar {origin_name}: {e}")
+        finally:
+            with lock:
+                outcomes = report[category].setdefault('outcomes', {})
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            slots.release()
+
+    started_at = time.monotonic()
+    submitted = 0
+    try:
+        for category, infos in groups.items():
+            if not report[category]['eligible']:
+                continue
+            for info in infos:
+                if max_files is not None and submitted >= max_files:
+                    break
+                if max_seconds is not None and time.monotonic() - started_at >= max_seconds:
+                    break
+                slots.acquire()
+                limiter.wait()
+                origin_bucket, origin_name = _origin(info, source_bucket, source_prefix)
+                try:
+                    staged_name = _stage(bucket_name, info, origin_bucket, origin_name)
+                except Exception as e:
+                    logger.error(f"No se pudo preparar {info.name} para reprocesarlo: {e}")
+                    staged_name = None
+                if staged_name is None:
+                    slots.release()
+                    with lock:
+                        outcomes = report[category].setdefault('outcomes', {})
+                        outcomes['not_staged'] = outcomes.get('not_staged', 0) + 1
+                    continue
+                lanes.submit(file_type_for(origin_name), info.size, _run, category, staged_name, origin_bucket, origin_name)
+                submitted += 1
+    finally:
+        lanes.shutdown(wait=True)
+
+    logger.info(f"Reprocesamiento de la cuarentena terminado: {submitted} archivo(s) en {time.monotonic() - started_at:.0f}s.")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vuelve a procesar los archivos en cuarentena, agrupados por motivo.")
+    parser.add_argument("--bucket", default=DESTINATION_BUCKET)
+    parser.add_argument("--reason", action="append", dest="reasons", help="Categoría a reprocesar; se puede repetir.")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rate", type=float, default=None, help="Archivos por segundo; 0 sin límite.")
+    parser.add_argument("--max-files", type=int, default=None)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("--source-bucket", default=None)
+    parser.add_argument("--source-prefix", default=None)
+    args = parser.parse_args()
+    result = reprocess_quarantine(
+        args.bucket, args.reasons, args.dry_run, args.workers, args.rate, args.max_files, args.max_seconds,
+        args.source_bucket, args.source_prefix,
+    )
+    print(json.dumps(result, indent=2, ensure_ascii=False))
@@ -0,0 +1,102 @@
+"""
+Aplicación HTTP para el servidor de producción (gunicorn).
+
+Expone `file_processor` en la ruta raíz, igual que `functions-framework`, y agrega:
+    - /warmup: prepara los clientes de Cloud Storage, Vertex AI y BigFrames del proceso.
+    - /readyz: responde 200 cuando el proceso ya se calentó y 503 mientras no; si aún
+      no se calentó, lo intenta.
+
+Los módulos se importan en el proceso maestro (`preload_app`), pero los clientes se
+crean después del `fork`, en cada proceso de trabajo: los canales gRPC y los hilos no
+sobreviven a la copia del proceso.
+
+Uso:
+    gunicorn --config gunicorn.conf.py server:app
+"""
+
+import time
+import logging
+import threading
+from flask import Flask, request, jsonify
+
+import config
+from main import file_processor, DESTINATION_BUCKET
+from utils.storage_backend import get_storage
+from utils import data_processor, bigframes_processor
+
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+_warmup_lock = threading.Lock()
+_warmup_state = {'ready': False, 'checks': {}}
+
+
+def _warm_storage():
+    # Crea el cliente y abre la conexión con una consulta de metadatos barata
+    get_storage().exists(DESTINATION_BUCKET, "processed/_warmup")
+
+
+def _warm_vertex():
+    # `count_tokens` crea el cliente de predicción y obtiene las credenciales sin generar contenido
+    data_processor.model.count_tokens("ping")
+    bigframes_processor.local_model.count_tokens("ping")
+
+
+def _warm_bigframes():
+    bigframes_processor.bigframes_session.warm_up()
+
+
+def _checks() -> list:
+    checks = [('storage', _warm_storage), ('vertex', _warm_vertex)]
+    if config.WARMUP_BIGFRAMES and bigframes_processor.BIGFRAMES_IMPORTED:
+        checks.append(('bigframes', _warm_bigframes))
+    return checks
+
+
+def warm_up(force: bool = False) -> dict:
+    """
+    Prepara los clientes del proceso para que la primera solicitud cueste lo mismo que
+    las siguientes.
+
+    Args:
+        force (bool): Repite el calentamiento aunque el proceso ya esté listo.
+
+    Returns:
+        dict: {'ready': bool, 'checks': {dependencia: {'ok': bool, 'seconds': float, ...}}}.
+    """
+    with _warmup_lock:
+        if _warmup_state['ready'] and not force:
+            return dict(_warmup_state)
+        checks = {}
+        for name, check in _checks():
+            started_at = time.monotonic()
+            try:
+                check()
+                checks[name] = {'ok': True}
+            except Exception as e:
+                logger.error(f"Error al calentar {name}: {e}")
+                checks[name] = {'ok': False, 'error': str(e)}
+            checks[name]['seconds'] = round(time.monotonic() - started_at, 3)
+        _warmup_state['checks'] = checks
+        _warmup_state['ready'] = all(result['ok'] for result in checks.values())
+        logger.info(f"Calentamiento del proceso terminado: {checks}")
+        return dict(_warmup_state)
+
+
+@app.route("/", methods=["POST"])
+def handle_event():
+    return file_processor(request)
+
+
+@app.route("/warmup", methods=["GET", "POST"])
+def warmup():
+    state = warm_up(force=request.args.get('force', 'false').lower() == 'true')
+    return jsonify(state), 200 if state['ready'] else 503
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # Si el calentamiento falló o no se ejecutó al iniciar, la sonda lo reintenta
+    state = warm_up()
+    return jsonify(state), 200 if state['ready'] else 503
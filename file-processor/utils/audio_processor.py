@@ -4,42 +4,89 @@ Utilidad para procesamiento de archivos de audio
 
 import os
 import logging
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from google.api_core import operation as api_operation
 from google.cloud import speech_v1p1beta1 as speech
-from google.cloud import storage
 import config
 
 # Importa la función de cuarentena desde un módulo de utilidades separado
 from utils.file_mover import move_to_quarantine
+from utils.storage_backend import get_storage
+from utils.deadline import DeadlineExceeded
+from utils.circuit_breaker import get_breaker, DependencyUnavailable
+from utils import tracing
 
 logger = logging.getLogger(__name__)
 
 
-def process_audio(bucket_name, file_name, file_info):
+def _resume_operation(client, operation_name: str):
+    """
+    Recupera una transcripción de larga duración iniciada en un intento anterior.
+    """
+    operations_client = client.transport.operations_client
+    return api_operation.from_gapic(
+        get_breaker('speech').call(operations_client.get_operation, operation_name),
+        operations_client,
+        speech.LongRunningRecognizeResponse,
+        metadata_type=speech.LongRunningRecognizeMetadata,
+    )
+
+
+def _start_recognition(client, bucket_name, file_name, deadline=None):
+    """
+    Envía el audio a Speech-to-Text y retorna la operación de larga duración.
+    """
+    gcs_uri = get_storage().uri(bucket_name, file_name)
+    logger.info(f"Enviando solicitud a Speech-to-Text para procesar el archivo: {gcs_uri or file_name}")
+
+    if gcs_uri:
+        audio = speech.RecognitionAudio(uri=gcs_uri)
+    else:
+        audio = speech.RecognitionAudio(content=get_storage().read(bucket_name, file_name))
+
+    # Se asume la codificación MP3 y la tasa de muestreo estándar
+    config_api = speech.RecognitionConfig(
+        language_code="es-ES",
+        enable_automatic_punctuation=True,
+        encoding=speech.RecognitionConfig.AudioEncoding.MP3,
+        sample_rate_hertz=44100,  # Frecuencia de muestreo estándar para MP3.
+    )
+
+    # La solicitud de envío también se acota a la porción de la etapa
+    kwargs = {'timeout': deadline.slice('transcription')} if deadline else {}
+    return get_breaker('speech').call(
+        client.long_running_recognize,
+        config=config_api,
+        audio=audio,
+        **kwargs
+    )
+
+
+@tracing.traced('transcription')
+def process_audio(bucket_name, file_name, file_info, deadline=None, operation_name: str = None):
     """
     Procesa un archivo de audio directamente desde un URI de Cloud Storage usando la API de Speech-to-Text.
+    Con el almacenamiento local, el contenido del audio se envía en la solicitud.
+
+    Si el plazo del evento se agota antes de que termine la transcripción, se lanza
+    `DeadlineExceeded` con el nombre de la operación, que sigue ejecutándose en la API;
+    el siguiente intento la retoma con `operation_name` en lugar de volver a enviarla.
     """
+    operation = None
     try:
-        storage_client = storage.Client()
-        gcs_uri = f"gs://{bucket_name}/{file_name}"
-        logger.info(f"Enviando solicitud a Speech-to-Text para procesar el archivo: {gcs_uri}")
-        
         client = speech.SpeechClient()
-        audio = speech.RecognitionAudio(uri=gcs_uri)
-        
-        # Se asume la codificación MP3 y la tasa de muestreo estándar
-        config_api = speech.RecognitionConfig(
-            language_code="es-ES",
-            enable_automatic_punctuation=True,
-            encoding=speech.RecognitionConfig.AudioEncoding.MP3,
-            sample_rate_hertz=44100,  # Frecuencia de muestreo estándar para MP3.
-        )
-        
-        operation = client.long_running_recognize(
-            config=config_api,
-            audio=audio
-        )
-        
-        response = operation.result(timeout=600)
+        if operation_name:
+            logger.info(f"Retomando la transcripción {operation_name} del archivo: {file_name}")
+            operation = _resume_operation(client, operation_name)
+        else:
+            operation = _start_recognition(client, bucket_name, file_name, deadline)
+        tracing.set_attributes({'speech.operation': operation.operation.name, 'resumed': bool(operation_name)})
+
+        timeout = deadline.slice('transcription', {'operation': operation.operation.name}) if deadline else 600
+        try:
+            response = get_breaker('speech').call(operation.result, timeout=timeout)
+        except FutureTimeoutError:
+            raise DeadlineExceeded('transcription', {'operation': operation.operation.name})
         
         transcript = "".join([result.alternatives[0].transcript + "\n" for result in response.results])
         base_file_name = os.path.splitext(os.path.basename(file_name))[0]
@@ -47,13 +94,19 @@ def process_audio(bucket_name, file_name, file_info):
         audio_results_path = config.PATHS.get('audio_results', 'audio_results/')
         result_file_name = f"{audio_results_path}{base_file_name}.txt"
         
-        result_blob = storage_client.bucket(bucket_name).blob(result_file_name)
-        result_blob.upload_from_string(transcript)
+        get_storage().write(bucket_name, result_file_name, transcript, content_type='text/plain')
         
         logger.info(f"Audio procesado y transcrito: {file_name} -> {result_file_name}")
         
         return result_file_name
 
+    except DeadlineExceeded:
+        raise
+    except DependencyUnavailable as e:
+        # Una caída de Speech-to-Text no es un problema del archivo: no va a cuarentena
+        if operation is not None:
+            raise e.with_partial({'operation': operation.operation.name}) from e
+        raise
     except Exception as e:
         logger.error(f"Error procesando audio {file_name}: {e}")
         move_to_quarantine(bucket_name, file_name, f"Error procesamiento audio: {e}")
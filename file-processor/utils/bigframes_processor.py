@@ -4,12 +4,24 @@ Contiene la lógica para el análisis y pronóstico de datos transaccionales,
 utilizando una amplia gama de columnas de datos.
 """
 
+import json
 import logging
 import os
-import bigframes.pandas as bfp
-import bigframes.ml.llm as bfml
-from google.cloud import storage
+import pandas as pd
 import vertexai
+from vertexai.generative_models import GenerativeModel
+
+import config
+from .stack_writer import read_stack
+from .column_profiler import profile_dataframe, to_pandas
+from .forecaster import forecast_dataframe, format_forecasts
+from .bigframes_session import BigFramesSessionManager
+from .micro_batcher import MicroBatcher
+from .storage_backend import get_storage
+from .circuit_breaker import get_breaker, DependencyUnavailable, OUTAGE_ERRORS
+from .deadline import DeadlineExceeded
+from .gemini_client import generate_content
+from . import tracing
 
 # Configuración del registro
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -45,6 +57,12 @@ IDENTIFIER_COLUMNS = [
     'clothing_size', 'satisfaction_level', 'product_in_stock'
 ]
 
+# Columnas categóricas usadas para estratificar la muestra del prompt
+STRATA_COLUMNS = [
+    'order_status', 'product_type', 'payment_method', 'brand', 'civil_status',
+    'gender', 'level_of_education', 'satisfaction_level', 'product_rating'
+]
+
 PROJECT_ID = "sieve-ai-470820"
 LOCATION = "us-central1"
 
@@ -53,70 +71,274 @@ try:
 except Exception as e:
     logger.error(f"Error al inicializar Vertex AI: {e}")
 
+# Modelo usado por el motor local para los stacks pequeños
+LOCAL_MODEL_NAME = "gemini-2.5-flash-lite"
+local_model = GenerativeModel(LOCAL_MODEL_NAME)
+
+# Sesión de BigFrames y modelo reutilizados entre invocaciones, con la ubicación fija.
+# BigQuery detiene los trabajos que superan el límite de la etapa de análisis.
+bigframes_session = BigFramesSessionManager(
+    PROJECT_ID, LOCATION, health_check_interval=config.BIGFRAMES_HEALTH_CHECK_INTERVAL,
+    job_timeout_seconds=config.DEADLINE_STAGE_SECONDS['analysis'],
+)
+
 try:
     BIGFRAMES_IMPORTED = True
 except ImportError as e:
     logger.warning(f"No se pudieron importar las bibliotecas de BigFrames: {e}. El análisis de reportes no estará disponible.")
     BIGFRAMES_IMPORTED = False
 
-def analyze_data_with_bigframes(csv_file_path: str):
+def select_analysis_engine(byte_size: int, row_count: int = None) -> str:
+    """
+    Elige el motor de análisis según el tamaño del stack.
+
+    Los stacks pequeños se analizan en el proceso con Pandas; BigFrames se reserva
+    para tablas que superan los límites locales configurados.
+
+    Returns:
+        str: 'pandas' o 'bigframes'.
+    """
+    if config.ANALYSIS_ENGINE in ['pandas', 'bigframes']:
+        return config.ANALYSIS_ENGINE
+    if byte_size is not None and byte_size > config.LOCAL_ANALYSIS_MAX_BYTES:
+        return 'bigframes'
+    if row_count is not None and row_count > config.LOCAL_ANALYSIS_MAX_ROWS:
+        return 'bigframes'
+    return 'pandas'
+
+
+def analyze_data_with_bigframes(csv_file_path: str, dataframe: pd.DataFrame = None, deadline=None):
     """
-    Realiza un análisis profundo de los datos en el archivo CSV usando BigFrames
+    Realiza un análisis profundo de los datos del stack (CSV o Parquet)
     y genera un reporte estructurado en formato de texto.
 
+    Los stacks pequeños se analizan localmente con Pandas y una llamada directa a Gemini;
+    los grandes se analizan con BigFrames.
+
     Args:
-        csv_file_path (str): La ruta al archivo CSV en el bucket de GCS.
+        csv_file_path (str): La ruta al stack en el bucket de GCS. Los stacks con extensión
+            `.parquet` se leen con sus tipos de columna, sin inferencia.
+        dataframe (pd.DataFrame): El DataFrame ya tipado del stack (opcional). Si se
+            proporciona, el motor local lo usa directamente sin volver a leer el stack;
+            BigFrames carga el stack guardado del lado del servidor.
+        deadline (Deadline): Plazo del evento (opcional). Si el análisis no termina en la
+            porción de la etapa 'analysis', se lanza `DeadlineExceeded`. La llamada a Gemini
+            del motor local se acota con su propio tiempo de espera; BigFrames no lo acepta
+            por llamada, por lo que su análisis se acota con `Deadline.call` y sus trabajos
+            con el límite de la sesión.
     
     Returns:
         str: El contenido del reporte de análisis y pronóstico en formato de texto.
     """
-    if not BIGFRAMES_IMPORTED:
-        return "Error: Las bibliotecas de BigFrames no están disponibles. El análisis no se pudo realizar."
+    try:
+        if dataframe is not None:
+            byte_size = int(dataframe.memory_usage(deep=True).sum())
+            engine = select_analysis_engine(byte_size, row_count=len(dataframe))
+            df = dataframe
+        else:
+            blob = get_storage().metadata(DESTINATION_BUCKET, csv_file_path)
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(DESTINATION_BUCKET)
-    blob = bucket.blob(csv_file_path)
+            if blob is None:
+                error_message = f"Error 404: El archivo '{csv_file_path}' no fue encontrado en el bucket '{DESTINATION_BUCKET}'."
+                logger.error(error_message)
+                return f"status: error\nmessage: {error_message}\ndetails: El proceso no continuó porque el archivo de origen no existe."
 
-    if not blob.exists():
-        error_message = f"Error 404: El archivo '{csv_file_path}' no fue encontrado en el bucket '{DESTINATION_BUCKET}'."
-        logger.error(error_message)
-        return f"status: error\nmessage: {error_message}\ndetails: El proceso no continuó porque el archivo de origen no existe."
+            engine = select_analysis_engine(blob.size)
+            if engine == 'pandas':
+                df = read_stack(DESTINATION_BUCKET, csv_file_path)
+                engine = select_analysis_engine(blob.size, row_count=len(df))
 
-    logger.info("Iniciando análisis de datos con BigFrames...")
+        if engine == 'bigframes' and get_storage().uri(DESTINATION_BUCKET, csv_file_path) is None:
+            # BigQuery no puede leer el almacenamiento local: el stack se analiza con Pandas
+            logger.info("El stack no está en Cloud Storage; se usará el análisis local con Pandas.")
+            engine = 'pandas'
+            if dataframe is None:
+                df = read_stack(DESTINATION_BUCKET, csv_file_path)
 
-    try:
-        df = bfp.read_csv(f"gs://{DESTINATION_BUCKET}/{csv_file_path}")
+        if engine == 'bigframes':
+            if not BIGFRAMES_IMPORTED:
+                return "Error: Las bibliotecas de BigFrames no están disponibles. El análisis no se pudo realizar."
+            logger.info("Iniciando análisis de datos con BigFrames...")
+            def _analyze():
+                return get_breaker('bigframes').call(
+                    bigframes_session.run, lambda session: _analyze_with_session(session, csv_file_path)
+                )
+
+            if deadline:
+                return deadline.call('analysis', _analyze)
+            return _analyze()
+
+        logger.info(f"Iniciando análisis local de datos con Pandas ({len(df)} filas)...")
         logger.info(f"Datos cargados. Columnas disponibles: {df.columns.tolist()}")
+        return _generate_report(df, engine, deadline)
 
-        relevant_text_cols = [col for col in TEXT_COLUMNS if col in df.columns]
-        if relevant_text_cols:
-            # Genera un prompt dinámico para resumir el contenido
-            prompt_content = f"""
-            Analiza los datos de las columnas de texto {relevant_text_cols} y las columnas financieras {FINANCIAL_COLUMNS} del siguiente DataFrame.
-            Genera un reporte ejecutivo detallado sobre los hallazgos clave, correlaciones, y patrones de comportamiento.
-            Proporciona una síntesis en un párrafo claro.
-            DataFrame en formato JSON: {df.to_json(orient='records', lines=True, index=False)[:2000]}...
-            """
-            
-            try:
-                # Crea una instancia del modelo
-                model = bfml.GeminiTextGenerator()
-                
-                # Crea un DataFrame con el prompt para pasarlo a la función predict
-                prompt_df = bfp.DataFrame({"prompt": [prompt_content]})
-                
-                # Usa el modelo para predecir, pasando solo el DataFrame
-                summary_result = model.predict(prompt_df)
-                
-                # Usa el nombre de columna correcto para el resultado
-                return summary_result["ml_generate_text_llm_result"].iloc[0]
-            except Exception as text_analysis_error:
-                logger.warning(f"No se pudo generar el reporte de texto: {text_analysis_error}")
-                return "Ocurrió un error al generar el reporte de texto. Este paso fue omitido."
-        else:
-            logger.warning("No se encontraron columnas de texto relevantes para el análisis.")
-            return "No se encontraron columnas de texto relevantes para el análisis."
-    
+    except (DeadlineExceeded, DependencyUnavailable):
+        # El archivo se difiere hasta que la dependencia se recupere
+        raise
     except Exception as e:
-        logger.error(f"Error fatal en el análisis de BigFrames: {e}")
-        return f"Error en el análisis. Consulte los registros para más detalles: {e}"
\ No newline at end of file
+        logger.error(f"Error fatal en el análisis de datos: {e}")
+        return f"Error en el análisis. Consulte los registros para más detalles: {e}"
+
+
+def _analyze_with_session(session, stack_path: str) -> str:
+    """
+    Carga el stack en la sesión de BigFrames compartida y genera el reporte.
+    """
+    stack_uri = get_storage().uri(DESTINATION_BUCKET, stack_path)
+    if stack_path.endswith('.parquet'):
+        df = session.read_parquet(stack_uri)
+    else:
+        df = session.read_csv(stack_uri)
+    logger.info(f"Datos cargados. Columnas disponibles: {df.columns.tolist()}")
+    return _generate_report(df, 'bigframes')
+
+
+def _sample_for_prompt(df, columns: list):
+    """
+    Obtiene solo las filas necesarias para el prompt, sin descargar la tabla completa.
+
+    Con la estrategia 'stratified' toma hasta el mismo número de filas de cada valor de la
+    primera columna categórica disponible; en otro caso toma las primeras filas.
+    """
+    sample_rows = config.ANALYSIS_SAMPLE_ROWS
+    subset = df[columns]
+    if config.ANALYSIS_SAMPLE_STRATEGY == 'stratified':
+        strata_col = next((col for col in STRATA_COLUMNS if col in df.columns), None)
+        if strata_col:
+            try:
+                strata = to_pandas(df[strata_col].nunique())
+                rows_per_stratum = max(1, sample_rows // max(1, int(strata)))
+                stratified = df[columns + ([strata_col] if strata_col not in columns else [])].groupby(strata_col, dropna=False).head(rows_per_stratum)
+                return to_pandas(stratified.head(sample_rows))[columns]
+            except Exception as e:
+                logger.warning(f"No se pudo obtener una muestra estratificada por '{strata_col}': {e}")
+    return to_pandas(subset.head(sample_rows))
+
+
+def _records_within_budget(sample: pd.DataFrame, max_chars: int) -> str:
+    """
+    Serializa filas completas en formato JSON por líneas hasta agotar el presupuesto de caracteres.
+    """
+    lines = []
+    used = 0
+    for line in sample.to_json(orient='records', lines=True, date_format='iso').splitlines():
+        if used + len(line) > max_chars:
+            break
+        lines.append(line)
+        used += len(line) + 1
+    return "\n".join(lines)
+
+
+def _generate_report(df, engine: str, deadline=None) -> str:
+    """
+    Genera el reporte de texto a partir de un DataFrame de Pandas o de BigFrames.
+    """
+    relevant_text_cols = [col for col in TEXT_COLUMNS if col in df.columns]
+    relevant_financial_cols = [col for col in FINANCIAL_COLUMNS if col in df.columns]
+    numeric_cols = [col for col in relevant_financial_cols if pd.api.types.is_numeric_dtype(df[col].dtype)]
+    relevant_time_cols = [col for col in TIME_COLUMNS if col in df.columns]
+    category_cols = [col for col in IDENTIFIER_COLUMNS if col in df.columns and col in STRATA_COLUMNS]
+
+    # Los pronósticos no dependen del modelo y se calculan aunque no haya columnas de texto
+    forecasts = forecast_dataframe(df, relevant_time_cols, numeric_cols)
+
+    if not relevant_text_cols:
+        logger.warning("No se encontraron columnas de texto relevantes para el análisis.")
+        report = "No se encontraron columnas de texto relevantes para el análisis."
+        return f"{report}\n\n{format_forecasts(forecasts)}" if forecasts else report
+
+    # Solo se materializa la muestra y el perfil que necesita el prompt
+    row_count = len(df)
+    sample = _sample_for_prompt(df, relevant_text_cols + relevant_financial_cols + relevant_time_cols)
+    profile = profile_dataframe(df, numeric_cols, category_cols, relevant_time_cols)
+
+    forecast_instructions = ""
+    if forecasts:
+        forecast_instructions = f"""
+    Pronósticos base calculados localmente (tendencia lineal o suavizado exponencial con intervalos del 95%). Usa estos valores para las proyecciones y no generes otros: {json.dumps(forecasts, ensure_ascii=False)}"""
+
+    # Genera un prompt dinámico para resumir el contenido
+    prompt_content = f"""
+    Analiza los datos de las columnas de texto {relevant_text_cols} y las columnas financieras {relevant_financial_cols} del siguiente DataFrame.
+    Genera un reporte ejecutivo detallado sobre los hallazgos clave, correlaciones, y patrones de comportamiento.
+    Proporciona una síntesis en un párrafo claro.
+    Basa las cifras del reporte en el perfil estadístico, calculado de forma exacta sobre todas las filas.
+    Total de filas: {row_count}.
+    Perfil estadístico (tasas de nulos, resumen numérico, cuantiles, correlaciones, categorías más frecuentes y rangos temporales): {json.dumps(profile, ensure_ascii=False)}{forecast_instructions}
+    Muestra de {len(sample)} filas en formato JSON: {_records_within_budget(sample, config.ANALYSIS_PROMPT_MAX_CHARS)}
+    """
+
+    report = _generate_text(prompt_content, engine, deadline)
+    if forecasts:
+        # Los pronósticos se agregan al reporte tal como se calcularon
+        report = f"{report}\n\n{format_forecasts(forecasts)}"
+    return report
+
+
+def _generate_text(prompt_content: str, engine: str, deadline=None) -> str:
+    """
+    Envía el prompt al modelo del motor seleccionado y retorna el texto generado.
+    Con un plazo, la llamada a Gemini del motor local se acota a la porción de 'analysis'.
+    """
+    try:
+        if engine == 'pandas':
+            # Llamada directa a Gemini, sin sesión de BigFrames
+            with tracing.span('gemini', **{'gen_ai.request.model': LOCAL_MODEL_NAME}) as current:
+                current.add('bytes.in', len(prompt_content.encode('utf-8')))
+                response = get_breaker('vertex').call(
+                    generate_content, local_model, prompt_content, deadline=deadline, stage='analysis'
+                )
+                current.add('bytes.out', len(response.text.encode('utf-8')))
+                tracing.record_usage(response)
+            return response.text
+
+        # El prompt se agrupa con los de otros archivos en una sola llamada a predict
+        report = _report_batcher.submit(prompt_content)
+        if report is None:
+            raise ValueError("El modelo no generó texto para el prompt.")
+        return report
+    except (DeadlineExceeded, DependencyUnavailable, *OUTAGE_ERRORS):
+        # Una caída del modelo debe llegar al interruptor que envuelve el análisis
+        raise
+    except Exception as text_analysis_error:
+        logger.warning(f"No se pudo generar el reporte de texto: {text_analysis_error}")
+        return "Ocurrió un error al generar el reporte de texto. Este paso fue omitido."
+
+
+def _predict_prompts(prompts: list) -> list:
+    """
+    Genera los reportes de varios prompts con una sola llamada a `predict` sobre un
+    DataFrame de varias filas. Las filas sin texto generado se retornan como None.
+
+    La llamada pasa por `bigframes_session.run`, que recrea la sesión y reintenta si la
+    sesión dejó de responder, antes de que el reporte recurra al texto de error.
+
+    El interruptor de 'bigframes' ya envuelve el análisis que envía el prompt; aplicarlo
+    de nuevo aquí haría que la llamada anidada chocara con la prueba del propio análisis.
+    """
+    return bigframes_session.run(lambda session: _predict_batch(session, prompts))
+
+
+@tracing.traced('bigframes.predict', result_attributes=lambda reports: {'prompts': len(reports)})
+def _predict_batch(session, prompts: list) -> list:
+    model = bigframes_session.model()
+    prompt_df = session.read_pandas(pd.DataFrame({"prompt": prompts}))
+    results = to_pandas(model.predict(prompt_df)).sort_index()
+
+    reports = []
+    for index in range(len(prompts)):
+        status = results["ml_generate_text_status"].get(index) if "ml_generate_text_status" in results.columns else None
+        if status:
+            logger.warning(f"El modelo devolvió un error para el prompt {index} del lote: {status}")
+        text = results["ml_generate_text_llm_result"].get(index)
+        reports.append(None if status or text is None or pd.isna(text) else text)
+    return reports
+
+
+# Agrupa los prompts de archivos procesados en paralelo en una sola llamada a predict
+_report_batcher = MicroBatcher(
+    _predict_prompts,
+    window_seconds=config.REPORT_BATCH_WINDOW_SECONDS,
+    max_items=config.REPORT_BATCH_MAX_PROMPTS,
+    name="lote de reportes de BigFrames",
+)
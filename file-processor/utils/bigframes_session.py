@@ -0,0 +1,147 @@
+"""
+Sesión de BigFrames y modelo de Gemini reutilizables entre invocaciones
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+import bigframes
+import bigframes.ml.llm as bfml
+from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+
+class BigFramesSessionManager:
+    """
+    Mantiene una sesión de BigFrames y un `GeminiTextGenerator` listos para usarse,
+    con la ubicación fija, ganchos de ciclo de vida, verificaciones de salud y
+    recreación automática cuando la sesión falla.
+
+    Args:
+        project (str): Proyecto de Google Cloud.
+        location (str): Ubicación de BigQuery donde se ejecutan los trabajos.
+        health_check_interval (float): Segundos mínimos entre verificaciones de salud.
+        job_timeout_seconds (float): Tiempo máximo de los trabajos de BigQuery de la sesión
+            (opcional). BigQuery detiene del lado del servidor los que lo superan, de modo
+            que un análisis abandonado no sigue consumiendo recursos.
+    """
+
+    def __init__(self, project: str, location: str, health_check_interval: float = 300, job_timeout_seconds: float = None):
+        self.project = project
+        self.location = location
+        self.health_check_interval = health_check_interval
+        self.job_timeout_seconds = job_timeout_seconds
+        self._lock = threading.RLock()
+        self._session = None
+        self._model = None
+        self._last_healthy_at = 0.0
+        self._hooks = {'create': [], 'close': []}
+        atexit.register(self.close)
+
+    def add_hook(self, event: str, hook):
+        """
+        Registra una función a llamar con la sesión cuando se crea ('create') o se cierra ('close').
+        """
+        if event not in self._hooks:
+            raise ValueError(f"Evento de ciclo de vida no soportado: {event}")
+        self._hooks[event].append(hook)
+
+    def _run_hooks(self, event: str, session):
+        for hook in self._hooks[event]:
+            try:
+                hook(session)
+            except Exception as e:
+                logger.warning(f"Error en el gancho '{event}' de la sesión de BigFrames: {e}")
+
+    def session(self):
+        """
+        Retorna la sesión activa, creándola si es necesario.
+        """
+        with self._lock:
+            if self._session is None:
+                logger.info(f"Creando sesión de BigFrames en {self.project} ({self.location})...")
+                context = bigframes.BigQueryOptions(project=self.project, location=self.location)
+                self._session = bigframes.connect(context)
+                if self.job_timeout_seconds:
+                    self._limit_job_duration(self._session)
+                self._last_healthy_at = time.monotonic()
+                self._run_hooks('create', self._session)
+            return self._session
+
+    def _limit_job_duration(self, session):
+        """
+        Aplica `job_timeout_seconds` a las consultas y cargas que la sesión envía a BigQuery.
+        """
+        job_timeout_ms = int(self.job_timeout_seconds * 1000)
+        client = session.bqclient
+        query_config = client.default_query_job_config or bigquery.QueryJobConfig()
+        query_config.job_timeout_ms = job_timeout_ms
+        client.default_query_job_config = query_config
+        load_config = client.default_load_job_config or bigquery.LoadJobConfig()
+        load_config.job_timeout_ms = job_timeout_ms
+        client.default_load_job_config = load_config
+
+    def model(self):
+        """
+        Retorna el modelo de generación de texto ligado a la sesión activa.
+        """
+        with self._lock:
+            if self._model is None:
+                self._model = bfml.GeminiTextGenerator(session=self.session())
+            return self._model
+
+    def warm_up(self):
+        """
+        Crea la sesión y el modelo por adelantado para que la primera solicitud no los pague.
+        """
+        self.model()
+
+    def health_check(self, force: bool = False) -> bool:
+        """
+        Ejecuta una consulta trivial para verificar la sesión. Sin `force`, se omite si la
+        última verificación exitosa es más reciente que `health_check_interval`.
+        """
+        with self._lock:
+            if self._session is None:
+                return False
+            if not force and time.monotonic() - self._last_healthy_at < self.health_check_interval:
+                return True
+            session = self._session
+        try:
+            session.read_gbq("SELECT 1 AS ok").to_pandas()
+            self._last_healthy_at = time.monotonic()
+            return True
+        except Exception as e:
+            logger.warning(f"La sesión de BigFrames no respondió a la verificación de salud: {e}")
+            return False
+
+    def close(self):
+        """
+        Cierra la sesión y descarta el modelo.
+        """
+        with self._lock:
+            session, self._session, self._model = self._session, None, None
+        if session is None:
+            return
+        self._run_hooks('close', session)
+        try:
+            session.close()
+        except Exception as e:
+            logger.warning(f"Error al cerrar la sesión de BigFrames: {e}")
+
+    def run(self, operation):
+        """
+        Ejecuta `operation(session)`. Si falla y la sesión no está sana, la recrea
+        y reintenta una sola vez.
+        """
+        try:
+            return operation(self.session())
+        except Exception as e:
+            if self.health_check(force=True):
+                raise
+            logger.warning(f"Recreando la sesión de BigFrames tras el error: {e}")
+            self.close()
+            return operation(self.session())
@@ -0,0 +1,30 @@
+"""
+Utilidad para guardar y recuperar el progreso de los trabajos por lotes en el almacenamiento
+"""
+
+import json
+import logging
+
+from .storage_backend import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+def load_checkpoint(bucket_name: str, blob_name: str) -> dict:
+    """
+    Carga el estado guardado de un trabajo. Retorna un diccionario vacío si no existe.
+    """
+    if not get_storage().exists(bucket_name, blob_name):
+        logger.info(f"No existe un punto de control en {blob_name}. El trabajo comenzará desde el inicio.")
+        return {}
+    state = json.loads(get_storage().read_text(bucket_name, blob_name))
+    logger.info(f"Punto de control cargado desde {blob_name}.")
+    return state
+
+
+def save_checkpoint(bucket_name: str, blob_name: str, state: dict):
+    """
+    Guarda el estado de un trabajo, reemplazando el punto de control anterior.
+    """
+    get_storage().write(bucket_name, blob_name, json.dumps(state, ensure_ascii=False), content_type='application/json')
+    logger.info(f"Punto de control guardado en {blob_name}.")
@@ -0,0 +1,226 @@
+"""
+Interruptores de circuito por dependencia externa (Vertex AI, Vision, Speech-to-Text y BigFrames)
+
+Mientras un servicio falla, su interruptor se abre y las llamadas fallan de inmediato con
+`DependencyUnavailable`, sin esperar a la API. Pasado el tiempo de espera, el interruptor
+deja pasar una llamada de prueba; si tiene éxito se cierra, y si falla vuelve a abrirse
+con una espera el doble de larga.
+"""
+
+import time
+import logging
+import threading
+from google.api_core import exceptions as api_exceptions
+from google.auth import exceptions as auth_exceptions
+
+try:
+    import requests
+    REQUESTS_IMPORTED = True
+except ImportError:
+    REQUESTS_IMPORTED = False
+
+import config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Errores que indican una caída o saturación del servicio, no un problema del archivo
+OUTAGE_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    # Los reintentos internos del cliente se agotaron sin respuesta del servicio
+    api_exceptions.RetryError,
+    auth_exceptions.TransportError,
+    ConnectionError,
+)
+if REQUESTS_IMPORTED:
+    # Los errores de red de `requests` no heredan de `ConnectionError`
+    OUTAGE_ERRORS += (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class DependencyUnavailable(Exception):
+    """
+    Una dependencia externa no está disponible; el archivo debe diferirse, no ponerse en cuarentena.
+
+    Args:
+        dependency (str): Nombre de la dependencia ('vertex', 'vision', 'speech' o 'bigframes').
+        retry_after (float): Segundos sugeridos antes de reintentar.
+        partial (dict): Estado parcial con el que el archivo puede reanudarse (opcional).
+    """
+
+    def __init__(self, dependency: str, retry_after: float = 0.0, partial: dict = None):
+        super().__init__(f"La dependencia '{dependency}' no está disponible.")
+        self.dependency = dependency
+        self.retry_after = retry_after
+        self.partial = dict(partial or {})
+
+    def with_partial(self, partial: dict):
+        """
+        Retorna una copia con estado parcial adicional, sin modificar la excepción original.
+        """
+        return DependencyUnavailable(self.dependency, self.retry_after, {**self.partial, **partial})
+
+
+class CircuitBreaker:
+    """
+    Interruptor de circuito de una dependencia.
+
+    Args:
+        name (str): Nombre de la dependencia.
+        failure_threshold (int): Fallos de caída consecutivos que abren el interruptor.
+        reset_seconds (float): Espera inicial antes de la llamada de prueba.
+        max_reset_seconds (float): Espera máxima tras aperturas repetidas.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float, max_reset_seconds: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.max_reset_seconds = max_reset_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._openings = 0
+        self._opened_until = 0.0
+        self._probe_in_flight = False
+        self._listeners = []
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._opened_until:
+                return HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        """
+        Retorna los segundos que faltan para la próxima llamada de prueba.
+        """
+        with self._lock:
+            return max(0.0, self._opened_until - time.monotonic()) if self._state == OPEN else 0.0
+
+    def add_listener(self, listener):
+        """
+        Registra `listener(name, state)`, llamado cuando el interruptor se abre o se cierra.
+        """
+        self._listeners.append(listener)
+
+    def _acquire(self):
+        """
+        Decide si una llamada puede pasar. Lanza `DependencyUnavailable` si el interruptor
+        está abierto o si ya hay una llamada de prueba en curso.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return False
+            now = time.monotonic()
+            if self._state == OPEN and now < self._opened_until:
+                raise DependencyUnavailable(self.name, self._opened_until - now)
+            if self._probe_in_flight:
+                raise DependencyUnavailable(self.name, self.reset_seconds)
+            self._state = HALF_OPEN
+            self._probe_in_flight = True
+            return True
+
+    def _release_probe(self, probe: bool):
+        if probe:
+            with self._lock:
+                self._probe_in_flight = False
+                if self._state == HALF_OPEN:
+                    self._state = OPEN
+
+    def _record_success(self, probe: bool):
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+            recovered = self._state != CLOSED
+            self._state = CLOSED
+            self._failures = 0
+            self._openings = 0
+        if recovered:
+            logger.info(f"La dependencia '{self.name}' se recuperó; el interruptor se cerró.")
+            self._notify(CLOSED)
+
+    def _record_failure(self, probe: bool) -> float:
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+            self._failures += 1
+            if self._state == CLOSED and self._failures < self.failure_threshold:
+                return 0.0
+            if self._state == OPEN and not probe:
+                # Una llamada iniciada antes de la apertura no alarga la espera
+                return max(0.0, self._opened_until - time.monotonic())
+            wait = min(self.reset_seconds * (2 ** self._openings), self.max_reset_seconds)
+            self._openings += 1
+            self._state = OPEN
+            self._opened_until = time.monotonic() + wait
+        logger.warning(f"Interruptor de '{self.name}' abierto durante {wait:.0f}s tras {self._failures} fallo(s).")
+        self._notify(OPEN)
+        return wait
+
+    def _notify(self, state: str):
+        for listener in self._listeners:
+            try:
+                listener(self.name, state)
+            except Exception as e:
+                logger.error(f"Error en el observador del interruptor de '{self.name}': {e}")
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Ejecuta `fn(*args, **kwargs)` a través del interruptor.
+
+        Los errores de caída del servicio se registran y se convierten en
+        `DependencyUnavailable`. Los demás errores de la API se propagan sin cambios y
+        cuentan como una respuesta del servicio; cualquier otro error se propaga sin
+        registrarse, porque no dice nada de la salud de la dependencia.
+        """
+        probe = self._acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except OUTAGE_ERRORS as e:
+            retry_after = self._record_failure(probe)
+            raise DependencyUnavailable(self.name, retry_after) from e
+        except api_exceptions.GoogleAPICallError:
+            # El servicio respondió con un error de la solicitud (por ejemplo, 400 o 404)
+            self._record_success(probe)
+            raise
+        except BaseException:
+            # Una dependencia anidada, un error local o una interrupción del proceso
+            self._release_probe(probe)
+            raise
+        self._record_success(probe)
+        return result
+
+
+_breakers = {
+    name: CircuitBreaker(
+        name,
+        failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds=config.CIRCUIT_RESET_SECONDS,
+        max_reset_seconds=config.CIRCUIT_MAX_RESET_SECONDS,
+    )
+    for name in ['vertex', 'vision', 'speech', 'bigframes']
+}
+
+
+def get_breaker(dependency: str) -> CircuitBreaker:
+    """
+    Retorna el interruptor de una dependencia ('vertex', 'vision', 'speech' o 'bigframes').
+    """
+    return _breakers[dependency]
+
+
+def breakers() -> dict:
+    """
+    Retorna todos los interruptores por nombre de dependencia.
+    """
+    return dict(_breakers)
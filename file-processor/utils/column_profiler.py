@@ -0,0 +1,111 @@
+"""
+Perfilado vectorizado de columnas para alimentar el reporte de análisis.
+Funciona con DataFrames de Pandas y de BigFrames; en BigFrames los cálculos
+se ejecutan en el motor de origen y solo se descargan los resultados.
+"""
+
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+TOP_K_CATEGORIES = 5
+# Solo se reportan las correlaciones con valor absoluto mayor o igual a este umbral
+MIN_REPORTED_CORRELATION = 0.5
+
+
+def to_pandas(obj):
+    """
+    Materializa un resultado de BigFrames en Pandas; los objetos de Pandas se retornan sin cambios.
+    """
+    return obj.to_pandas() if hasattr(obj, 'to_pandas') else obj
+
+
+def _round(value, digits: int = 4):
+    if value is None or pd.isna(value):
+        return None
+    return round(float(value), digits)
+
+
+def _profile_numeric(df, numeric_cols: list) -> dict:
+    """
+    Resumen, cuantiles y correlaciones de todas las columnas numéricas en una sola pasada por operación.
+    """
+    summary = to_pandas(df[numeric_cols].agg(['count', 'mean', 'std', 'min', 'max']))
+    quantiles = to_pandas(df[numeric_cols].quantile(QUANTILES))
+    profile = {}
+    for col in numeric_cols:
+        stats = {stat: _round(value) for stat, value in summary[col].items()}
+        stats['quantiles'] = {f"p{int(q * 100)}": _round(value) for q, value in quantiles[col].items()}
+        profile[col] = stats
+
+    correlations = []
+    if len(numeric_cols) > 1:
+        matrix = to_pandas(df[numeric_cols].astype('Float64').corr())
+        for i, col_a in enumerate(numeric_cols):
+            for col_b in numeric_cols[i + 1:]:
+                value = _round(matrix.loc[col_a, col_b], 3)
+                if value is not None and abs(value) >= MIN_REPORTED_CORRELATION:
+                    correlations.append({'columns': [col_a, col_b], 'pearson': value})
+    return {'summary': profile, 'correlations': correlations}
+
+
+def _profile_categories(df, category_cols: list) -> dict:
+    profile = {}
+    for col in category_cols:
+        counts = to_pandas(df[col].value_counts(dropna=True).head(TOP_K_CATEGORIES))
+        profile[col] = {str(value): int(count) for value, count in counts.items()}
+    return profile
+
+
+def _profile_time(df, time_cols: list) -> dict:
+    profile = {}
+    for col in time_cols:
+        series = df[col]
+        if not pd.api.types.is_datetime64_any_dtype(series.dtype):
+            if hasattr(series, 'to_pandas'):
+                continue
+            series = pd.to_datetime(series, errors='coerce', utc=True, format='mixed')
+        start, end = to_pandas(series.min()), to_pandas(series.max())
+        if start is None or pd.isna(start):
+            continue
+        distinct_days = int(to_pandas(series.dt.floor('D').nunique()))
+        span_days = (end - start).days + 1
+        profile[col] = {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'span_days': span_days,
+            'distinct_days': distinct_days,
+            'coverage': _round(distinct_days / span_days, 3),
+        }
+    return profile
+
+
+def profile_dataframe(df, numeric_cols: list, category_cols: list, time_cols: list) -> dict:
+    """
+    Calcula un perfil compacto del DataFrame por grupo de columnas.
+
+    Args:
+        df: DataFrame de Pandas o de BigFrames.
+        numeric_cols (list): Columnas numéricas (resumen, cuantiles y correlaciones).
+        category_cols (list): Columnas categóricas (categorías más frecuentes).
+        time_cols (list): Columnas de fecha (rango y cobertura temporal).
+
+    Returns:
+        dict: El perfil, con una sección por grupo. Las secciones que fallan se omiten.
+    """
+    profile = {}
+    profiled_cols = numeric_cols + category_cols + time_cols
+    sections = [
+        ('null_rates', lambda: {col: _round(rate, 3) for col, rate in to_pandas(df[profiled_cols].isna().mean()).items()} if profiled_cols else {}),
+        ('numeric', lambda: _profile_numeric(df, numeric_cols) if numeric_cols else {}),
+        ('categories', lambda: _profile_categories(df, category_cols)),
+        ('time_ranges', lambda: _profile_time(df, time_cols)),
+    ]
+    for name, compute in sections:
+        try:
+            profile[name] = compute()
+        except Exception as e:
+            logger.warning(f"No se pudo calcular la sección '{name}' del perfil: {e}")
+    return profile
@@ -0,0 +1,378 @@
+"""
+Compactación incremental de los resultados por archivo en conjuntos de datos Parquet
+particionados por fecha y `report_type`.
+
+Genera dos conjuntos de datos:
+    - rows: las filas de `dataframe_package` alineadas al esquema completo.
+    - reports: un registro por archivo con el reporte inicial y el reporte final.
+
+Las partes se escriben primero en una carpeta temporal de la ejecución y se publican
+al final; el punto de control registra la ejecución pendiente para completarla si el
+proceso se interrumpe durante la publicación.
+
+Cada archivo fuente aparece una sola vez en los conjuntos de datos. Un índice
+`source_file` → parte registra dónde quedaron sus filas; cuando un archivo se reprocesa y
+su resultado vuelve a compactarse, las partes que contenían su versión anterior se
+reescriben sin esas filas (o se eliminan si quedan vacías) y se publican junto con las
+partes nuevas.
+
+Solo una compactación trabaja a la vez: cada ejecución toma un turno exclusivo en
+`LEASE_BLOB` con una escritura condicionada, y las que no lo obtienen terminan sin cambios.
+Con el mismo turno se fusionan las partes pendientes del conjunto de datos unificado y
+los deltas del índice de identificadores.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+from datetime import datetime, timezone
+
+import pandas as pd
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+import config
+from .checkpoint import load_checkpoint, save_checkpoint
+from .schema_validator import align_to_schema
+from .stack_writer import build_stack_dataframe, read_stack, PARQUET_CONTENT_TYPE
+from .storage_backend import get_storage, ObjectInfo
+from .unified_dataset import merge_unified_dataset
+from .identifier_index import compact_identifier_index
+
+logger = logging.getLogger(__name__)
+
+DESTINATION_BUCKET = "data-framed-sieve"
+PROCESSED_RESULTS_FOLDER = "processed/processed_results/"
+FINAL_REPORTS_FOLDER = "final_reports/"
+COMPACTED_FOLDER = "curated/compacted/"
+STAGING_FOLDER = f"{COMPACTED_FOLDER}_staging/"
+CHECKPOINT_BLOB = "processed/_checkpoints/compaction.json"
+LEASE_BLOB = "processed/_checkpoints/compaction.lease"
+SOURCES_INDEX_TEMPLATE = "processed/_checkpoints/compaction_sources-{}.parquet"
+
+NO_REPORT_TYPE = "sin_reporte"
+# Relación inicial estimada entre el tamaño en Parquet y el tamaño en memoria
+INITIAL_COMPRESSION_RATIO = 0.25
+
+
+class _PartitionWriter:
+    """
+    Acumula DataFrames por partición y los escribe en partes de tamaño cercano al objetivo.
+    """
+
+    def __init__(self, bucket_name: str, run_id: str, dataset: str, target_bytes: int):
+        self._bucket_name = bucket_name
+        self._run_id = run_id
+        self._dataset = dataset
+        self._target_bytes = target_bytes
+        self._compression_ratio = INITIAL_COMPRESSION_RATIO
+        self._buffers = {}
+        self._sequence = 0
+        self.staged_blobs = []
+        self.sources = []
+
+    def add(self, partition: tuple, df: pd.DataFrame):
+        frames, memory_bytes = self._buffers.get(partition, ([], 0))
+        frames.append(df)
+        memory_bytes += int(df.memory_usage(deep=True).sum())
+        self._buffers[partition] = (frames, memory_bytes)
+        # El umbral en memoria se ajusta con la compresión observada en las partes previas
+        if memory_bytes * self._compression_ratio >= self._target_bytes:
+            self._flush(partition)
+
+    def flush_all(self):
+        for partition in list(self._buffers):
+            self._flush(partition)
+
+    def _flush(self, partition: tuple):
+        frames, memory_bytes = self._buffers.pop(partition)
+        date, report_type = partition
+        self._sequence += 1
+        blob_name = (
+            f"{STAGING_FOLDER}{self._run_id}/{self._dataset}/date={date}/report_type={report_type}/"
+            f"part-{self._run_id}-{self._sequence:05d}.parquet"
+        )
+        df = pd.concat(frames, ignore_index=True)
+        with get_storage().open_write(self._bucket_name, blob_name, PARQUET_CONTENT_TYPE) as stream:
+            df.to_parquet(stream, index=False, engine='pyarrow', compression=config.PARQUET_COMPRESSION)
+            written_bytes = stream.tell()
+        if memory_bytes:
+            self._compression_ratio = max(0.01, written_bytes / memory_bytes)
+        self.staged_blobs.append(blob_name)
+        published_name = _published_name(self._run_id, blob_name)
+        self.sources.extend((source_file, published_name) for source_file in df['source_file'].unique())
+        logger.info(f"Parte compactada escrita: {blob_name} ({written_bytes} bytes).")
+
+
+def _published_name(run_id: str, staged_name: str) -> str:
+    return f"{COMPACTED_FOLDER}{staged_name[len(f'{STAGING_FOLDER}{run_id}/'):]}"
+
+
+def _is_after(blob: ObjectInfo, watermark: dict) -> bool:
+    if not watermark:
+        return True
+    updated = blob.updated.isoformat()
+    return (updated, blob.name) > (watermark['updated'], watermark['name'])
+
+
+def _report_records(json_data: dict, source_file: str, final_report: str) -> pd.DataFrame:
+    report = (json_data.get('generated_report') or {}) if isinstance(json_data, dict) else {}
+    findings = report.get('findings') or {}
+    return pd.DataFrame({
+        'source_file': [source_file],
+        'observations': [findings.get('observations')],
+        'key_points': [json.dumps(findings.get('key_points') or [], ensure_ascii=False)],
+        'variables_and_standards': [json.dumps(report.get('variables_and_standards') or [], ensure_ascii=False)],
+        'final_report': [final_report],
+    }).astype('string')
+
+
+def _publish_run(bucket_name: str, run_id: str):
+    """
+    Copia las partes de la ejecución a su ubicación final y elimina la carpeta temporal.
+    La operación es idempotente para poder repetirse tras una interrupción.
+    """
+    published = 0
+    for blob in get_storage().list(bucket_name, prefix=f"{STAGING_FOLDER}{run_id}/"):
+        destination_name = _published_name(run_id, blob.name)
+        get_storage().copy(bucket_name, blob.name, bucket_name, destination_name)
+        get_storage().delete(bucket_name, blob.name)
+        published += 1
+    logger.info(f"Ejecución de compactación {run_id} publicada: {published} parte(s).")
+
+
+def _delete_if_exists(bucket_name: str, blob_name: str):
+    try:
+        get_storage().delete(bucket_name, blob_name)
+    except NotFound:
+        pass
+
+
+def _load_sources(bucket_name: str, state: dict) -> pd.DataFrame:
+    """
+    Carga el índice `source_file` → parte publicada del punto de control.
+    """
+    if not state.get('sources'):
+        return pd.DataFrame({'source_file': pd.Series(dtype='string'), 'part': pd.Series(dtype='string')})
+    return read_stack(bucket_name, state['sources'])
+
+
+def _stage_replacements(bucket_name: str, run_id: str, sources: pd.DataFrame, replaced: set) -> list:
+    """
+    Reescribe en la carpeta temporal de la ejecución las partes publicadas que contienen
+    versiones anteriores de los archivos reemplazados, sin las filas de esos archivos. Al
+    publicarse, la copia sustituye a la parte original.
+
+    Returns:
+        list: Las partes que quedan vacías y deben eliminarse tras la publicación.
+    """
+    emptied = []
+    for part in sources.loc[sources['source_file'].isin(replaced), 'part'].unique():
+        try:
+            df = read_stack(bucket_name, part)
+        except NotFound:
+            continue
+        df = df[~df['source_file'].isin(replaced)]
+        if df.empty:
+            emptied.append(part)
+            continue
+        staged_name = f"{STAGING_FOLDER}{run_id}/{part[len(COMPACTED_FOLDER):]}"
+        with get_storage().open_write(bucket_name, staged_name, PARQUET_CONTENT_TYPE) as stream:
+            df.to_parquet(stream, index=False, engine='pyarrow', compression=config.PARQUET_COMPRESSION)
+        logger.info(f"Parte {part} reescrita sin las versiones anteriores de {len(replaced)} archivo(s).")
+    return emptied
+
+
+def _finish_run(bucket_name: str, pending: dict) -> dict:
+    """
+    Publica una ejecución registrada, elimina las partes vaciadas y adopta su índice de
+    archivos fuente. Es idempotente para poder repetirse tras una interrupción.
+    """
+    _publish_run(bucket_name, pending['run_id'])
+    for part in pending.get('emptied', []):
+        _delete_if_exists(bucket_name, part)
+    state = {'watermark': pending['watermark'], 'sources': pending.get('sources')}
+    save_checkpoint(bucket_name, CHECKPOINT_BLOB, state)
+    previous = pending.get('previous_sources')
+    if previous and previous != state['sources']:
+        _delete_if_exists(bucket_name, previous)
+    return state
+
+
+def _discard_abandoned_runs(bucket_name: str):
+    """
+    Elimina las partes temporales de ejecuciones interrumpidas antes de registrarse. Solo
+    se descartan las partes más antiguas que el turno, por si una ejecución que lo perdió
+    por tardar demasiado todavía está escribiendo.
+    """
+    cutoff = time.time() - config.COMPACTION_LEASE_SECONDS
+    for blob in get_storage().list(bucket_name, prefix=STAGING_FOLDER):
+        if blob.updated is not None and blob.updated.timestamp() > cutoff:
+            continue
+        logger.info(f"Eliminando parte temporal abandonada: {blob.name}")
+        get_storage().delete(bucket_name, blob.name)
+
+
+def _acquire_lease(bucket_name: str, run_id: str) -> bool:
+    """
+    Toma el turno exclusivo de compactación. Retorna False si otra ejecución lo tiene.
+    """
+    generation = 0
+    info = get_storage().metadata(bucket_name, LEASE_BLOB)
+    if info is not None:
+        try:
+            current = json.loads(get_storage().read_text(bucket_name, LEASE_BLOB))
+        except NotFound:
+            current = None
+        if current is not None:
+            if current.get('expires_at', 0) > time.time():
+                logger.warning(f"La compactación {current.get('run_id')} sigue en curso; se omite esta ejecución.")
+                return False
+            logger.warning(f"El turno de la compactación {current.get('run_id')} venció; se toma para {run_id}.")
+            generation = info.generation
+    lease = {'run_id': run_id, 'expires_at': time.time() + config.COMPACTION_LEASE_SECONDS}
+    try:
+        get_storage().write(
+            bucket_name, LEASE_BLOB, json.dumps(lease), content_type='application/json', if_generation_match=generation
+        )
+    except PreconditionFailed:
+        logger.warning("Otra compactación tomó el turno al mismo tiempo; se omite esta ejecución.")
+        return False
+    return True
+
+
+def _release_lease(bucket_name: str, run_id: str):
+    try:
+        current = json.loads(get_storage().read_text(bucket_name, LEASE_BLOB))
+        if current.get('run_id') == run_id:
+            get_storage().delete(bucket_name, LEASE_BLOB)
+    except NotFound:
+        pass
+    except Exception as e:
+        logger.error(f"No se pudo liberar el turno de compactación de {run_id}: {e}")
+
+
+def compact_outputs(bucket_name: str = DESTINATION_BUCKET, max_files: int = None) -> dict:
+    """
+    Compacta los resultados nuevos desde el último punto de control.
+
+    Args:
+        bucket_name (str): Bucket con los resultados procesados.
+        max_files (int): Número máximo de resultados a compactar en esta ejecución (opcional).
+
+    Returns:
+        dict: El estado final del punto de control.
+    """
+    run_id = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    if not _acquire_lease(bucket_name, run_id):
+        return load_checkpoint(bucket_name, CHECKPOINT_BLOB)
+    try:
+        state = _compact(bucket_name, max_files, run_id)
+        if config.UNIFIED_DATASET_ENABLED:
+            try:
+                merge_unified_dataset(bucket_name)
+            except Exception as e:
+                logger.error(f"No se pudieron fusionar las partes del conjunto unificado: {e}")
+        if config.IDENTIFIER_INDEX_ENABLED:
+            try:
+                compact_identifier_index(bucket_name)
+            except Exception as e:
+                logger.error(f"No se pudo compactar el índice de identificadores: {e}")
+        return state
+    finally:
+        _release_lease(bucket_name, run_id)
+
+
+def _compact(bucket_name: str, max_files: int, run_id: str) -> dict:
+    state = load_checkpoint(bucket_name, CHECKPOINT_BLOB)
+
+    # Completa la publicación de una ejecución que se interrumpió tras registrarse
+    pending = state.get('pending')
+    if pending:
+        logger.info(f"Completando la ejecución de compactación pendiente {pending['run_id']}.")
+        state = _finish_run(bucket_name, pending)
+    _discard_abandoned_runs(bucket_name)
+
+    watermark = state.get('watermark')
+    candidates = [
+        blob for blob in get_storage().list(bucket_name, prefix=PROCESSED_RESULTS_FOLDER)
+        if blob.name.endswith('.json') and _is_after(blob, watermark)
+    ]
+    candidates.sort(key=lambda blob: (blob.updated.isoformat(), blob.name))
+    if max_files:
+        candidates = candidates[:max_files]
+    if not candidates:
+        logger.info("No hay resultados nuevos para compactar.")
+        return state
+
+    rows_writer = _PartitionWriter(bucket_name, run_id, 'rows', config.COMPACTION_TARGET_FILE_BYTES)
+    reports_writer = _PartitionWriter(bucket_name, run_id, 'reports', config.COMPACTION_TARGET_FILE_BYTES)
+
+    for blob in candidates:
+        source_file = os.path.splitext(os.path.basename(blob.name))[0]
+        try:
+            json_data = json.loads(get_storage().read_text(bucket_name, blob.name))
+        except Exception as e:
+            logger.error(f"No se pudo leer el resultado {blob.name}: {e}")
+            continue
+
+        report_type = NO_REPORT_TYPE
+        if isinstance(json_data, dict):
+            report_type = (json_data.get('generated_report') or {}).get('report_type') or NO_REPORT_TYPE
+        partition = (blob.updated.date().isoformat(), str(report_type).replace('/', '_'))
+
+        df = build_stack_dataframe(json_data, blob.name)
+        if df is not None:
+            rows = align_to_schema(df)
+            rows.insert(0, 'source_file', pd.Series(source_file, index=rows.index, dtype='string'))
+            rows_writer.add(partition, rows)
+
+        final_report_name = f"{FINAL_REPORTS_FOLDER}{source_file}_report.txt"
+        try:
+            final_report = get_storage().read_text(bucket_name, final_report_name)
+        except NotFound:
+            final_report = None
+        reports_writer.add(partition, _report_records(json_data, source_file, final_report))
+
+    rows_writer.flush_all()
+    reports_writer.flush_all()
+
+    # Las versiones anteriores de los archivos reprocesados se retiran de sus partes
+    new_sources = pd.DataFrame(rows_writer.sources + reports_writer.sources, columns=['source_file', 'part'])
+    sources = _load_sources(bucket_name, state)
+    replaced = set(new_sources['source_file']) & set(sources['source_file'])
+    emptied = _stage_replacements(bucket_name, run_id, sources, replaced) if replaced else []
+    sources = pd.concat([sources[~sources['source_file'].isin(replaced)], new_sources], ignore_index=True)
+    sources_name = SOURCES_INDEX_TEMPLATE.format(run_id)
+    with get_storage().open_write(bucket_name, sources_name, PARQUET_CONTENT_TYPE) as stream:
+        sources.astype('string').to_parquet(stream, index=False, engine='pyarrow')
+
+    # Registra la ejecución antes de publicarla para poder completarla si se interrumpe
+    last = candidates[-1]
+    pending = {
+        'run_id': run_id,
+        'watermark': {'updated': last.updated.isoformat(), 'name': last.name},
+        'emptied': emptied,
+        'sources': sources_name,
+        'previous_sources': state.get('sources'),
+    }
+    save_checkpoint(bucket_name, CHECKPOINT_BLOB, {**state, 'pending': pending})
+    state = _finish_run(bucket_name, pending)
+
+    logger.info(
+        f"Compactación finalizada: {len(candidates)} resultado(s) en "
+        f"{len(rows_writer.staged_blobs) + len(reports_writer.staged_blobs)} parte(s); "
+        f"{len(replaced)} archivo(s) reemplazado(s)."
+    )
+    return state
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compacta los resultados procesados en Parquet particionado.")
+    parser.add_argument("--bucket", default=DESTINATION_BUCKET)
+    parser.add_argument("--max-files", type=int, default=None)
+    args = parser.parse_args()
+    compact_outputs(args.bucket, args.max_files)
@@ -6,7 +6,9 @@ import json
 import logging
 import os
 import io # Importación para manejar archivos en memoria
-from google.cloud import storage
+import copy
+import difflib
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import vertexai
 from vertexai.generative_models import GenerativeModel
 from google.api_core.exceptions import NotFound
@@ -17,6 +19,14 @@ import docx
 
 # Importamos el esquema desde el nuevo archivo
 from .schema import data_schema_manager
+from .micro_batcher import MicroBatcher
+from .minhash_index import MinHashIndex
+from .storage_backend import get_storage
+from .deadline import DeadlineExceeded
+from .circuit_breaker import get_breaker, DependencyUnavailable
+from .gemini_client import generate_content
+from . import tracing
+import config
 
 # Configuración de logging
 logger = logging.getLogger(__name__)
@@ -32,9 +42,22 @@ if not PROJECT_ID or not LOCATION:
 vertexai.init(project=PROJECT_ID, location=LOCATION)
 
 # Cargar el modelo de Gemini
-model = GenerativeModel("gemini-2.5-flash-lite")
+MODEL_NAME = "gemini-2.5-flash-lite"
+model = GenerativeModel(MODEL_NAME)
 
-def process_data(bucket_name: str, file_name: str, file_info: dict, text_content: str = None):
+# El esquema serializado es el mismo para todas las solicitudes
+SCHEMA_PROMPT = json.dumps(data_schema_manager, ensure_ascii=False)
+
+PACKED_PROMPT_INSTRUCTIONS = (
+    "A continuación se incluyen varios documentos independientes. Cada documento comienza con "
+    "la línea '<<<DOCUMENTO n>>>' y termina con la línea '<<<FIN DOCUMENTO n>>>'. Aplica el esquema "
+    "anterior a cada documento por separado, sin mezclar datos entre documentos. La salida debe ser "
+    "un solo objeto JSON con la clave 'documents', cuyo valor es una lista con un elemento por documento. "
+    "Cada elemento debe contener 'document_index' (el número n del documento) y 'result' (el objeto JSON "
+    "que se ajusta al esquema para ese documento)."
+)
+
+def process_data(bucket_name: str, file_name: str, file_info: dict, text_content: str = None, deadline=None):
     """
     Función principal para procesar archivos de texto o datos.
     Descarga el archivo de Cloud Storage, lo analiza con Gemini y retorna el resultado.
@@ -44,6 +67,8 @@ def process_data(bucket_name: str, file_name: str, file_info: dict, text_content
         file_name (str): El nombre del archivo a procesar.
         file_info (dict): Información del archivo, incluyendo su tipo.
         text_content (str): Texto extraído previamente de la imagen (opcional).
+        deadline (Deadline): Plazo del evento (opcional). Si se agota durante el análisis,
+            se lanza `DeadlineExceeded` con el texto extraído como estado parcial.
     """
     extracted_text = ""
 
@@ -54,42 +79,15 @@ def process_data(bucket_name: str, file_name: str, file_info: dict, text_content
     else:
         # Si no se ha proporcionado texto, descargamos el archivo y lo procesamos.
         try:
+            if deadline:
+                deadline.check('extraction')
             logger.info(f"Procesando archivo de tipo '{file_info['file_type']}' desde el bucket '{bucket_name}'.")
-
-            storage_client = storage.Client()
-            bucket = storage_client.bucket(bucket_name)
-            blob = bucket.blob(file_name)
-
-            try:
-                file_bytes = blob.download_as_bytes()
-                logger.info(f"Contenido del archivo '{file_name}' descargado exitosamente.")
-            except NotFound as e:
-                logger.error(f"Error 404: El archivo '{file_name}' no fue encontrado en el bucket '{bucket_name}'.")
-                return None
-            except Exception as e:
-                logger.error(f"Error desconocido al descargar el archivo '{file_name}': {e}")
-                raise
-
-            real_mime_type = file_info.get('real_mime_type')
-
-            if real_mime_type == 'application/pdf':
-                pdf_file = io.BytesIO(file_bytes)
-                reader = PyPDF2.PdfReader(pdf_file)
-                for page in reader.pages:
-                    extracted_text += page.extract_text() or ""
-            elif real_mime_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-                doc_file = io.BytesIO(file_bytes)
-                doc = docx.Document(doc_file)
-                for paragraph in doc.paragraphs:
-                    extracted_text += paragraph.text + "\n"
-            elif file_info.get('file_type') in ['text', 'data']:
-                extracted_text = file_bytes.decode('utf-8')
-                if real_mime_type == 'application/json':
-                    extracted_text = json.dumps(json.loads(extracted_text), indent=2)
-            else:
-                logger.warning(f"Tipo de archivo no soportado para extracción de texto: {file_name}")
+            extracted_text = _extract_text(bucket_name, file_name, file_info)
+            if extracted_text is None:
                 return None
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error en la función 'process_data': {e}")
             raise
@@ -98,8 +96,14 @@ def process_data(bucket_name: str, file_name: str, file_info: dict, text_content
         logger.warning(f"No se pudo extraer texto del archivo: {file_name}")
         return None
 
-    prompt_data = json.dumps(data_schema_manager, ensure_ascii=False)
-    analysis_result = _process_text_with_gemini(extracted_text, prompt_data)
+    try:
+        if config.DEDUP_ENABLED and len(extracted_text) <= config.DEDUP_MAX_TEXT_CHARS:
+            analysis_result = _analyze_with_near_duplicates(file_name, file_info, extracted_text, text_content, deadline)
+        else:
+            analysis_result = _analyze_text(file_info, extracted_text, text_content, deadline)
+    except (DeadlineExceeded, DependencyUnavailable) as e:
+        # El texto extraído permite reanudar sin repetir la descarga ni la extracción
+        raise e.with_partial({'text': extracted_text}) from e
 
     if "error" not in analysis_result:
         return analysis_result
@@ -107,35 +111,232 @@ def process_data(bucket_name: str, file_name: str, file_info: dict, text_content
         logger.error(f"Error durante el análisis del texto: {analysis_result['error']}")
         return None
 
-def _process_text_with_gemini(text_to_process: str, prompt_data: str) -> dict:
+
+@tracing.traced('extraction', result_attributes=lambda text: {'text.chars': len(text or '')})
+def _extract_text(bucket_name: str, file_name: str, file_info: dict) -> str:
+    """
+    Descarga el archivo y extrae su texto según el tipo MIME real.
+
+    Returns:
+        str: El texto extraído, o None si el archivo no existe o su tipo no es soportado.
+    """
+    extracted_text = ""
+
+    try:
+        file_bytes = get_storage().read(bucket_name, file_name)
+        logger.info(f"Contenido del archivo '{file_name}' descargado exitosamente.")
+    except NotFound as e:
+        logger.error(f"Error 404: El archivo '{file_name}' no fue encontrado en el bucket '{bucket_name}'.")
+        return None
+    except Exception as e:
+        logger.error(f"Error desconocido al descargar el archivo '{file_name}': {e}")
+        raise
+
+    real_mime_type = file_info.get('real_mime_type')
+
+    if real_mime_type == 'application/pdf':
+        pdf_file = io.BytesIO(file_bytes)
+        reader = PyPDF2.PdfReader(pdf_file)
+        for page in reader.pages:
+            extracted_text += page.extract_text() or ""
+    elif real_mime_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
+        doc_file = io.BytesIO(file_bytes)
+        doc = docx.Document(doc_file)
+        for paragraph in doc.paragraphs:
+            extracted_text += paragraph.text + "\n"
+    elif file_info.get('file_type') in ['text', 'data']:
+        extracted_text = file_bytes.decode('utf-8')
+        if real_mime_type == 'application/json':
+            extracted_text = json.dumps(json.loads(extracted_text), indent=2)
+    else:
+        logger.warning(f"Tipo de archivo no soportado para extracción de texto: {file_name}")
+        return None
+
+    return extracted_text
+
+
+def _analyze_text(file_info: dict, extracted_text: str, text_content: str = None, deadline=None) -> dict:
+    """
+    Envía el texto a Gemini, empaquetado con otros documentos pequeños si es posible.
+    """
+    if _is_packable(file_info, extracted_text, text_content):
+        timeout = deadline.slice('gemini') if deadline else None
+        try:
+            return _prompt_packer.submit(extracted_text, weight=len(extracted_text), timeout=timeout)
+        except FutureTimeoutError:
+            # El documento se retira del lote si aún no se envió; si ya se envió, se descarta su resultado
+            raise DeadlineExceeded('gemini')
+    return _process_text_with_gemini(extracted_text, SCHEMA_PROMPT, deadline)
+
+
+def _analyze_with_near_duplicates(file_name: str, file_info: dict, extracted_text: str, text_content: str = None, deadline=None) -> dict:
+    """
+    Reutiliza la extracción de un documento con el mismo contenido ya procesado. Si el
+    documento solo es parecido, envía al modelo las diferencias junto con el resultado
+    previo: dos facturas casi idénticas pueden diferir justo en los importes o las fechas.
+    """
+    exact = _near_duplicate_index.find_exact(extracted_text)
+    if exact:
+        logger.info(f"Reutilizando la extracción de '{exact.key}' para '{file_name}' (contenido idéntico).")
+        return copy.deepcopy(exact.result)
+
+    signature = _near_duplicate_index.signature(extracted_text)
+    match = _near_duplicate_index.query(extracted_text, signature)
+
+    analysis_result = None
+    if match and match.similarity >= config.DEDUP_DELTA_THRESHOLD:
+        logger.info(f"Enviando solo las diferencias respecto de '{match.key}' para '{file_name}' (similitud {match.similarity:.2f}).")
+        analysis_result = _process_delta_with_gemini(match.text, match.result, extracted_text, deadline)
+        if analysis_result is not None and "error" in analysis_result:
+            logger.warning(f"No se pudo procesar el documento por diferencias: {analysis_result['error']}")
+            analysis_result = None
+
+    if analysis_result is None:
+        analysis_result = _analyze_text(file_info, extracted_text, text_content, deadline)
+
+    if "error" not in analysis_result:
+        _near_duplicate_index.add(file_name, extracted_text, copy.deepcopy(analysis_result), signature)
+    return analysis_result
+
+
+def _process_delta_with_gemini(previous_text: str, previous_result: dict, new_text: str, deadline=None):
+    """
+    Actualiza el resultado de un documento previo con las líneas que cambiaron en el nuevo.
+    Retorna None si las diferencias no son más pequeñas que el documento completo.
+    """
+    diff_lines = difflib.unified_diff(previous_text.splitlines(), new_text.splitlines(), lineterm="", n=0)
+    diff_text = "\n".join(diff_lines)
+    if not diff_text or len(diff_text) >= len(new_text) // 2:
+        return None
+
+    delta_prompt = (
+        f"{SCHEMA_PROMPT}\n\n"
+        "El documento a analizar es casi idéntico a uno procesado anteriormente. Este es el resultado "
+        "JSON obtenido para el documento anterior:\n"
+        f"{json.dumps(previous_result, ensure_ascii=False)}\n\n"
+        "Las diferencias se indican en formato diff unificado: las líneas con '-' solo existían en el "
+        "documento anterior y las líneas con '+' solo existen en el nuevo. Devuelve el objeto JSON completo "
+        "que corresponde al documento nuevo, actualizando únicamente los valores afectados por las diferencias."
+    )
+    return _process_text_with_gemini(diff_text, delta_prompt, deadline)
+
+
+def _process_text_with_gemini(text_to_process: str, prompt_data: str, deadline=None, timeout: float = None) -> dict:
     """
     Función auxiliar privada para procesar el texto con Gemini.
+    Con un plazo, la solicitud se acota a la porción de la etapa 'gemini'; sin plazo, a
+    `timeout` si se indica.
     """
     try:
         combined_prompt = f"{prompt_data}\n\nTexto a analizar:\n{text_to_process}"
         logger.info("Enviando solicitud a Gemini...")
-        response = model.generate_content(combined_prompt,
-            generation_config= {
-                "response_mime_type": "application/json"
-            }
-        )
-        response_text = response.text.strip()
+        generation_config = {
+            "response_mime_type": "application/json"
+        }
+        # Mientras Vertex AI no responde, el interruptor falla de inmediato
+        vertex = get_breaker('vertex')
+        with tracing.span('gemini', **{'gen_ai.request.model': MODEL_NAME}) as current:
+            current.add('bytes.in', len(combined_prompt.encode('utf-8')))
+            response = vertex.call(
+                generate_content, model, combined_prompt, deadline=deadline, timeout=timeout,
+                generation_config=generation_config,
+            )
+            response_text = response.text.strip()
+            current.add('bytes.out', len(response_text.encode('utf-8')))
+            tracing.record_usage(response)
         logger.info("Respuesta de Gemini recibida.")
 
-        # Buscar el inicio y fin del objeto JSON para un parsing seguro
-        start_index = response_text.find('{')
-        end_index = response_text.rfind('}')
-        if start_index == -1 or end_index == -1:
-            logger.error("No se encontró un JSON válido en la respuesta del modelo.")
-            return {"error": "Invalid JSON response from model", "response": response_text}
+        return _parse_json_response(response_text)
+    except (DeadlineExceeded, DependencyUnavailable):
+        raise
+    except Exception as e:
+        return {"error": str(e)}
 
-        json_string = response_text[start_index:end_index+1]
 
-        try:
-            processed_data = json.loads(json_string)
-            return processed_data
-        except json.JSONDecodeError:
-            logger.error("La respuesta del modelo no es un JSON válido después de la limpieza.")
-            return {"error": "Invalid JSON response from model after cleaning", "response": json_string}
-    except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+def _parse_json_response(response_text: str) -> dict:
+    """
+    Extrae el objeto JSON de la respuesta del modelo.
+    """
+    # Buscar el inicio y fin del objeto JSON para un parsing seguro
+    start_index = response_text.find('{')
+    end_index = response_text.rfind('}')
+    if start_index == -1 or end_index == -1:
+        logger.error("No se encontró un JSON válido en la respuesta del modelo.")
+        return {"error": "Invalid JSON response from model", "response": response_text}
+
+    json_string = response_text[start_index:end_index+1]
+
+    try:
+        processed_data = json.loads(json_string)
+        return processed_data
+    except json.JSONDecodeError:
+        logger.error("La respuesta del modelo no es un JSON válido después de la limpieza.")
+        return {"error": "Invalid JSON response from model after cleaning", "response": json_string}
+
+
+def _is_packable(file_info: dict, extracted_text: str, text_content: str = None) -> bool:
+    """
+    Indica si el documento es lo bastante pequeño para compartir solicitud con otros.
+    """
+    if not config.PROMPT_PACKING_ENABLED or text_content:
+        return False
+    if file_info.get('real_mime_type') not in config.PROMPT_PACKING_MIME_TYPES:
+        return False
+    return len(extracted_text) <= config.PROMPT_PACKING_MAX_DOCUMENT_CHARS
+
+
+def _process_packed_texts(texts: list) -> list:
+    """
+    Procesa varios documentos pequeños en una sola solicitud a Gemini y separa la respuesta
+    en un resultado por documento. Los documentos cuya respuesta no se pueda separar se
+    procesan de forma individual.
+
+    El lote no tiene el plazo de un solo archivo: cada solicitud se acota al límite de la
+    etapa 'gemini', y cada archivo deja de esperar cuando se agota su propio plazo.
+    """
+    timeout = config.DEADLINE_STAGE_SECONDS['gemini']
+    if len(texts) == 1:
+        return [_process_text_with_gemini(texts[0], SCHEMA_PROMPT, timeout=timeout)]
+
+    documents = "\n\n".join(
+        f"<<<DOCUMENTO {index}>>>\n{text}\n<<<FIN DOCUMENTO {index}>>>"
+        for index, text in enumerate(texts)
+    )
+    packed_prompt = f"{SCHEMA_PROMPT}\n\n{PACKED_PROMPT_INSTRUCTIONS}"
+    packed_result = _process_text_with_gemini(documents, packed_prompt, timeout=timeout)
+
+    results = [None] * len(texts)
+    if "error" in packed_result:
+        logger.warning(f"No se pudo procesar el lote empaquetado: {packed_result['error']}")
+    else:
+        for document in packed_result.get("documents") or []:
+            if not isinstance(document, dict):
+                continue
+            index = document.get("document_index")
+            result = document.get("result")
+            if isinstance(index, int) and 0 <= index < len(texts) and isinstance(result, dict):
+                results[index] = result
+
+    missing = [index for index, result in enumerate(results) if result is None]
+    if missing:
+        logger.warning(f"Procesando de forma individual {len(missing)} de {len(texts)} documentos del lote empaquetado.")
+    for index in missing:
+        results[index] = _process_text_with_gemini(texts[index], SCHEMA_PROMPT, timeout=timeout)
+
+    return results
+
+
+_near_duplicate_index = MinHashIndex(
+    num_perm=config.DEDUP_NUM_PERM,
+    bands=config.DEDUP_BANDS,
+    shingle_size=config.DEDUP_SHINGLE_SIZE,
+    max_entries=config.DEDUP_MAX_ENTRIES,
+)
+
+_prompt_packer = MicroBatcher(
+    _process_packed_texts,
+    window_seconds=config.PROMPT_PACKING_WINDOW_SECONDS,
+    max_items=config.PROMPT_PACKING_MAX_DOCUMENTS,
+    max_weight=config.PROMPT_PACKING_MAX_BATCH_CHARS,
+    name="lote de documentos empaquetados",
+)
\ No newline at end of file
@@ -1,8 +1,18 @@
 import os
 import json
+import time
 import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from google.cloud import storage
+
+import config
+from .schema_validator import coerce_dataframe
+from .stack_writer import build_stack_dataframe, save_stack
+from .report_builder import build_raw_report
+from .identifier_index import index_stack
+from .checkpoint import load_checkpoint, save_checkpoint
+from .storage_backend import get_storage, ObjectInfo
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
@@ -13,29 +23,29 @@ BUCKET_NAME = "data_lake_sieve"
 SOURCE_FOLDER = "processed/processed_results/"
 DESTINATION_FOLDER = "data_lake_sieve/curated/structured_results/" 
 
+# Ubicaciones de la rematerialización masiva de los stacks y reportes
+RESULTS_BUCKET = "data-framed-sieve"
+STACKS_FOLDER = "processed/stacks/"
+RAW_REPORTS_FOLDER = "processed/raw_reports/"
+REMATERIALIZE_CHECKPOINT_BLOB = "processed/_checkpoints/rematerialize.json"
+
 def process_json_event(bucket_name: str, file_name: str):
     """
     Procesa un solo archivo JSON de Cloud Storage, lo convierte en un DataFrame de Pandas
-    y guarda el resultado como CSV.
+    y guarda el resultado como stack (CSV y/o Parquet).
 
     Args:
         bucket_name (str): El nombre del bucket de Google Cloud Storage.
         file_name (str): La ruta completa del archivo JSON a procesar.
     """
     try:
-        # Inicializa el cliente de Cloud Storage
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-
         # Procesa solo si el archivo está en la carpeta de origen y es un JSON
         if file_name.startswith(SOURCE_FOLDER) and file_name.endswith('.json'):
             logger.info(f"Procesando archivo JSON: {file_name}")
 
-            blob = bucket.blob(file_name)
-            
             try:
                 # Descarga el contenido del archivo JSON
-                json_content = blob.download_as_text()
+                json_content = get_storage().read_text(bucket_name, file_name)
                 
                 # Carga el contenido en un objeto de Python
                 data = json.loads(json_content)
@@ -46,15 +56,18 @@ def process_json_event(bucket_name: str, file_name: str):
                     
                     # Convierte la lista de diccionarios a un DataFrame de Pandas
                     df = pd.DataFrame.from_dict(table_data)
+
+                    # Convierte las columnas a los tipos declarados en el esquema
+                    df = coerce_dataframe(df)
                     
                     logger.info(f"DataFrame creado con {df.shape[0]} filas y {df.shape[1]} columnas.")
                     
-                    # Define la ruta de destino para el archivo CSV
-                    base_name = os.path.basename(file_name).replace('.json', '.csv')
+                    # Define la ruta de destino del stack, sin extensión
+                    base_name = os.path.basename(file_name).replace('.json', '')
                     destination_blob_name = os.path.join(DESTINATION_FOLDER, base_name)
 
-                    # Guarda el DataFrame en un archivo CSV en el bucket
-                    _save_dataframe_as_csv(df, bucket, destination_blob_name)
+                    # Guarda el DataFrame en los formatos configurados (Parquet y/o CSV)
+                    save_stack(df, bucket_name, destination_blob_name)
                 else:
                     logger.warning(f"El archivo {file_name} no contiene la estructura esperada.")
 
@@ -66,19 +79,94 @@ def process_json_event(bucket_name: str, file_name: str):
     except Exception as e:
         logger.error(f"Error general: {e}")
 
-def _save_dataframe_as_csv(df: pd.DataFrame, bucket: storage.Bucket, destination_blob_name: str):
+
+def _rematerialize_result(bucket_name: str, blob: ObjectInfo, outputs: list) -> bool:
     """
-    Guarda un DataFrame de Pandas como un archivo CSV en un bucket de GCS.
+    Regenera el stack y el reporte inicial de un resultado guardado, sin llamar al modelo.
+
+    Returns:
+        bool: True si el resultado se procesó sin errores.
     """
+    base_name = os.path.splitext(os.path.basename(blob.name))[0]
     try:
-        # Convierte el DataFrame a un CSV en memoria
-        csv_string = df.to_csv(index=False)
-        
-        # Sube la cadena CSV a Cloud Storage
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_string(csv_string, content_type='text/csv')
-        
-        logger.info(f"DataFrame guardado exitosamente como CSV en: {destination_blob_name}")
+        json_data = json.loads(get_storage().read_text(bucket_name, blob.name))
+
+        if 'stacks' in outputs:
+            df = build_stack_dataframe(json_data, blob.name)
+            if df is not None:
+                stack_blob_name = save_stack(df, bucket_name, f"{STACKS_FOLDER}{base_name}")
+                if config.IDENTIFIER_INDEX_ENABLED:
+                    index_stack(bucket_name, df, stack_blob_name)
+
+        if 'reports' in outputs:
+            report = build_raw_report(json_data)
+            if report:
+                get_storage().write(bucket_name, f"{RAW_REPORTS_FOLDER}{base_name}_report.txt", report, content_type='text/plain')
+        return True
     except Exception as e:
-        logger.error(f"Error al guardar el DataFrame como CSV: {e}")
+        logger.error(f"Error al rematerializar {blob.name}: {e}")
+        return False
+
+
+def rematerialize_outputs(bucket_name: str = RESULTS_BUCKET, outputs: list = None, workers: int = None,
+                          page_size: int = None, restart: bool = False) -> dict:
+    """
+    Regenera en paralelo los stacks y los reportes iniciales a partir de los resultados
+    guardados en `processed/processed_results/`. El progreso se guarda al terminar cada
+    página del listado, de modo que una ejecución interrumpida continúa donde quedó.
+
+    Args:
+        bucket_name (str): Bucket con los resultados procesados.
+        outputs (list): Salidas a regenerar: 'stacks' y/o 'reports'. Por defecto, ambas.
+        workers (int): Número de hilos de trabajo (opcional).
+        page_size (int): Resultados por página del listado (opcional).
+        restart (bool): Ignora el punto de control y comienza desde el inicio.
+
+    Returns:
+        dict: El estado final del punto de control.
+    """
+    outputs = outputs or ['stacks', 'reports']
+    workers = workers or config.REMATERIALIZE_WORKERS
+    page_size = page_size or config.REMATERIALIZE_PAGE_SIZE
+
+    state = {} if restart else load_checkpoint(bucket_name, REMATERIALIZE_CHECKPOINT_BLOB)
+    if state.get('done'):
+        logger.info("La rematerialización ya se completó. Usa `restart` para repetirla.")
+        return state
+    state.setdefault('processed', 0)
+    state.setdefault('failed', 0)
+
+    started_at = time.monotonic()
+    pages = get_storage().list_pages(bucket_name, prefix=SOURCE_FOLDER, page_size=page_size, page_token=state.get('page_token'))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for page, next_page_token in pages:
+            blobs = [blob for blob in page if blob.name.endswith('.json')]
+            results = list(executor.map(lambda blob: _rematerialize_result(bucket_name, blob, outputs), blobs))
+            state['processed'] += results.count(True)
+            state['failed'] += results.count(False)
+            state['page_token'] = next_page_token
+            save_checkpoint(bucket_name, REMATERIALIZE_CHECKPOINT_BLOB, state)
+
+            elapsed = time.monotonic() - started_at
+            logger.info(
+                f"Rematerialización: {state['processed']} resultado(s) procesados, {state['failed']} con error "
+                f"({len(blobs) / max(elapsed, 1e-6):.1f} resultados/s en la última página)."
+            )
+            started_at = time.monotonic()
+
+    state['done'] = True
+    state.pop('page_token', None)
+    save_checkpoint(bucket_name, REMATERIALIZE_CHECKPOINT_BLOB, state)
+    logger.info(f"Rematerialización finalizada: {state['processed']} resultado(s), {state['failed']} con error.")
+    return state
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regenera los stacks y reportes desde los resultados guardados.")
+    parser.add_argument("--bucket", default=RESULTS_BUCKET)
+    parser.add_argument("--outputs", nargs="+", choices=['stacks', 'reports'], default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--page-size", type=int, default=None)
+    parser.add_argument("--restart", action="store_true")
+    args = parser.parse_args()
+    rematerialize_outputs(args.bucket, args.outputs, args.workers, args.page_size, args.restart)
@@ -0,0 +1,113 @@
+"""
+Plazo total de procesamiento de un evento, repartido entre las etapas del flujo
+"""
+
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Una etapa no tiene tiempo suficiente para terminar dentro del plazo del evento.
+
+    Args:
+        stage (str): Etapa que se interrumpió.
+        partial (dict): Estado parcial con el que la etapa puede reanudarse (opcional).
+    """
+
+    def __init__(self, stage: str, partial: dict = None):
+        super().__init__(f"Se agotó el plazo del evento en la etapa '{stage}'.")
+        self.stage = stage
+        self.partial = dict(partial or {})
+
+    def with_partial(self, partial: dict):
+        """
+        Retorna una copia con estado parcial adicional. La misma excepción puede llegar a
+        varios archivos (por ejemplo, desde un lote compartido), por lo que no se modifica.
+        """
+        return DeadlineExceeded(self.stage, {**self.partial, **partial})
+
+
+class Deadline:
+    """
+    Plazo de un evento, creado al recibirlo y entregado a cada etapa del procesamiento.
+
+    Cada etapa obtiene una porción del tiempo restante, acotada por su límite en
+    `config.DEADLINE_STAGE_SECONDS`. Se reserva `config.DEADLINE_RESERVE_SECONDS` para
+    guardar el estado parcial antes de que la plataforma corte la solicitud.
+
+    Args:
+        seconds (float): Duración total del plazo.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """
+        Retorna los segundos disponibles para trabajar, descontada la reserva.
+        """
+        return max(0.0, self._expires_at - time.monotonic() - config.DEADLINE_RESERVE_SECONDS)
+
+    def slice(self, stage: str, partial: dict = None) -> float:
+        """
+        Retorna los segundos asignados a una etapa.
+
+        Raises:
+            DeadlineExceeded: Si el tiempo restante es menor que `config.DEADLINE_MIN_STAGE_SECONDS`.
+        """
+        seconds = self.remaining()
+        limit = config.DEADLINE_STAGE_SECONDS.get(stage)
+        if limit is not None:
+            seconds = min(seconds, limit)
+        if seconds < config.DEADLINE_MIN_STAGE_SECONDS:
+            raise DeadlineExceeded(stage, partial)
+        return seconds
+
+    def check(self, stage: str, partial: dict = None):
+        """
+        Verifica que una etapa todavía pueda comenzar.
+        """
+        self.slice(stage, partial)
+
+    def call(self, stage: str, fn, *args, partial: dict = None, **kwargs):
+        """
+        Ejecuta `fn(*args, **kwargs)` y espera su resultado durante la porción de la etapa.
+
+        Es el último recurso para las llamadas que no aceptan un tiempo de espera propio:
+        si el plazo se agota, la llamada se abandona y termina en segundo plano. Siempre
+        que la API lo permita, conviene pasarle la porción de `slice` como tiempo de espera.
+
+        Raises:
+            DeadlineExceeded: Si la llamada no termina a tiempo.
+        """
+        seconds = self.slice(stage, partial)
+        future = Future()
+
+        def _run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        # El hilo hereda el contexto del llamador (por ejemplo, el span de traza activo)
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(_run,), name=f"plazo-{stage}", daemon=True).start()
+        try:
+            return future.result(timeout=seconds)
+        except FutureTimeoutError:
+            if future.done():
+                # El error de tiempo de espera provino de la propia llamada
+                raise
+            logger.warning(f"La etapa '{stage}' no terminó en {seconds:.0f}s.")
+            raise DeadlineExceeded(stage, partial)
@@ -0,0 +1,220 @@
+"""
+Cola de archivos diferidos por la caída de una dependencia externa.
+
+Cada archivo diferido tiene una entrada en processed/_deferred/<bucket>/<archivo>.json con
+la dependencia que falló, el número de intentos y la hora del siguiente intento, que se
+aleja de forma exponencial. El archivo original permanece en su lugar.
+
+Un hilo de drenado por proceso revisa la cola periódicamente y reintenta los archivos
+vencidos. Mientras el interruptor de una dependencia no está cerrado, solo se reintenta
+un archivo de esa dependencia como prueba; cuando el interruptor se cierra, la cola se
+drena de inmediato sin esperar el resto de los plazos de espera.
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+import config
+from .storage_backend import get_storage
+from .circuit_breaker import breakers, get_breaker, CLOSED
+from .lane_scheduler import file_type_for
+
+logger = logging.getLogger(__name__)
+
+DESTINATION_BUCKET = "data-framed-sieve"
+DEFERRED_FOLDER = "processed/_deferred/"
+
+# Estado retornado por `process_file` cuando el archivo quedó diferido
+DEFERRED_STATUS = 202
+
+# Estados de `process_file` que resuelven el archivo: procesado (200) o enviado a cuarentena (500)
+RESOLVED_STATUSES = (200, 500)
+
+_lock = threading.Lock()
+_wake = threading.Event()
+_recovered = set()
+_drainer_pid = None
+
+
+def _entry_blob_name(bucket_name: str, file_name: str) -> str:
+    return f"{DEFERRED_FOLDER}{bucket_name}/{file_name}.json"
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(config.DEFERRED_BASE_BACKOFF_SECONDS * (2 ** (attempts - 1)), config.DEFERRED_MAX_BACKOFF_SECONDS)
+    # La variación evita que los archivos diferidos juntos se reintenten a la vez
+    return delay * random.uniform(0.8, 1.2)
+
+
+def defer_file(bucket_name: str, file_name: str, dependency: str, reason: str, retry_after: float = 0.0):
+    """
+    Agrega un archivo a la cola de diferidos, o actualiza su entrada si ya estaba.
+
+    Args:
+        bucket_name (str): Bucket del archivo original.
+        file_name (str): Ruta del archivo original.
+        dependency (str): Dependencia que no estaba disponible, o None si el archivo se
+            difirió por agotar el plazo de procesamiento.
+        reason (str): Descripción del error.
+        retry_after (float): Espera mínima sugerida por el interruptor.
+    """
+    blob_name = _entry_blob_name(bucket_name, file_name)
+    try:
+        previous = json.loads(get_storage().read_text(DESTINATION_BUCKET, blob_name))
+    except NotFound:
+        previous = {}
+
+    attempts = previous.get('attempts', 0) + 1
+    delay = max(_backoff(attempts), retry_after)
+    entry = {
+        'bucket': bucket_name,
+        'file_name': file_name,
+        'dependency': dependency,
+        'reason': reason,
+        'attempts': attempts,
+        'first_deferred_at': previous.get('first_deferred_at', time.time()),
+        'next_attempt_at': time.time() + delay,
+    }
+    get_storage().write(DESTINATION_BUCKET, blob_name, json.dumps(entry), content_type='application/json')
+    cause = f"la dependencia '{dependency}'" if dependency else "el plazo de procesamiento"
+    logger.warning(f"{file_name} diferido por {cause} (intento {attempts}); se reintentará en {delay:.0f}s.")
+
+
+def _claim(info, now: float, recovered: set):
+    """
+    Reserva una entrada para este proceso. Retorna la entrada, o None si otro proceso la
+    reservó primero o todavía no vence.
+    """
+    try:
+        entry = json.loads(get_storage().read_text(DESTINATION_BUCKET, info.name))
+    except NotFound:
+        return None
+    if entry.get('claimed_until', 0) > now:
+        return None
+    if entry['next_attempt_at'] > now and entry['dependency'] not in recovered:
+        return None
+    entry['claimed_until'] = now + config.DEFERRED_CLAIM_SECONDS
+    try:
+        get_storage().write(
+            DESTINATION_BUCKET, info.name, json.dumps(entry), content_type='application/json',
+            if_generation_match=info.generation,
+        )
+    except (PreconditionFailed, NotFound):
+        return None
+    return entry
+
+
+def drain_deferred(process_fn, lanes) -> int:
+    """
+    Reintenta los archivos diferidos que ya vencieron.
+
+    Args:
+        process_fn: Función `(bucket_name, file_name) -> (mensaje, estado)`, normalmente `process_file`.
+        lanes (LaneScheduler): Planificador donde se ejecutan los reintentos.
+
+    Returns:
+        int: El número de archivos reintentados.
+    """
+    with _lock:
+        recovered = set(_recovered)
+    now = time.time()
+    probing = set()
+    jobs = []
+    for info in get_storage().list(DESTINATION_BUCKET, prefix=DEFERRED_FOLDER):
+        if len(jobs) >= config.DEFERRED_DRAIN_BATCH:
+            break
+        entry = _claim(info, now, recovered)
+        if entry is None:
+            continue
+        dependency = entry['dependency']
+        if dependency and get_breaker(dependency).state != CLOSED and dependency not in recovered:
+            if dependency in probing:
+                # Solo un archivo por dependencia sirve de prueba mientras el interruptor no se cierre
+                _release(info.name, entry)
+                continue
+            probing.add(dependency)
+        future = lanes.submit(file_type_for(entry['file_name']), None, process_fn, entry['bucket'], entry['file_name'])
+        jobs.append((info.name, entry, future))
+
+    if len(jobs) < config.DEFERRED_DRAIN_BATCH:
+        # Con la cola recorrida completa, las dependencias recuperadas vuelven a respetar las esperas
+        with _lock:
+            _recovered.difference_update(recovered)
+
+    for blob_name, entry, future in jobs:
+        try:
+            _, status = future.result()
+        except Exception as e:
+            logger.error(f"Error no controlado al reintentar {entry['file_name']}: {e}")
+            continue
+        if status in RESOLVED_STATUSES:
+            # El archivo se procesó o quedó en cuarentena; su entrada ya no hace falta
+            _remove(blob_name)
+        elif status != DEFERRED_STATUS:
+            # Sin reentrega de Pub/Sub detrás, la entrada es lo único que volverá a intentarlo
+            _reschedule(entry, f"El reintento terminó con el estado {status}.")
+    if jobs:
+        logger.info(f"{len(jobs)} archivo(s) diferido(s) reintentado(s).")
+    return len(jobs)
+
+
+def _release(blob_name: str, entry: dict):
+    entry['claimed_until'] = 0
+    try:
+        get_storage().write(DESTINATION_BUCKET, blob_name, json.dumps(entry), content_type='application/json')
+    except Exception as e:
+        logger.error(f"No se pudo liberar la entrada diferida {blob_name}: {e}")
+
+
+def _reschedule(entry: dict, reason: str):
+    try:
+        defer_file(entry['bucket'], entry['file_name'], entry['dependency'], reason)
+    except Exception as e:
+        logger.error(f"No se pudo reprogramar el archivo diferido {entry['file_name']}: {e}")
+
+
+def _remove(blob_name: str):
+    try:
+        get_storage().delete(DESTINATION_BUCKET, blob_name)
+    except NotFound:
+        pass
+
+
+def _on_breaker_change(dependency: str, state: str):
+    if state == CLOSED:
+        with _lock:
+            _recovered.add(dependency)
+        _wake.set()
+
+
+def _drain_loop(process_fn, lanes):
+    while True:
+        _wake.wait(config.DEFERRED_DRAIN_INTERVAL)
+        _wake.clear()
+        try:
+            drain_deferred(process_fn, lanes)
+        except Exception as e:
+            logger.error(f"Error al drenar la cola de archivos diferidos: {e}")
+
+
+def start_deferred_drainer(process_fn, lanes):
+    """
+    Inicia el hilo de drenado de la cola en este proceso, si no se inició antes.
+    """
+    global _drainer_pid
+    if not config.DEFERRED_DRAIN_ENABLED:
+        return
+    with _lock:
+        if _drainer_pid == os.getpid():
+            return
+        _drainer_pid = os.getpid()
+    threading.Thread(target=_drain_loop, args=(process_fn, lanes), name="drenado-diferidos", daemon=True).start()
+
+
+for _breaker in breakers().values():
+    _breaker.add_listener(_on_breaker_change)
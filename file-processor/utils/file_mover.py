@@ -1,41 +1,63 @@
 import logging
 import os
-from google.cloud import storage
+from datetime import datetime, timezone
 from google.api_core.exceptions import NotFound
 
+from .storage_backend import get_storage
+
 # Configuración de logging
 logger = logging.getLogger(__name__)
 
+QUARANTINE_FOLDER = "quarantine/"
+
+# Límite de longitud del motivo guardado en los metadatos del objeto
+MAX_REASON_CHARS = 1024
+
+
+def reason_category(reason: str) -> str:
+    """
+    Retorna la categoría de un motivo de cuarentena: el texto antes del primer ':', sin
+    el detalle variable del error (por ejemplo, 'Error de procesamiento').
+    """
+    return (reason or '').split(':', 1)[0].strip() or 'Sin motivo registrado'
+
+
 def move_to_quarantine(bucket_name: str, file_name: str, reason: str, destination_bucket: str = None):
     """
     Mueve un archivo a la carpeta de cuarentena, opcionalmente a un bucket diferente.
+
+    El motivo, su categoría y la ubicación original se guardan en los metadatos del objeto
+    en cuarentena, para agrupar los archivos y restaurarlos después (ver `reprocess_quarantine.py`).
     """
     try:
-        storage_client = storage.Client()
-        source_bucket = storage_client.bucket(bucket_name)
-        
-        # Define el blob de origen
-        source_blob = source_bucket.blob(file_name)
+        storage_backend = get_storage()
 
         # Si no existe el archivo de origen, no hacemos nada
-        if not source_blob.exists():
+        if not storage_backend.exists(bucket_name, file_name):
             logger.warning(f"No se pudo mover a cuarentena. El archivo de origen ya no existe: {file_name}")
             return
 
         # Determina el bucket de destino
-        target_bucket = storage_client.bucket(destination_bucket if destination_bucket else bucket_name)
+        target_bucket = destination_bucket if destination_bucket else bucket_name
 
         # Define la ruta de destino en la carpeta de cuarentena
         base_name = os.path.basename(file_name)
-        destination_blob_name = f"quarantine/{base_name}"
+        destination_blob_name = f"{QUARANTINE_FOLDER}{base_name}"
+        metadata = {
+            'quarantine_reason': str(reason)[:MAX_REASON_CHARS],
+            'quarantine_category': reason_category(str(reason)),
+            'original_bucket': bucket_name,
+            'original_name': file_name,
+            'quarantined_at': datetime.now(timezone.utc).isoformat(),
+        }
         
         # Copia el archivo al bucket y la carpeta de destino
-        source_blob.copy_to(target_bucket.blob(destination_blob_name))
+        storage_backend.copy(bucket_name, file_name, target_bucket, destination_blob_name, metadata=metadata)
         
         # Elimina el archivo original del bucket de origen
-        source_blob.delete()
+        storage_backend.delete(bucket_name, file_name)
         
-        logger.info(f"Archivo movido a cuarentena: {destination_blob_name} en el bucket {target_bucket.name}. Razón: {reason}")
+        logger.info(f"Archivo movido a cuarentena: {destination_blob_name} en el bucket {target_bucket}. Razón: {reason}")
     except NotFound:
         logger.warning(f"El archivo de origen {file_name} ya no existe. No es necesario moverlo a cuarentena.")
     except Exception as e:
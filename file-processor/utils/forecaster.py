@@ -0,0 +1,192 @@
+"""
+Pronósticos base locales para los reportes de tipo Foresight
+(`prediction_report` y `management_report`).
+
+Para cada par columna de fecha × columna numérica se remuestrea la serie, se calculan
+promedios móviles y se ajustan una tendencia lineal y un suavizado exponencial simple;
+se conserva el modelo con menor error y se pronostica con intervalos de predicción.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+
+import config
+from .column_profiler import to_pandas
+
+logger = logging.getLogger(__name__)
+
+# Columnas de flujo que se suman por período; las demás se promedian
+FLOW_COLUMNS = ['number_of_units_sold', 'number_of_transactions', 'total_cost', 'revenue']
+
+MIN_PERIODS = 6
+Z_95 = 1.96
+SMOOTHING_ALPHAS = np.linspace(0.05, 0.95, 19)
+
+
+def _choose_frequency(start: pd.Timestamp, end: pd.Timestamp) -> str:
+    span_days = (end - start).days
+    if span_days <= 90:
+        return 'D'
+    if span_days <= 730:
+        return 'W'
+    return 'MS'
+
+
+def _complete_periods(resampled: pd.Series, start: pd.Timestamp, end: pd.Timestamp, frequency: str) -> pd.Series:
+    """
+    Descarta el primer y el último período si la serie no cubre todos sus días. Una suma
+    sobre un período parcial subestima el flujo y sesga la tendencia y el suavizado.
+    """
+    if frequency == 'W':
+        first_complete, last_complete = start.dayofweek == 0, end.dayofweek == 6
+    elif frequency == 'MS':
+        first_complete, last_complete = start.day == 1, end.is_month_end
+    else:
+        return resampled
+    return resampled.iloc[(0 if first_complete else 1):(None if last_complete else -1)]
+
+
+def _load_series(df, time_col: str, value_col: str) -> pd.Series:
+    """
+    Retorna la serie valor-por-fecha en Pandas. En BigFrames se agrega por fecha en el motor
+    de origen y solo se descarga una fila por marca de tiempo.
+    """
+    if hasattr(df, 'to_pandas'):
+        aggregation = 'sum' if value_col in FLOW_COLUMNS else 'mean'
+        series = to_pandas(df[[time_col, value_col]].dropna().groupby(time_col)[value_col].agg(aggregation))
+    else:
+        series = df[[time_col, value_col]].dropna().set_index(time_col)[value_col]
+    index = series.index
+    if not pd.api.types.is_datetime64_any_dtype(index.dtype):
+        index = pd.to_datetime(index, errors='coerce', utc=True, format='mixed')
+    series = pd.Series(pd.to_numeric(series.values, errors='coerce'), index=index).dropna()
+    return series[series.index.notna()].sort_index()
+
+
+def _fit_linear(y: np.ndarray):
+    x = np.arange(len(y), dtype=float)
+    slope, intercept = np.polyfit(x, y, 1)
+    residuals = y - (intercept + slope * x)
+    sigma = float(np.sqrt(np.sum(residuals ** 2) / max(1, len(y) - 2)))
+    return {'intercept': float(intercept), 'slope': float(slope)}, sigma
+
+
+def _fit_exponential_smoothing(y: np.ndarray):
+    """
+    Ajusta el suavizado exponencial simple evaluando todos los valores de alfa a la vez.
+    """
+    levels = np.full(len(SMOOTHING_ALPHAS), y[0], dtype=float)
+    squared_errors = np.zeros(len(SMOOTHING_ALPHAS))
+    for value in y[1:]:
+        errors = value - levels
+        squared_errors += errors ** 2
+        levels += SMOOTHING_ALPHAS * errors
+    best = int(np.argmin(squared_errors))
+    sigma = float(np.sqrt(squared_errors[best] / max(1, len(y) - 1)))
+    return {'alpha': float(SMOOTHING_ALPHAS[best]), 'level': float(levels[best])}, sigma
+
+
+def _forecast_pair(df, time_col: str, value_col: str, horizon: int):
+    series = _load_series(df, time_col, value_col)
+    if len(series) < 2:
+        return None
+
+    frequency = _choose_frequency(series.index.min(), series.index.max())
+    if value_col in FLOW_COLUMNS:
+        aggregation = 'sum'
+        resampled = _complete_periods(
+            series.resample(frequency).sum(min_count=0), series.index.min(), series.index.max(), frequency
+        )
+    else:
+        aggregation = 'mean'
+        resampled = series.resample(frequency).mean().interpolate()
+    if len(resampled) < MIN_PERIODS:
+        return None
+
+    y = resampled.to_numpy(dtype=float)
+    window = min(len(y), {'D': 7, 'W': 4, 'MS': 3}[frequency])
+    rolling_mean = float(resampled.rolling(window).mean().iloc[-1])
+
+    linear_params, linear_sigma = _fit_linear(y)
+    smoothing_params, smoothing_sigma = _fit_exponential_smoothing(y)
+
+    n = len(y)
+    steps = np.arange(1, horizon + 1, dtype=float)
+    if linear_sigma <= smoothing_sigma:
+        model, params, sigma = 'linear_trend', linear_params, linear_sigma
+        x_future = n - 1 + steps
+        x_mean = (n - 1) / 2
+        sxx = np.sum((np.arange(n) - x_mean) ** 2)
+        values = params['intercept'] + params['slope'] * x_future
+        spread = Z_95 * sigma * np.sqrt(1 + 1 / n + (x_future - x_mean) ** 2 / sxx)
+    else:
+        model, params, sigma = 'exponential_smoothing', smoothing_params, smoothing_sigma
+        values = np.full(horizon, params['level'])
+        spread = Z_95 * sigma * np.sqrt(1 + (steps - 1) * params['alpha'] ** 2)
+
+    future_index = pd.date_range(resampled.index[-1], periods=horizon + 1, freq=frequency)[1:]
+    return {
+        'time_column': time_col,
+        'value_column': value_col,
+        'frequency': frequency,
+        'aggregation': aggregation,
+        'periods': n,
+        'last_period': resampled.index[-1].isoformat(),
+        'last_value': round(float(y[-1]), 4),
+        'rolling_mean': round(rolling_mean, 4),
+        'model': model,
+        'params': {key: round(value, 4) for key, value in params.items()},
+        'rmse': round(sigma, 4),
+        'forecast': [
+            {
+                'period': period.isoformat(),
+                'value': round(float(value), 4),
+                'lower': round(float(value - delta), 4),
+                'upper': round(float(value + delta), 4),
+            }
+            for period, value, delta in zip(future_index, values, spread)
+        ],
+    }
+
+
+def forecast_dataframe(df, time_cols: list, value_cols: list) -> list:
+    """
+    Calcula los pronósticos base de cada par columna de fecha × columna numérica.
+
+    Args:
+        df: DataFrame de Pandas o de BigFrames.
+        time_cols (list): Columnas de fecha presentes en el stack.
+        value_cols (list): Columnas numéricas presentes en el stack.
+
+    Returns:
+        list: Un pronóstico por par con datos suficientes, hasta `FORECAST_MAX_PAIRS`.
+    """
+    forecasts = []
+    for time_col in time_cols:
+        for value_col in value_cols:
+            if len(forecasts) >= config.FORECAST_MAX_PAIRS:
+                return forecasts
+            try:
+                forecast = _forecast_pair(df, time_col, value_col, config.FORECAST_HORIZON)
+                if forecast:
+                    forecasts.append(forecast)
+            except Exception as e:
+                logger.warning(f"No se pudo calcular el pronóstico de '{value_col}' por '{time_col}': {e}")
+    return forecasts
+
+
+def format_forecasts(forecasts: list) -> str:
+    """
+    Da formato de texto a los pronósticos para incluirlos en el reporte final.
+    """
+    lines = ["Pronósticos base calculados (intervalos de predicción del 95%):"]
+    for forecast in forecasts:
+        lines.append(
+            f"- {forecast['value_column']} por {forecast['time_column']} "
+            f"({forecast['aggregation']}, frecuencia {forecast['frequency']}, {forecast['periods']} períodos, "
+            f"modelo {forecast['model']}, RMSE {forecast['rmse']}, promedio móvil {forecast['rolling_mean']}):"
+        )
+        for point in forecast['forecast']:
+            lines.append(f"    {point['period']}: {point['value']} [{point['lower']}, {point['upper']}]")
+    return "\n".join(lines)
@@ -0,0 +1,51 @@
+"""
+Llamadas a Gemini acotadas por el plazo del evento
+
+`GenerativeModel.generate_content` no acepta un tiempo de espera por llamada. Cuando el
+modelo expone su cliente de predicción, la solicitud se envía a ese cliente con `timeout`,
+de modo que la propia API la corta al vencer y no queda trabajo en segundo plano. Con
+versiones del SDK que no lo exponen, se recurre a `Deadline.call`.
+"""
+
+import logging
+from google.api_core import exceptions as api_exceptions
+
+from .deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+
+def _supports_timeout(model) -> bool:
+    return all(hasattr(model, attribute) for attribute in ['_prepare_request', '_prediction_client', '_parse_response'])
+
+
+def generate_content(model, contents, deadline=None, stage: str = 'gemini', timeout: float = None, **kwargs):
+    """
+    Llama a `model.generate_content(contents, **kwargs)` con un tiempo de espera.
+
+    Args:
+        model (GenerativeModel): Modelo de Gemini.
+        contents: Prompt de la solicitud.
+        deadline (Deadline): Plazo del evento (opcional). La solicitud se acota a la porción de `stage`.
+        stage (str): Etapa del plazo a la que pertenece la llamada.
+        timeout (float): Tiempo de espera cuando no hay plazo (opcional).
+
+    Raises:
+        DeadlineExceeded: Si la porción de la etapa se agota antes de la respuesta.
+    """
+    if deadline is not None:
+        timeout = deadline.slice(stage)
+        if not _supports_timeout(model):
+            return deadline.call(stage, model.generate_content, contents, **kwargs)
+    if timeout is None or not _supports_timeout(model):
+        return model.generate_content(contents, **kwargs)
+
+    request = model._prepare_request(contents=contents, **kwargs)
+    try:
+        response = model._prediction_client.generate_content(request=request, timeout=timeout)
+    except api_exceptions.DeadlineExceeded:
+        if deadline is None:
+            raise
+        logger.warning(f"La etapa '{stage}' no terminó en {timeout:.0f}s.")
+        raise DeadlineExceeded(stage)
+    return model._parse_response(response)
@@ -0,0 +1,396 @@
+"""
+Índice de identificadores entre archivos (`client_id`, `product_id`, `order_number`).
+
+El índice está particionado por el hash de cada clave (columna, valor). Cada partición
+tiene una corrida ordenada con las entradas `columna, valor, stack, filas` y un filtro de
+Bloom con sus claves, y `manifest.json` apunta a la corrida y al filtro vigentes de cada
+partición. Una búsqueda solo lee la partición de su clave: descarta el valor con el filtro
+o lo busca en la corrida con búsqueda binaria, de modo que su costo no depende del número
+de stacks. El manifiesto y los filtros se conservan en memoria y las corridas en una
+caché LRU.
+
+`index_stack` solo escribe un delta inmutable con las entradas del stack.
+`compact_identifier_index`, que corre fuera del procesamiento (con la compactación),
+fusiona los deltas en corridas nuevas, reemplaza las entradas de los stacks reindexados
+y elimina las de los stacks que ya no existen. Un stack aparece en las búsquedas después
+de la siguiente compactación.
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import base64
+import bisect
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from google.api_core.exceptions import NotFound
+
+import config
+from .stack_writer import read_stack
+from .storage_backend import get_storage
+
+logger = logging.getLogger(__name__)
+
+INDEX_FOLDER = "processed/identifier_index/"
+DELTAS_FOLDER = f"{INDEX_FOLDER}deltas/"
+RUNS_FOLDER = f"{INDEX_FOLDER}runs/"
+MANIFEST_BLOB = f"{INDEX_FOLDER}manifest.json"
+# Particiones donde figura cada stack indexado; solo lo usa la compactación
+STACKS_BLOB = f"{INDEX_FOLDER}stacks.json"
+
+IdentifierMatch = namedtuple('IdentifierMatch', ['stack', 'rows'])
+
+_Bloom = namedtuple('_Bloom', ['bits', 'num_bits', 'num_hashes'])
+
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_manifest = {}
+_manifest_generation = None
+_last_refresh = 0.0
+_blooms = {}
+_runs = OrderedDict()
+
+
+def _normalize(value) -> str:
+    """
+    Convierte un identificador a su forma de texto canónica.
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip().replace('\t', ' ').replace('\n', ' ')
+
+
+def _partition(column: str, value: str, partitions: int) -> int:
+    # Un hash distinto del de los filtros, para que la partición no sesgue sus posiciones
+    digest = hashlib.blake2b(f"{column}\x1f{value}".encode('utf-8'), digest_size=8, person=b'partition').digest()
+    return int.from_bytes(digest, 'big') % partitions
+
+
+def _positions(column: str, value: str, num_bits: int, num_hashes: int) -> list:
+    digest = hashlib.blake2b(f"{column}\x1f{value}".encode('utf-8'), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'big')
+    h2 = int.from_bytes(digest[8:], 'big') | 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+def _bloom_contains(bloom: _Bloom, column: str, value: str) -> bool:
+    for position in _positions(column, value, bloom.num_bits, bloom.num_hashes):
+        if not bloom.bits[position >> 3] & (0x80 >> (position & 7)):
+            return False
+    return True
+
+
+def _build_bloom(keys: list) -> dict:
+    """
+    Construye un filtro de Bloom dimensionado para la tasa de falsos positivos configurada.
+    """
+    count = max(len(keys), 1)
+    num_bits = max(64, math.ceil(-count * math.log(config.IDENTIFIER_BLOOM_FP_RATE) / (math.log(2) ** 2)))
+    num_hashes = max(1, round(num_bits / count * math.log(2)))
+    bits = np.zeros(num_bits, dtype=bool)
+    for column, value in keys:
+        bits[_positions(column, value, num_bits, num_hashes)] = True
+    return {
+        'num_bits': num_bits,
+        'num_hashes': num_hashes,
+        'bits': base64.b64encode(np.packbits(bits).tobytes()).decode('ascii'),
+    }
+
+
+def _index_entries(df: pd.DataFrame) -> list:
+    """
+    Extrae las entradas (columna, valor, fila) de las columnas indexadas, ordenadas.
+    """
+    entries = []
+    for column in config.IDENTIFIER_INDEX_COLUMNS:
+        if column not in df.columns:
+            continue
+        values = df[column].reset_index(drop=True).dropna()
+        entries.extend((column, _normalize(value), int(row)) for row, value in values.items())
+    entries.sort()
+    return entries
+
+
+def index_stack(bucket_name: str, df: pd.DataFrame, stack_blob_name: str):
+    """
+    Guarda los identificadores de un stack recién escrito como un delta pendiente de
+    compactar. Un delta sin entradas también se guarda, para retirar las de una versión
+    anterior del stack.
+
+    Args:
+        bucket_name (str): Bucket donde se guarda el índice.
+        df (pd.DataFrame): El stack ya tipado.
+        stack_blob_name (str): Ruta completa del stack en el bucket, devuelta en las búsquedas.
+    """
+    grouped = {}
+    for column, value, row in _index_entries(df):
+        grouped.setdefault((column, value), []).append(row)
+    delta = {
+        'stack': stack_blob_name,
+        'entries': [[column, value, rows] for (column, value), rows in grouped.items()],
+    }
+    get_storage().write(
+        bucket_name, f"{DELTAS_FOLDER}{uuid.uuid4().hex}.json", json.dumps(delta), content_type='application/json'
+    )
+    if grouped:
+        logger.info(f"{len(grouped)} identificadores distintos de {stack_blob_name} pendientes de indexar.")
+    else:
+        logger.info(f"El stack {stack_blob_name} no tiene identificadores para indexar.")
+
+
+def _current_manifest(bucket_name: str, force: bool = False) -> dict:
+    """
+    Retorna el manifiesto en memoria, verificando cada `IDENTIFIER_INDEX_REFRESH_SECONDS`
+    si cambió. La consulta se hace fuera del candado y solo un hilo la hace a la vez.
+    """
+    global _manifest, _manifest_generation, _last_refresh
+    with _lock:
+        if not force and time.monotonic() - _last_refresh < config.IDENTIFIER_INDEX_REFRESH_SECONDS:
+            return _manifest
+    if not _refresh_lock.acquire(blocking=force):
+        # Otro hilo ya está actualizando el manifiesto
+        with _lock:
+            return _manifest
+    try:
+        info = get_storage().metadata(bucket_name, MANIFEST_BLOB)
+        generation = info.generation if info is not None else None
+        manifest = None
+        if generation != _manifest_generation:
+            try:
+                manifest = json.loads(get_storage().read_text(bucket_name, MANIFEST_BLOB)) if info is not None else {}
+            except NotFound:
+                manifest = {}
+
+        with _lock:
+            if manifest is not None:
+                _manifest, _manifest_generation = manifest, generation
+                current = {run['bloom'] for run in manifest.get('runs', {}).values()}
+                for name in [name for name in _blooms if name not in current]:
+                    del _blooms[name]
+            _last_refresh = time.monotonic()
+            return _manifest
+    finally:
+        _refresh_lock.release()
+
+
+def _load_bloom(bucket_name: str, run: dict) -> _Bloom:
+    with _lock:
+        if run['bloom'] in _blooms:
+            return _blooms[run['bloom']]
+    data = json.loads(get_storage().read_text(bucket_name, run['bloom']))
+    bloom = _Bloom(base64.b64decode(data['bits']), data['num_bits'], data['num_hashes'])
+    with _lock:
+        _blooms[run['bloom']] = bloom
+    return bloom
+
+
+def _read_run(bucket_name: str, run_name: str) -> list:
+    """
+    Lee las entradas (columna, valor, stack, filas) de una corrida, en orden.
+    """
+    entries = []
+    for line in get_storage().read_text(bucket_name, run_name).splitlines():
+        column, value, stack, rows = line.split('\t')
+        entries.append((column, value, stack, [int(row) for row in rows.split(',')]))
+    return entries
+
+
+def _load_run(bucket_name: str, run: dict):
+    """
+    Retorna las claves ordenadas y los pares (stack, filas) de una corrida, usando la
+    caché LRU. Las corridas no se modifican: cada compactación escribe una nueva.
+    """
+    with _lock:
+        if run['run'] in _runs:
+            _runs.move_to_end(run['run'])
+            return _runs[run['run']]
+
+    keys, matches = [], []
+    for column, value, stack, rows in _read_run(bucket_name, run['run']):
+        keys.append((column, value))
+        matches.append(IdentifierMatch(stack, rows))
+
+    with _lock:
+        _runs[run['run']] = (keys, matches)
+        while len(_runs) > config.IDENTIFIER_INDEX_CACHED_RUNS:
+            _runs.popitem(last=False)
+    return keys, matches
+
+
+def _matches(bucket_name: str, manifest: dict, column: str, value: str) -> list:
+    run = manifest.get('runs', {}).get(str(_partition(column, value, manifest.get('partitions', 1))))
+    if run is None or not _bloom_contains(_load_bloom(bucket_name, run), column, value):
+        return []
+    keys, matches = _load_run(bucket_name, run)
+    start = bisect.bisect_left(keys, (column, value))
+    end = bisect.bisect_right(keys, (column, value))
+    return matches[start:end]
+
+
+def lookup_identifier(bucket_name: str, column: str, value) -> list:
+    """
+    Busca los stacks y filas donde aparece un identificador.
+
+    Args:
+        bucket_name (str): Bucket donde se guarda el índice.
+        column (str): Columna del identificador, por ejemplo 'client_id'.
+        value: Valor buscado.
+
+    Returns:
+        list: Una lista de `IdentifierMatch(stack, rows)`.
+    """
+    value = _normalize(value)
+    try:
+        return _matches(bucket_name, _current_manifest(bucket_name), column, value)
+    except NotFound:
+        # El manifiesto en memoria apunta a una corrida que ya se reemplazó
+        return _matches(bucket_name, _current_manifest(bucket_name, force=True), column, value)
+
+
+def correlate_stack(bucket_name: str, stack_blob_name: str) -> dict:
+    """
+    Encuentra los demás stacks que comparten identificadores con un stack.
+
+    Returns:
+        dict: stack relacionado -> {columna: [valores compartidos]}.
+    """
+    try:
+        df = read_stack(bucket_name, stack_blob_name)
+    except NotFound:
+        logger.warning(f"El stack {stack_blob_name} no existe.")
+        return {}
+
+    related = {}
+    for column, value in sorted({(column, value) for column, value, _ in _index_entries(df)}):
+        for match in lookup_identifier(bucket_name, column, value):
+            if match.stack != stack_blob_name:
+                related.setdefault(match.stack, {}).setdefault(column, []).append(value)
+    return related
+
+
+def _load_json(bucket_name: str, blob_name: str, default: dict):
+    info = get_storage().metadata(bucket_name, blob_name)
+    if info is None:
+        return default, 0
+    return json.loads(get_storage().read_text(bucket_name, blob_name)), info.generation
+
+
+def _write_run(bucket_name: str, partition: int, run_id: str, entries: list) -> dict:
+    """
+    Escribe una corrida ordenada y su filtro de Bloom, y retorna su entrada del manifiesto.
+    """
+    run_name = f"{RUNS_FOLDER}p={partition:04d}/{run_id}.tsv"
+    bloom_name = f"{RUNS_FOLDER}p={partition:04d}/{run_id}.bloom.json"
+    with get_storage().open_write(bucket_name, run_name, 'text/tab-separated-values', text=True) as stream:
+        for column, value, stack, rows in entries:
+            stream.write(f"{column}\t{value}\t{stack}\t{','.join(str(row) for row in rows)}\n")
+    keys = sorted({(column, value) for column, value, _, _ in entries})
+    get_storage().write(bucket_name, bloom_name, json.dumps(_build_bloom(keys)), content_type='application/json')
+    return {'run': run_name, 'bloom': bloom_name, 'entries': len(entries)}
+
+
+def _removed_stacks(bucket_name: str, stacks: list) -> set:
+    """
+    Retorna los stacks indexados que ya no existen (eliminados o compactados).
+    """
+    folders = {f"{os.path.dirname(stack)}/" for stack in stacks}
+    existing = set()
+    for folder in folders:
+        existing.update(info.name for info in get_storage().list(bucket_name, prefix=folder))
+    return {stack for stack in stacks if stack not in existing}
+
+
+def compact_identifier_index(bucket_name: str) -> dict:
+    """
+    Fusiona los deltas pendientes en corridas nuevas de las particiones afectadas y
+    retira las entradas de los stacks reindexados o eliminados.
+
+    Debe ejecutarse una sola vez a la vez (la compactación la llama con su turno exclusivo).
+    Los deltas se eliminan después de publicar el manifiesto, de modo que una ejecución
+    interrumpida se repite sin duplicar entradas. Las corridas reemplazadas se conservan
+    hasta que los procesos que leen el índice hayan actualizado su manifiesto.
+
+    Returns:
+        dict: El manifiesto publicado.
+    """
+    manifest, generation = _load_json(
+        bucket_name, MANIFEST_BLOB, {'partitions': config.IDENTIFIER_INDEX_PARTITIONS, 'runs': {}}
+    )
+    stacks, stacks_generation = _load_json(bucket_name, STACKS_BLOB, {})
+    partitions = manifest['partitions']
+
+    # Si un stack se reindexó varias veces, vale su delta más reciente
+    deltas = sorted(
+        get_storage().list(bucket_name, prefix=DELTAS_FOLDER),
+        key=lambda info: (info.updated.isoformat() if info.updated else '', info.name),
+    )
+    updates = {}
+    for info in deltas:
+        delta = json.loads(get_storage().read_text(bucket_name, info.name))
+        updates[delta['stack']] = delta['entries']
+    removed = _removed_stacks(bucket_name, [stack for stack in stacks if stack not in updates])
+
+    replaced = set(updates) | removed
+    new_entries = {}
+    for stack, entries in updates.items():
+        for column, value, rows in entries:
+            new_entries.setdefault(_partition(column, value, partitions), []).append((column, value, stack, rows))
+    affected = set(new_entries)
+    for stack in replaced:
+        affected.update(stacks.get(stack, []))
+
+    run_id = uuid.uuid4().hex
+    retired = []
+    for partition in sorted(affected):
+        current = manifest['runs'].pop(str(partition), None)
+        entries = []
+        if current is not None:
+            entries = [entry for entry in _read_run(bucket_name, current['run']) if entry[2] not in replaced]
+            retired.extend([current['run'], current['bloom']])
+        entries.extend(new_entries.get(partition, []))
+        if entries:
+            entries.sort()
+            manifest['runs'][str(partition)] = _write_run(bucket_name, partition, run_id, entries)
+
+    now = time.time()
+    expired = [batch for batch in manifest.get('retired', []) if now - batch['at'] > 2 * config.IDENTIFIER_INDEX_REFRESH_SECONDS]
+    manifest['retired'] = [batch for batch in manifest.get('retired', []) if batch not in expired]
+    if retired:
+        manifest['retired'].append({'at': now, 'names': retired})
+    if deltas or removed or expired:
+        get_storage().write(
+            bucket_name, MANIFEST_BLOB, json.dumps(manifest), content_type='application/json',
+            if_generation_match=generation,
+        )
+
+    # El registro de stacks se guarda después del manifiesto: si se interrumpe antes, la
+    # siguiente ejecución vuelve a retirar los stacks de las mismas particiones
+    for stack in removed:
+        stacks.pop(stack, None)
+        logger.info(f"El stack {stack} ya no existe; se retira del índice de identificadores.")
+    for stack, entries in updates.items():
+        stacks[stack] = sorted({_partition(column, value, partitions) for column, value, _ in entries})
+    if updates or removed:
+        get_storage().write(
+            bucket_name, STACKS_BLOB, json.dumps(stacks), content_type='application/json',
+            if_generation_match=stacks_generation,
+        )
+
+    for name in [name for batch in expired for name in batch['names']] + [info.name for info in deltas]:
+        try:
+            get_storage().delete(bucket_name, name)
+        except NotFound:
+            pass
+    logger.info(
+        f"Índice de identificadores compactado: {len(deltas)} delta(s), {len(removed)} stack(s) retirado(s), "
+        f"{len(affected)} partición(es) reescrita(s)."
+    )
+    return manifest
@@ -3,12 +3,19 @@ Utilidad para procesamiento de archivos de imagen
 """
 
 from google.cloud import vision
+from google.api_core import exceptions as api_exceptions
 import logging
 import os
 
+from .storage_backend import get_storage
+from .deadline import DeadlineExceeded
+from .circuit_breaker import get_breaker, DependencyUnavailable
+from . import tracing
+
 logger = logging.getLogger(__name__)
 
-def process_image(bucket_name, file_name, file_info):
+@tracing.traced('ocr', result_attributes=lambda text: {'bytes.out': len((text or '').encode('utf-8'))})
+def process_image(bucket_name, file_name, file_info, deadline=None):
     """
     Procesa una imagen usando Vision API OCR.
     
@@ -16,6 +23,7 @@ def process_image(bucket_name, file_name, file_info):
         bucket_name (str): Nombre del bucket.
         file_name (str): Nombre del archivo.
         file_info (dict): Información del archivo validado.
+        deadline (Deadline): Plazo del evento; acota la llamada a Vision (opcional).
     
     Returns:
         str: El texto extraído de la imagen, o None si hay un error.
@@ -24,9 +32,21 @@ def process_image(bucket_name, file_name, file_info):
         client = vision.ImageAnnotatorClient()
         
         image = vision.Image()
-        image.source.image_uri = f"gs://{bucket_name}/{file_name}"
+        gcs_uri = get_storage().uri(bucket_name, file_name)
+        if gcs_uri:
+            image.source.image_uri = gcs_uri
+        else:
+            # Con el almacenamiento local, la imagen se envía en la solicitud
+            image.content = get_storage().read(bucket_name, file_name)
         
-        response = client.text_detection(image=image)
+        kwargs = {'timeout': deadline.slice('ocr')} if deadline else {}
+        try:
+            response = get_breaker('vision').call(client.text_detection, image=image, **kwargs)
+        except DependencyUnavailable as e:
+            if deadline and isinstance(e.__cause__, api_exceptions.DeadlineExceeded):
+                # El tiempo de espera de Vision era la porción del plazo del evento
+                raise DeadlineExceeded('ocr') from e
+            raise
         texts = response.text_annotations
         
         if response.error.message:
@@ -40,6 +60,8 @@ def process_image(bucket_name, file_name, file_info):
         
         return extracted_text
         
+    except (DeadlineExceeded, DependencyUnavailable):
+        raise
     except Exception as e:
         logger.error(f"Error procesando imagen {file_name}: {e}")
         return None
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""
+Planificador con carriles separados por tipo de archivo y clase de tamaño
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import config
+
+logger = logging.getLogger(__name__)
+
+SIZE_CLASSES = ['small', 'large']
+
+_FORMATS_BY_TYPE = {
+    'audio': config.AUDIO_FORMATS,
+    'image': config.IMAGE_FORMATS,
+    'text': config.TEXT_FORMATS,
+    'data': config.DATA_FORMATS,
+}
+
+
+def file_type_for(file_name: str) -> str:
+    """
+    Clasifica un objeto por su extensión, sin descargarlo. La validación real la hace `process_file`.
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    for file_type, formats in _FORMATS_BY_TYPE.items():
+        if extension in formats['extensions']:
+            return file_type
+    return 'other'
+
+
+class _Lane:
+    def __init__(self, name: tuple, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue = deque()
+        self.running = 0
+        self.last_dispatch = 0.0
+
+
+class LaneScheduler:
+    """
+    Ejecuta trabajos en un grupo de hilos compartido, repartido en carriles por
+    (tipo de archivo, clase de tamaño). Cada carril tiene su propia cola y su límite de
+    trabajos simultáneos, de modo que un carril saturado (por ejemplo, audios largos)
+    no ocupa la capacidad de los demás.
+
+    Cuando un hilo queda libre atiende primero a los carriles con trabajos en cola y
+    ninguno en ejecución, para que ningún carril quede sin avanzar; después, a los
+    carriles de archivos pequeños antes que a los grandes. Entre carriles equivalentes
+    se elige el que lleva más tiempo sin ejecutar un trabajo.
+
+    Args:
+        workers (int): Número total de hilos de trabajo.
+        lane_limits (dict): tipo de archivo -> {'small': límite, 'large': límite}.
+        small_file_bytes (int): Tamaño máximo de un archivo pequeño. Los archivos de
+            tamaño desconocido se consideran grandes.
+        name (str): Nombre usado en los hilos y los registros.
+    """
+
+    def __init__(self, workers: int, lane_limits: dict, small_file_bytes: int, name: str = "carriles"):
+        self._small_file_bytes = small_file_bytes
+        self._name = name
+        self._condition = threading.Condition()
+        self._lanes = {}
+        # Los tipos sin carril propio usan el carril 'other'
+        lane_limits = {'other': {'small': 1, 'large': 1}, **lane_limits}
+        for file_type, limits in lane_limits.items():
+            for size_class in SIZE_CLASSES:
+                lane = (file_type, size_class)
+                self._lanes[lane] = _Lane(lane, limits.get(size_class, 1))
+        self._shutdown = False
+        self._workers = max(1, workers)
+        self._threads = []
+        self._pid = None
+
+    def lane_for(self, file_type: str, size: int = None) -> tuple:
+        """
+        Retorna el carril (tipo de archivo, clase de tamaño) de un trabajo.
+        """
+        if (file_type, 'small') not in self._lanes:
+            file_type = 'other'
+        size_class = 'small' if size is not None and size <= self._small_file_bytes else 'large'
+        return file_type, size_class
+
+    def _ensure_started(self):
+        """
+        Inicia los hilos de trabajo en el primer trabajo del proceso. Debe llamarse con el
+        candado adquirido.
+
+        Los hilos no sobreviven a un `fork`: si el planificador se creó en el proceso
+        maestro de un servidor con precarga, cada proceso hijo inicia los suyos.
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._threads = [
+            threading.Thread(target=self._work_loop, name=f"{self._name}-{i}", daemon=True)
+            for i in range(self._workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, file_type: str, size: int, fn, *args, **kwargs) -> Future:
+        """
+        Encola `fn(*args, **kwargs)` en el carril que le corresponde y retorna un `Future`.
+        """
+        future = Future()
+        lane = self._lanes[self.lane_for(file_type, size)]
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError(f"El planificador '{self._name}' ya se detuvo.")
+            self._ensure_started()
+            lane.queue.append((future, fn, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def run(self, file_type: str, size: int, fn, *args, **kwargs):
+        """
+        Ejecuta un trabajo en su carril y espera su resultado.
+        """
+        return self.submit(file_type, size, fn, *args, **kwargs).result()
+
+    def _next_job(self):
+        """
+        Elige el siguiente trabajo. Debe llamarse con el candado adquirido.
+        """
+        ready = [lane for lane in self._lanes.values() if lane.queue and lane.running < lane.limit]
+        if not ready:
+            return None, None
+        lane = min(ready, key=lambda lane: (lane.running > 0, SIZE_CLASSES.index(lane.name[1]), lane.last_dispatch))
+        lane.running += 1
+        lane.last_dispatch = time.monotonic()
+        return lane, lane.queue.popleft()
+
+    def _work_loop(self):
+        while True:
+            with self._condition:
+                lane, job = self._next_job()
+                while job is None:
+                    if self._shutdown and not any(lane.queue for lane in self._lanes.values()):
+                        return
+                    self._condition.wait()
+                    lane, job = self._next_job()
+
+            future, fn, args, kwargs = job
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    lane.running -= 1
+                    # El carril liberado puede tener trabajos esperando a otro hilo
+                    self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Retorna, por carril, el número de trabajos en cola y en ejecución.
+        """
+        with self._condition:
+            return {
+                f"{lane.name[0]}/{lane.name[1]}": {'queued': len(lane.queue), 'running': lane.running}
+                for lane in self._lanes.values() if lane.queue or lane.running
+            }
+
+    def shutdown(self, wait: bool = True):
+        """
+        Deja de aceptar trabajos; los hilos terminan cuando se vacían las colas.
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
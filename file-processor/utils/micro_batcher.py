@@ -0,0 +1,127 @@
+"""
+Utilidad para agrupar solicitudes concurrentes en lotes dentro de una ventana corta de tiempo
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Agrupa elementos enviados desde varios hilos y los procesa juntos con una sola llamada.
+
+    Cada llamada a `submit` bloquea al hilo que la hace hasta que su lote se procesa y
+    retorna el resultado correspondiente a su elemento. Un lote se procesa en un hilo
+    propio cuando vence la ventana de tiempo o cuando se alcanza el máximo de elementos o
+    de peso acumulado, de modo que cada hilo puede dejar de esperar con su propio plazo.
+
+    Args:
+        flush_fn (callable): Recibe la lista de elementos del lote y retorna una lista de
+            resultados en el mismo orden.
+        window_seconds (float): Tiempo máximo que espera el primer elemento de un lote.
+        max_items (int): Número máximo de elementos por lote.
+        max_weight (int): Peso máximo acumulado por lote (opcional). Un elemento que
+            supera el máximo por sí solo forma un lote propio.
+        name (str): Nombre usado en los registros.
+    """
+
+    def __init__(self, flush_fn, window_seconds: float, max_items: int, max_weight: int = None, name: str = "lote"):
+        self._flush_fn = flush_fn
+        self._window_seconds = window_seconds
+        self._max_items = max(1, max_items)
+        self._max_weight = max_weight
+        self._name = name
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_weight = 0
+        self._timer = None
+
+    def submit(self, item, weight: int = 1, timeout: float = None):
+        """
+        Agrega un elemento al lote en curso y espera su resultado.
+
+        Args:
+            timeout (float): Segundos máximos de espera (opcional). Si vencen antes de que el
+                lote comience, el elemento se retira del lote; si el lote ya está en curso,
+                su resultado se descarta.
+
+        Raises:
+            concurrent.futures.TimeoutError: Si el resultado no llega a tiempo.
+        """
+        future = Future()
+        # El span del archivo recibe su parte de los bytes y tokens del lote
+        entry = (item, future, weight, tracing.current_span())
+        batches = []
+        with self._lock:
+            # Un elemento que no cabe en el lote en curso lo cierra y comienza el siguiente
+            if self._pending and self._max_weight is not None and self._pending_weight + weight > self._max_weight:
+                batches.append(self._take_pending())
+            self._pending.append(entry)
+            self._pending_weight += weight
+            weight_reached = self._max_weight is not None and self._pending_weight >= self._max_weight
+            if len(self._pending) >= self._max_items or weight_reached:
+                batches.append(self._take_pending())
+            elif self._timer is None:
+                self._timer = threading.Timer(self._window_seconds, self._flush_on_timer)
+                self._timer.args = (self._timer,)
+                self._timer.daemon = True
+                self._timer.start()
+
+        for batch in batches:
+            self._start_batch(batch)
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                if any(pending is entry for pending in self._pending):
+                    self._pending = [pending for pending in self._pending if pending is not entry]
+                    self._pending_weight -= weight
+            raise
+
+    def _take_pending(self):
+        """
+        Extrae el lote pendiente. Debe llamarse con el candado adquirido.
+        """
+        batch = self._pending
+        self._pending = []
+        self._pending_weight = 0
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _start_batch(self, batch):
+        threading.Thread(target=self._run_batch, args=(batch,), name=self._name, daemon=True).start()
+
+    def _flush_on_timer(self, timer):
+        with self._lock:
+            # Un temporizador cancelado puede dispararse igual; solo el vigente cierra el lote
+            if timer is not self._timer:
+                return
+            batch = self._take_pending()
+        if batch:
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        items = [item for item, _, _, _ in batch]
+        logger.info(f"Procesando {self._name} con {len(items)} elemento(s).")
+        try:
+            members = [member for _, _, _, member in batch]
+            weights = [weight for _, _, weight, _ in batch]
+            with tracing.shared_span('batch', members, weights, **{'batch.name': self._name}):
+                results = self._flush_fn(items)
+            if len(results) != len(batch):
+                raise ValueError(f"Se esperaban {len(batch)} resultados y se recibieron {len(results)}.")
+            for (_, future, _, _), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            logger.error(f"Error procesando {self._name}: {e}")
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
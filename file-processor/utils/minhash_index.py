@@ -0,0 +1,158 @@
+"""
+Índice local MinHash/LSH para detectar documentos casi idénticos
+"""
+
+import re
+import threading
+import zlib
+import hashlib
+import logging
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Primo de Mersenne 2^61 - 1 usado por las permutaciones universales
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+NearDuplicateMatch = namedtuple("NearDuplicateMatch", ["key", "similarity", "text", "result"])
+
+
+def _content_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _shingles(text: str, shingle_size: int) -> set:
+    """
+    Divide el texto normalizado en secuencias de `shingle_size` palabras consecutivas.
+    """
+    tokens = re.findall(r"\w+", text.lower())
+    if len(tokens) <= shingle_size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)}
+
+
+class MinHashIndex:
+    """
+    Índice en memoria con firmas MinHash y bandas LSH, acotado a `max_entries` entradas.
+    Las entradas menos usadas recientemente se eliminan primero. Cada entrada también se
+    indexa por el hash de su contenido para encontrar los documentos idénticos.
+
+    Args:
+        num_perm (int): Número de permutaciones de la firma.
+        bands (int): Número de bandas LSH; debe dividir a `num_perm`.
+        shingle_size (int): Palabras por shingle.
+        max_entries (int): Número máximo de documentos retenidos.
+        seed (int): Semilla de las permutaciones.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 32, shingle_size: int = 5, max_entries: int = 2000, seed: int = 1):
+        if num_perm % bands != 0:
+            raise ValueError(f"El número de permutaciones ({num_perm}) debe ser múltiplo del número de bandas ({bands}).")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._buckets = [dict() for _ in range(bands)]
+        self._digests = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Calcula la firma MinHash del texto de forma vectorizada.
+        """
+        shingles = _shingles(text, self.shingle_size)
+        if not shingles:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _MERSENNE_PRIME
+        return np.bitwise_and(permuted, _MAX_HASH).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> list:
+        return [
+            hashlib.blake2b(signature[i * self.rows_per_band:(i + 1) * self.rows_per_band].tobytes(), digest_size=8).digest()
+            for i in range(self.bands)
+        ]
+
+    def find_exact(self, text: str):
+        """
+        Busca un documento indexado con exactamente el mismo contenido.
+
+        Returns:
+            NearDuplicateMatch: La coincidencia con similitud 1.0, o None.
+        """
+        digest = _content_digest(text)
+        with self._lock:
+            key = self._digests.get(digest)
+            if key is None:
+                return None
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            return NearDuplicateMatch(key, 1.0, entry["text"], entry["result"])
+
+    def query(self, text: str, signature: np.ndarray = None):
+        """
+        Busca el documento indexado más parecido al texto.
+
+        Returns:
+            NearDuplicateMatch: La mejor coincidencia con su similitud Jaccard estimada, o None.
+        """
+        if signature is None:
+            signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            candidates = set()
+            for band, band_key in enumerate(band_keys):
+                candidates.update(self._buckets[band].get(band_key, ()))
+            best = None
+            for key in candidates:
+                entry = self._entries[key]
+                similarity = float(np.mean(entry["signature"] == signature))
+                if best is None or similarity > best.similarity:
+                    best = NearDuplicateMatch(key, similarity, entry["text"], entry["result"])
+            if best is not None:
+                self._entries.move_to_end(best.key)
+        return best
+
+    def add(self, key: str, text: str, result: dict, signature: np.ndarray = None):
+        """
+        Agrega o reemplaza un documento en el índice, expulsando los más antiguos si es necesario.
+        """
+        if signature is None:
+            signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            digest = _content_digest(text)
+            if digest in self._digests:
+                self._remove(self._digests[digest])
+            self._entries[key] = {"signature": signature, "band_keys": band_keys, "digest": digest, "text": text, "result": result}
+            self._digests[digest] = key
+            for band, band_key in enumerate(band_keys):
+                self._buckets[band].setdefault(band_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._digests.pop(entry["digest"], None)
+        for band, band_key in enumerate(entry["band_keys"]):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def __len__(self):
+        return len(self._entries)
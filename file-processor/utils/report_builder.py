@@ -0,0 +1,30 @@
+"""
+Construcción del reporte de texto inicial a partir del resultado del modelo
+"""
+
+
+def build_raw_report(json_data) -> str:
+    """
+    Construye el reporte de texto inicial con las claves 'generated_report' y 'findings'.
+
+    Args:
+        json_data (dict): El resultado procesado por Gemini.
+
+    Returns:
+        str: El texto del reporte, o None si el JSON no contiene un reporte.
+    """
+    if not isinstance(json_data, dict) or 'findings' not in (json_data.get('generated_report') or {}):
+        return None
+
+    report_data = json_data['generated_report']
+    findings_data = report_data['findings']
+    report = (
+        f"Tipo de Reporte: {report_data.get('report_type', 'N/A')}\n"
+        "--------------------------------------\n"
+        "Observaciones:\n"
+        f"{findings_data.get('observations', 'No hay observaciones.')}\n\n"
+        "Puntos Clave:\n"
+    )
+    key_points = findings_data.get('key_points', [])
+    report += "\n".join([f"- {point}" for point in key_points]) if key_points else "No se encontraron puntos clave.\n"
+    return report
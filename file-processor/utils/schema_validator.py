@@ -0,0 +1,202 @@
+"""
+Validador de la salida del modelo compilado a partir del esquema de datos.
+Convierte las filas de `dataframe_package` a columnas con tipos reales de Pandas.
+"""
+
+import logging
+import pandas as pd
+
+from .schema import data_schema_manager
+
+logger = logging.getLogger(__name__)
+
+# Valores que el modelo usa para indicar un dato ausente
+NULL_TOKENS = ['n/a', 'na', 'null', 'none', 'nan', '']
+
+TRUE_TOKENS = ['true', 'verdadero', 'sí', 'si', 'yes', '1']
+FALSE_TOKENS = ['false', 'falso', 'no', '0']
+
+# Clases de datos de texto con un número limitado de valores posibles
+CATEGORICAL_CLASSES = ['categorical_values', 'limited_and_concrete', 'rating_and_ranks']
+
+# Identificadores y códigos que el esquema declara como enteros pero que se conservan como
+# texto: pueden ser alfanuméricos ('C1') o tener ceros a la izquierda ('08001')
+IDENTIFIER_COLUMNS = ['client_id', 'product_id', 'order_number', 'employee_number', 'postal_code']
+
+# Valores de ejemplo incluidos en el registro de conversiones fallidas
+MAX_LOGGED_FAILURES = 5
+
+
+def compile_dataframe_schema(schema: dict) -> dict:
+    """
+    Compila el esquema en un diccionario columna -> tipo de destino.
+
+    Los tipos posibles son 'integer', 'number', 'boolean', 'datetime', 'category' y 'string'.
+    """
+    class_data_by_column = {}
+    for group_name, group in schema.get('properties', {}).items():
+        if group_name == 'dataframe_package':
+            continue
+        for column, definition in group.get('properties', {}).items():
+            class_data_by_column[column] = definition.get('class_data')
+
+    row_properties = schema['properties']['dataframe_package']['properties']['data']['items']['properties']
+    compiled = {}
+    for column, definition in row_properties.items():
+        column_type = definition.get('type')
+        if column in IDENTIFIER_COLUMNS:
+            compiled[column] = 'string'
+        elif column_type == 'string' and definition.get('format') == 'date-time':
+            compiled[column] = 'datetime'
+        elif column_type == 'string' and class_data_by_column.get(column) in CATEGORICAL_CLASSES:
+            compiled[column] = 'category'
+        elif column_type in ['integer', 'number', 'boolean', 'string']:
+            compiled[column] = column_type
+        else:
+            compiled[column] = 'string'
+    return compiled
+
+
+# El esquema se compila una sola vez al importar el módulo
+COMPILED_DATAFRAME_SCHEMA = compile_dataframe_schema(data_schema_manager)
+
+
+def _null_mask(series: pd.Series) -> pd.Series:
+    """
+    Marca los valores nulos, incluyendo los marcadores de texto como 'n/a'.
+    """
+    if series.dtype != object and not pd.api.types.is_string_dtype(series.dtype):
+        return series.isna()
+    normalized = series.astype('string').str.strip().str.lower()
+    return series.isna() | normalized.isin(NULL_TOKENS).fillna(False)
+
+
+def _strip_thousands_separators(series: pd.Series) -> pd.Series:
+    """
+    Normaliza los números escritos con separadores de miles o coma decimal
+    ('1,200.50', '1.200,50', '12,5') al formato que entiende `pd.to_numeric`.
+    """
+    text = series.astype('string').str.strip().str.replace("[\\s\u00a0']", '', regex=True)
+    last_comma = text.str.rfind(',')
+    last_dot = text.str.rfind('.')
+    # El separador que aparece al final es el decimal; el otro agrupa los miles
+    comma_decimal = (last_comma > last_dot) & ~text.str.fullmatch(r'[+-]?\d{1,3}(,\d{3})+').fillna(False)
+    text = text.where(comma_decimal.fillna(False), text.str.replace(',', '', regex=False))
+    return text.where(~comma_decimal.fillna(False), text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+
+
+def _keep_unparsed(series: pd.Series, parsed: pd.Series, target_type: str) -> pd.Series:
+    """
+    Retorna la columna convertida, o la columna original como texto si la conversión
+    dejaría nulo algún valor que no lo era. Las conversiones fallidas se registran.
+    """
+    failed = parsed.isna() & series.notna()
+    if not failed.any():
+        return parsed
+    samples = series[failed].astype('string').head(MAX_LOGGED_FAILURES).tolist()
+    logger.warning(
+        f"{int(failed.sum())} valor(es) de la columna '{series.name}' no se pudieron convertir a "
+        f"'{target_type}' (por ejemplo {samples}); la columna se conserva como texto."
+    )
+    return series.astype('string')
+
+
+def _coerce_series(series: pd.Series, target_type: str) -> pd.Series:
+    series = series.mask(_null_mask(series))
+
+    if target_type in ['integer', 'number']:
+        numeric = pd.to_numeric(series, errors='coerce')
+        retry = numeric.isna() & series.notna()
+        if retry.any():
+            numeric = numeric.astype('Float64')
+            numeric[retry] = pd.to_numeric(_strip_thousands_separators(series[retry]), errors='coerce')
+        if numeric[series.notna()].isna().any():
+            return _keep_unparsed(series, numeric, target_type)
+        if target_type == 'integer':
+            non_null = numeric.dropna()
+            if (non_null == non_null.round()).all():
+                return numeric.astype('Int64')
+        return numeric.astype('Float64')
+
+    if target_type == 'boolean':
+        normalized = series.astype('string').str.strip().str.lower()
+        result = pd.Series(pd.NA, index=series.index, dtype='boolean')
+        result[normalized.isin(TRUE_TOKENS).fillna(False)] = True
+        result[normalized.isin(FALSE_TOKENS).fillna(False)] = False
+        return _keep_unparsed(series, result, target_type)
+
+    if target_type == 'datetime':
+        return _keep_unparsed(series, pd.to_datetime(series, errors='coerce', utc=True, format='mixed'), target_type)
+
+    if target_type == 'category':
+        return series.astype('string').astype('category')
+
+    return series.astype('string')
+
+
+def coerce_dataframe(df: pd.DataFrame, compiled_schema: dict = None) -> pd.DataFrame:
+    """
+    Convierte cada columna al tipo declarado en el esquema, reemplaza los marcadores
+    de valores ausentes por nulos reales y elimina las columnas que ya venían vacías.
+
+    Las columnas que no están en el esquema solo se limpian de marcadores nulos. Una
+    columna con valores que no se pueden convertir a su tipo se conserva como texto.
+    """
+    if compiled_schema is None:
+        compiled_schema = COMPILED_DATAFRAME_SCHEMA
+
+    coerced = {}
+    dropped = []
+    for column in df.columns:
+        if _null_mask(df[column]).all():
+            dropped.append(column)
+            continue
+        target_type = compiled_schema.get(column)
+        try:
+            if target_type:
+                coerced[column] = _coerce_series(df[column], target_type)
+            else:
+                coerced[column] = df[column].mask(_null_mask(df[column]))
+        except Exception as e:
+            logger.warning(f"No se pudo convertir la columna '{column}' al tipo '{target_type}': {e}")
+            coerced[column] = df[column]
+
+    result = pd.DataFrame(coerced, index=df.index)
+    if dropped:
+        logger.info(f"Columnas vacías eliminadas: {dropped}")
+    return result
+
+
+# Tipos de Pandas de cada columna en los conjuntos de datos alineados. Las categorías se
+# guardan como texto para que todas las partes tengan el mismo esquema.
+_ALIGNED_DTYPES = {
+    'integer': 'Int64',
+    'number': 'Float64',
+    'boolean': 'boolean',
+    'datetime': 'datetime64[ns, UTC]',
+    'category': 'string',
+    'string': 'string',
+}
+
+
+def align_to_schema(df: pd.DataFrame, compiled_schema: dict = None) -> pd.DataFrame:
+    """
+    Alinea un DataFrame ya convertido al conjunto completo de columnas del esquema, en el
+    orden del esquema. Las columnas ausentes se agregan vacías con su tipo y las columnas
+    que no están en el esquema se descartan, de modo que todos los resultados compartan
+    la misma estructura.
+    """
+    if compiled_schema is None:
+        compiled_schema = COMPILED_DATAFRAME_SCHEMA
+
+    columns = {}
+    for column, target_type in compiled_schema.items():
+        dtype = _ALIGNED_DTYPES[target_type]
+        if column in df.columns:
+            try:
+                columns[column] = df[column].astype(dtype)
+                continue
+            except Exception as e:
+                logger.warning(f"No se pudo alinear la columna '{column}' al tipo '{dtype}': {e}")
+        columns[column] = pd.Series(pd.NA, index=df.index, dtype=dtype)
+    return pd.DataFrame(columns, index=df.index)
@@ -0,0 +1,127 @@
+"""
+Utilidad para guardar y leer los stacks procesados en CSV y/o Parquet.
+Las salidas se escriben por partes directamente en el backend de almacenamiento.
+"""
+
+import io
+import json
+import logging
+import pandas as pd
+
+import config
+from .schema_validator import coerce_dataframe
+from .storage_backend import get_storage
+
+logger = logging.getLogger(__name__)
+
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+
+def build_stack_dataframe(json_data, source_name: str):
+    """
+    Construye el DataFrame tipado de un resultado del modelo.
+
+    Args:
+        json_data (dict | list): El resultado procesado por Gemini.
+        source_name (str): Nombre del archivo de origen, usado en los registros.
+
+    Returns:
+        pd.DataFrame: El DataFrame con los tipos del esquema, o None si no hay datos.
+    """
+    if isinstance(json_data, dict) and 'dataframe_package' in json_data and 'data' in json_data['dataframe_package']:
+        table_data = json_data['dataframe_package']['data']
+        if not table_data:
+            logger.warning(f"La estructura 'dataframe_package' está vacía después de la limpieza para el archivo {source_name}. No se puede crear el DataFrame.")
+            return None
+
+        df = pd.DataFrame.from_dict(table_data)
+    elif isinstance(json_data, list):
+        df = pd.DataFrame(json_data)
+    elif isinstance(json_data, dict) and 'data' in json_data:
+        df = pd.DataFrame.from_dict(json_data['data'])
+    else:
+        logger.warning(f"Estructura JSON no reconocida para el archivo {source_name}. No se puede crear el DataFrame.")
+        return None
+
+    # Convierte las columnas a los tipos declarados en el esquema
+    df = coerce_dataframe(df)
+    if df.empty:
+        logger.warning(f"El DataFrame del archivo {source_name} no contiene valores después de la validación.")
+        return None
+    return df
+
+
+def _stack_formats() -> list:
+    """
+    Retorna los formatos configurados, con Parquet primero si está habilitado.
+    """
+    if config.STACK_FORMAT == 'both':
+        return ['parquet', 'csv']
+    if config.STACK_FORMAT in ['parquet', 'csv']:
+        return [config.STACK_FORMAT]
+    logger.warning(f"Formato de stack no reconocido: {config.STACK_FORMAT}. Se usará CSV.")
+    return ['csv']
+
+
+def _text_value(value) -> str:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+def _parquet_ready(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convierte a texto las columnas que quedaron como `object` (columnas fuera del esquema o
+    valores que no se pudieron convertir), porque pyarrow rechaza las columnas con tipos
+    mezclados. Los diccionarios y listas se guardan como JSON.
+    """
+    object_columns = [col for col in df.columns if df[col].dtype == object]
+    if not object_columns:
+        return df
+    df = df.copy()
+    for col in object_columns:
+        df[col] = df[col].map(_text_value, na_action='ignore').astype('string')
+    return df
+
+
+def save_stack(df: pd.DataFrame, bucket_name: str, base_blob_name: str) -> str:
+    """
+    Guarda un DataFrame en los formatos configurados en `STACK_FORMAT`.
+
+    Args:
+        df (pd.DataFrame): DataFrame con los tipos ya convertidos según el esquema.
+        bucket_name (str): Bucket de destino.
+        base_blob_name (str): Ruta de destino sin extensión.
+
+    Returns:
+        str: La ruta del stack principal (Parquet si está habilitado, de lo contrario CSV).
+    """
+    saved_paths = []
+    for stack_format in _stack_formats():
+        destination_blob_name = f"{base_blob_name}.{stack_format}"
+        if stack_format == 'parquet':
+            with get_storage().open_write(bucket_name, destination_blob_name, PARQUET_CONTENT_TYPE) as stream:
+                _parquet_ready(df).to_parquet(stream, index=False, engine='pyarrow', compression=config.PARQUET_COMPRESSION)
+        else:
+            with get_storage().open_write(bucket_name, destination_blob_name, 'text/csv', text=True) as stream:
+                df.to_csv(stream, index=False, chunksize=config.CSV_WRITE_CHUNK_ROWS)
+        logger.info(f"Stack guardado en formato {stack_format}: {destination_blob_name}")
+        saved_paths.append(destination_blob_name)
+    return saved_paths[0]
+
+
+def save_json(data, bucket_name: str, blob_name: str):
+    """
+    Serializa un objeto a JSON directamente en el blob de destino, sin construir la cadena completa.
+    """
+    with get_storage().open_write(bucket_name, blob_name, 'application/json', text=True) as stream:
+        json.dump(data, stream)
+
+
+def read_stack(bucket_name: str, blob_name: str) -> pd.DataFrame:
+    """
+    Lee un stack del almacenamiento a un DataFrame de Pandas según su extensión.
+    """
+    content = get_storage().read(bucket_name, blob_name)
+    if blob_name.endswith('.parquet'):
+        return pd.read_parquet(io.BytesIO(content), engine='pyarrow')
+    return pd.read_csv(io.BytesIO(content))
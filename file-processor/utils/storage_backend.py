@@ -0,0 +1,542 @@
+"""
+Interfaz de almacenamiento de objetos con una implementación para Cloud Storage y otra
+para un directorio local.
+
+Todos los módulos leen y escriben a través de `get_storage()`, de modo que el mismo
+código de `process_file` puede ejecutarse contra Cloud Storage o contra el disco local
+(para ejecuciones masivas locales y pruebas de rendimiento repetibles). El backend se
+elige con `STORAGE_BACKEND` ('gcs' o 'local') y `LOCAL_STORAGE_ROOT`.
+
+Las operaciones sobre objetos inexistentes lanzan `NotFound` y las condiciones de
+generación no cumplidas lanzan `PreconditionFailed`, igual que con Cloud Storage.
+"""
+
+import io
+import os
+import json
+import time
+import queue
+import shutil
+import logging
+import uuid
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from google.cloud import storage
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+import config
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+ObjectInfo = namedtuple(
+    'ObjectInfo',
+    ['bucket', 'name', 'size', 'updated', 'content_type', 'generation', 'metadata', 'component_count'],
+)
+
+# Marcadores de fin de la cola de carga
+_FINISH = object()
+_ABORT = object()
+
+# Carpeta de los objetos temporales de las escrituras por partes en Cloud Storage. Los que
+# queden tras una caída del proceso se pueden limpiar con una regla de ciclo de vida.
+UPLOAD_TEMP_FOLDER = "_uploads/"
+
+
+class StorageBackend:
+    """
+    Operaciones de almacenamiento usadas por el pipeline. Los objetos se identifican por
+    el nombre del bucket y la ruta del objeto dentro del bucket.
+    """
+
+    def read(self, bucket_name: str, name: str) -> bytes:
+        raise NotImplementedError
+
+    def read_text(self, bucket_name: str, name: str) -> str:
+        return self.read(bucket_name, name).decode('utf-8')
+
+    def read_range(self, bucket_name: str, name: str, start: int, length: int) -> bytes:
+        """
+        Lee `length` bytes a partir de la posición `start`.
+        """
+        raise NotImplementedError
+
+    def write(self, bucket_name: str, name: str, data, content_type: str = None,
+              if_generation_match: int = None, metadata: dict = None):
+        """
+        Escribe un objeto completo. Con `if_generation_match`, solo escribe si la generación
+        actual coincide (0 significa que el objeto no debe existir).
+        """
+        raise NotImplementedError
+
+    def open_write(self, bucket_name: str, name: str, content_type: str = None, text: bool = False):
+        """
+        Retorna un administrador de contexto con un archivo de escritura por partes. Si ocurre
+        un error dentro del bloque, el objeto no se publica.
+        """
+        raise NotImplementedError
+
+    def copy(self, source_bucket: str, source_name: str, destination_bucket: str, destination_name: str,
+             metadata: dict = None):
+        raise NotImplementedError
+
+    def compose(self, bucket_name: str, name: str, sources: list, if_generation_match: int = None):
+        """
+        Concatena los objetos `sources` (rutas del mismo bucket) en `name`.
+        """
+        raise NotImplementedError
+
+    def delete(self, bucket_name: str, name: str):
+        raise NotImplementedError
+
+    def list(self, bucket_name: str, prefix: str = ''):
+        """
+        Itera los `ObjectInfo` de los objetos bajo un prefijo, en orden de nombre.
+        """
+        for objects, _ in self.list_pages(bucket_name, prefix):
+            yield from objects
+
+    def list_pages(self, bucket_name: str, prefix: str = '', page_size: int = 1000, page_token: str = None):
+        """
+        Itera las páginas del listado como tuplas (objetos, token de la página siguiente).
+        """
+        raise NotImplementedError
+
+    def metadata(self, bucket_name: str, name: str) -> ObjectInfo:
+        """
+        Retorna el `ObjectInfo` de un objeto, o None si no existe.
+        """
+        raise NotImplementedError
+
+    def update_metadata(self, bucket_name: str, name: str, metadata: dict):
+        """
+        Agrega o reemplaza claves de los metadatos personalizados de un objeto, sin reescribirlo.
+        """
+        raise NotImplementedError
+
+    def exists(self, bucket_name: str, name: str) -> bool:
+        return self.metadata(bucket_name, name) is not None
+
+    def uri(self, bucket_name: str, name: str) -> str:
+        """
+        Retorna el URI gs:// del objeto para los servicios que lo leen directamente,
+        o None si el backend no es accesible desde Google Cloud.
+        """
+        return None
+
+
+class _StreamingBlobWriter(io.RawIOBase):
+    """
+    Archivo de solo escritura que sube su contenido a un blob por partes de `chunk_size` bytes.
+
+    Mientras el contenido no supera `chunk_size`, se acumula en memoria y se sube al cerrar
+    con una sola carga, que es el caso de la mayoría de las salidas. Si lo supera, la carga
+    pasa a un hilo en segundo plano con una sesión reanudable, de modo que la serialización
+    continúa mientras se sube la parte anterior. La memoria usada queda acotada a unas
+    pocas partes, sin importar el tamaño total del archivo.
+
+    Las partes de una carga reanudable se suben a un objeto temporal en `UPLOAD_TEMP_FOLDER`
+    que, al cerrar, se compone sobre el destino en una sola operación. Si la carga se
+    descarta, solo se elimina el temporal: la versión anterior del destino nunca se modifica.
+    """
+
+    def __init__(self, blob: storage.Blob, content_type: str, chunk_size: int):
+        super().__init__()
+        self._blob = blob
+        self._upload = None
+        self._content_type = content_type
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._queue = queue.Queue(maxsize=2)
+        self._error = None
+        self._aborted = False
+        self._bytes_written = 0
+        self._thread = None
+
+    def _start_upload(self):
+        """
+        Inicia la carga reanudable cuando el contenido ya no cabe en una sola parte.
+        """
+        self._upload = self._blob.bucket.blob(f"{UPLOAD_TEMP_FOLDER}{uuid.uuid4().hex}")
+        self._thread = threading.Thread(target=self._upload_loop, daemon=True)
+        self._thread.start()
+
+    def _upload_loop(self):
+        try:
+            blob_writer = self._upload.open('wb', chunk_size=self._chunk_size, content_type=self._content_type)
+            while True:
+                chunk = self._queue.get()
+                if chunk is _ABORT:
+                    # La sesión reanudable no se puede cancelar con la API pública:
+                    # se finaliza y se elimina el objeto temporal.
+                    blob_writer.close()
+                    self._delete_upload()
+                    return
+                if chunk is _FINISH:
+                    blob_writer.close()
+                    self._blob.content_type = self._content_type
+                    self._blob.compose([self._upload])
+                    self._delete_upload()
+                    return
+                blob_writer.write(chunk)
+        except Exception as e:
+            self._error = e
+            self._delete_upload()
+
+    def _delete_upload(self):
+        try:
+            self._upload.delete()
+        except NotFound:
+            pass
+        except Exception as e:
+            logger.warning(f"No se pudo eliminar el objeto temporal {self._upload.name}: {e}")
+
+    def _put(self, item):
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._bytes_written
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("Escritura sobre un archivo cerrado.")
+        if self._aborted:
+            return len(data)
+        self._buffer.extend(data)
+        self._bytes_written += len(data)
+        while len(self._buffer) > self._chunk_size:
+            if self._thread is None:
+                self._start_upload()
+            self._put(bytes(self._buffer[:self._chunk_size]))
+            del self._buffer[:self._chunk_size]
+        return len(data)
+
+    def abort(self):
+        """
+        Descarta la carga y elimina el objeto temporal, sin tocar el destino.
+        """
+        if self.closed or self._aborted:
+            return
+        self._aborted = True
+        self._buffer.clear()
+        if self._thread is None:
+            return
+        if self._error is None:
+            self._put(_ABORT)
+        self._thread.join()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if not self._aborted and self._thread is None:
+                self._blob.upload_from_string(bytes(self._buffer), content_type=self._content_type)
+                self._buffer.clear()
+            elif not self._aborted:
+                if self._buffer:
+                    self._put(bytes(self._buffer))
+                    self._buffer.clear()
+                self._put(_FINISH)
+                self._thread.join()
+                if self._error is not None:
+                    raise self._error
+        finally:
+            super().close()
+
+
+class GCSStorageBackend(StorageBackend):
+    """
+    Backend sobre Google Cloud Storage con un solo cliente compartido.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> storage.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = storage.Client()
+            return self._client
+
+    def _blob(self, bucket_name: str, name: str) -> storage.Blob:
+        return self.client.bucket(bucket_name).blob(name)
+
+    @staticmethod
+    def _info(blob: storage.Blob) -> ObjectInfo:
+        return ObjectInfo(
+            blob.bucket.name, blob.name, blob.size, blob.updated, blob.content_type,
+            blob.generation, blob.metadata or {}, blob.component_count,
+        )
+
+    @tracing.storage_io('in')
+    def read(self, bucket_name, name):
+        return self._blob(bucket_name, name).download_as_bytes()
+
+    @tracing.storage_io('in')
+    def read_range(self, bucket_name, name, start, length):
+        if length <= 0:
+            return b''
+        return self._blob(bucket_name, name).download_as_bytes(start=start, end=start + length - 1)
+
+    @tracing.storage_io('out')
+    def write(self, bucket_name, name, data, content_type=None, if_generation_match=None, metadata=None):
+        blob = self._blob(bucket_name, name)
+        if metadata:
+            blob.metadata = metadata
+        blob.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match)
+
+    @contextmanager
+    def open_write(self, bucket_name, name, content_type=None, text=False):
+        writer = _StreamingBlobWriter(self._blob(bucket_name, name), content_type, config.UPLOAD_CHUNK_SIZE)
+        stream = io.TextIOWrapper(writer, encoding='utf-8', newline='') if text else writer
+        try:
+            yield stream
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            stream.close()
+        tracing.record_bytes('out', writer.tell())
+
+    def copy(self, source_bucket, source_name, destination_bucket, destination_name, metadata=None):
+        source = self.client.bucket(source_bucket)
+        copied = source.copy_blob(source.blob(source_name), self.client.bucket(destination_bucket), destination_name)
+        if metadata:
+            copied.metadata = {**(copied.metadata or {}), **metadata}
+            copied.patch()
+
+    def compose(self, bucket_name, name, sources, if_generation_match=None):
+        bucket = self.client.bucket(bucket_name)
+        bucket.blob(name).compose([bucket.blob(source) for source in sources], if_generation_match=if_generation_match)
+
+    def delete(self, bucket_name, name):
+        self._blob(bucket_name, name).delete()
+
+    def list_pages(self, bucket_name, prefix='', page_size=1000, page_token=None):
+        iterator = self.client.list_blobs(bucket_name, prefix=prefix, page_size=page_size, page_token=page_token)
+        for page in iterator.pages:
+            objects = [self._info(blob) for blob in page]
+            yield objects, iterator.next_page_token
+
+    def metadata(self, bucket_name, name):
+        blob = self.client.bucket(bucket_name).get_blob(name)
+        return self._info(blob) if blob is not None else None
+
+    def update_metadata(self, bucket_name, name, metadata):
+        blob = self._blob(bucket_name, name)
+        blob.metadata = metadata
+        blob.patch()
+
+    def uri(self, bucket_name, name):
+        return f"gs://{bucket_name}/{name}"
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    Backend sobre un directorio local: cada bucket es una carpeta bajo `root` y los
+    metadatos de cada objeto se guardan en `root/.metadata/`. Las escrituras se hacen
+    en un archivo temporal que se publica con un reemplazo atómico.
+
+    Las condiciones de generación solo se garantizan dentro de un mismo proceso.
+    """
+
+    METADATA_FOLDER = '.metadata'
+    TEMP_FOLDER = '.tmp'
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(self.root, self.TEMP_FOLDER), exist_ok=True)
+
+    def _path(self, bucket_name: str, name: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, bucket_name, name))
+        if not path.startswith(os.path.join(self.root, bucket_name) + os.sep):
+            raise ValueError(f"Ruta de objeto no válida: {name}")
+        return path
+
+    def _metadata_path(self, bucket_name: str, name: str) -> str:
+        return os.path.join(self.root, self.METADATA_FOLDER, bucket_name, f"{name}.json")
+
+    def _load_metadata(self, bucket_name: str, name: str) -> dict:
+        try:
+            with open(self._metadata_path(bucket_name, name), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _check_generation(self, bucket_name: str, name: str, if_generation_match: int):
+        if if_generation_match is None:
+            return
+        current = self.metadata(bucket_name, name)
+        generation = current.generation if current is not None else 0
+        if generation != if_generation_match:
+            raise PreconditionFailed(f"La generación de {bucket_name}/{name} no coincide: {generation} != {if_generation_match}")
+
+    def _publish(self, temp_path: str, bucket_name: str, name: str, content_type: str = None, metadata: dict = None):
+        path = self._path(bucket_name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        metadata_path = self._metadata_path(bucket_name, name)
+        os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+        with open(metadata_path, 'w', encoding='utf-8') as f:
+            json.dump({'content_type': content_type, 'generation': time.time_ns(), 'metadata': metadata or {}}, f)
+
+    def _temp_file(self):
+        return tempfile.NamedTemporaryFile(dir=os.path.join(self.root, self.TEMP_FOLDER), delete=False)
+
+    @tracing.storage_io('in')
+    def read(self, bucket_name, name):
+        try:
+            with open(self._path(bucket_name, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise NotFound(f"No existe el objeto {bucket_name}/{name}")
+
+    @tracing.storage_io('in')
+    def read_range(self, bucket_name, name, start, length):
+        try:
+            with open(self._path(bucket_name, name), 'rb') as f:
+                f.seek(start)
+                return f.read(max(length, 0))
+        except FileNotFoundError:
+            raise NotFound(f"No existe el objeto {bucket_name}/{name}")
+
+    @tracing.storage_io('out')
+    def write(self, bucket_name, name, data, content_type=None, if_generation_match=None, metadata=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._temp_file() as temp:
+            temp.write(data)
+        with self._lock:
+            try:
+                self._check_generation(bucket_name, name, if_generation_match)
+            except PreconditionFailed:
+                os.remove(temp.name)
+                raise
+            self._publish(temp.name, bucket_name, name, content_type, metadata)
+
+    @contextmanager
+    def open_write(self, bucket_name, name, content_type=None, text=False):
+        temp = self._temp_file()
+        stream = io.TextIOWrapper(temp, encoding='utf-8', newline='') if text else temp
+        try:
+            yield stream
+        except BaseException:
+            stream.close()
+            os.remove(temp.name)
+            raise
+        stream.close()
+        tracing.record_bytes('out', os.path.getsize(temp.name))
+        with self._lock:
+            self._publish(temp.name, bucket_name, name, content_type)
+
+    def copy(self, source_bucket, source_name, destination_bucket, destination_name, metadata=None):
+        source_info = self._load_metadata(source_bucket, source_name)
+        with self._temp_file() as temp:
+            try:
+                with open(self._path(source_bucket, source_name), 'rb') as source:
+                    shutil.copyfileobj(source, temp)
+            except FileNotFoundError:
+                os.remove(temp.name)
+                raise NotFound(f"No existe el objeto {source_bucket}/{source_name}")
+        with self._lock:
+            self._publish(
+                temp.name, destination_bucket, destination_name, source_info.get('content_type'),
+                {**source_info.get('metadata', {}), **(metadata or {})},
+            )
+
+    def compose(self, bucket_name, name, sources, if_generation_match=None):
+        with self._lock:
+            self._check_generation(bucket_name, name, if_generation_match)
+            content_type = self._load_metadata(bucket_name, name).get('content_type')
+            with self._temp_file() as temp:
+                for source in sources:
+                    with open(self._path(bucket_name, source), 'rb') as f:
+                        shutil.copyfileobj(f, temp)
+            self._publish(temp.name, bucket_name, name, content_type)
+
+    def delete(self, bucket_name, name):
+        with self._lock:
+            try:
+                os.remove(self._path(bucket_name, name))
+            except FileNotFoundError:
+                raise NotFound(f"No existe el objeto {bucket_name}/{name}")
+            try:
+                os.remove(self._metadata_path(bucket_name, name))
+            except FileNotFoundError:
+                pass
+
+    def list_pages(self, bucket_name, prefix='', page_size=1000, page_token=None):
+        bucket_root = os.path.join(self.root, bucket_name)
+        names = []
+        for directory, _, files in os.walk(bucket_root):
+            for file_name in files:
+                name = os.path.relpath(os.path.join(directory, file_name), bucket_root).replace(os.sep, '/')
+                if name.startswith(prefix) and (page_token is None or name > page_token):
+                    names.append(name)
+        names.sort()
+        for start in range(0, len(names), page_size):
+            page = names[start:start + page_size]
+            objects = [info for info in (self.metadata(bucket_name, name) for name in page) if info is not None]
+            # El token es el último nombre listado; la página siguiente comienza después de él
+            next_token = page[-1] if start + page_size < len(names) else None
+            yield objects, next_token
+
+    def metadata(self, bucket_name, name):
+        try:
+            stat = os.stat(self._path(bucket_name, name))
+        except FileNotFoundError:
+            return None
+        stored = self._load_metadata(bucket_name, name)
+        return ObjectInfo(
+            bucket_name, name, stat.st_size, datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+            stored.get('content_type'), stored.get('generation', stat.st_mtime_ns), stored.get('metadata', {}), None,
+        )
+
+    def update_metadata(self, bucket_name, name, metadata):
+        with self._lock:
+            if not os.path.exists(self._path(bucket_name, name)):
+                raise NotFound(f"No existe el objeto {bucket_name}/{name}")
+            stored = self._load_metadata(bucket_name, name)
+            stored['metadata'] = {**stored.get('metadata', {}), **metadata}
+            metadata_path = self._metadata_path(bucket_name, name)
+            os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+            with open(metadata_path, 'w', encoding='utf-8') as f:
+                json.dump(stored, f)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """
+    Retorna el backend de almacenamiento configurado, creándolo la primera vez.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if config.STORAGE_BACKEND == 'local':
+                logger.info(f"Usando almacenamiento local en {config.LOCAL_STORAGE_ROOT}")
+                _backend = LocalStorageBackend(config.LOCAL_STORAGE_ROOT)
+            elif config.STORAGE_BACKEND == 'gcs':
+                _backend = GCSStorageBackend()
+            else:
+                raise ValueError(f"Backend de almacenamiento no soportado: {config.STORAGE_BACKEND}")
+        return _backend
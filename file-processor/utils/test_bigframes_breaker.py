@@ -0,0 +1,50 @@
+import time
+import pytest
+import pandas as pd
+from google.api_core.exceptions import ServiceUnavailable
+
+# Importación relativa para que funcione correctamente
+from . import bigframes_processor, circuit_breaker
+from .circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN
+
+
+class _FakeSession:
+    def read_csv(self, uri):
+        return pd.DataFrame({'total': [1, 2]})
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """
+    Interruptor de 'bigframes' con una espera corta, abierto tras un fallo.
+    """
+    breaker = CircuitBreaker('bigframes', failure_threshold=1, reset_seconds=0.05, max_reset_seconds=1)
+    monkeypatch.setitem(circuit_breaker._breakers, 'bigframes', breaker)
+    with pytest.raises(circuit_breaker.DependencyUnavailable):
+        breaker.call(_raise_outage)
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+def _raise_outage():
+    raise ServiceUnavailable("BigQuery no disponible")
+
+
+def test_half_open_analysis_closes_breaker(breaker, monkeypatch):
+    """
+    Una llamada de prueba exitosa a través de `_analyze_with_session` cierra el
+    interruptor, aunque el prompt del reporte pase por el lote de predict.
+    """
+    monkeypatch.setattr(bigframes_processor.bigframes_session, 'session', lambda: _FakeSession())
+    monkeypatch.setattr(bigframes_processor.get_storage(), 'uri', lambda bucket, name: f"gs://{bucket}/{name}")
+    monkeypatch.setattr(bigframes_processor, '_generate_report', lambda df, engine: bigframes_processor._generate_text("prompt", engine))
+    monkeypatch.setattr(bigframes_processor, '_predict_batch', lambda session, prompts: ['reporte'] * len(prompts))
+
+    report = breaker.call(
+        bigframes_processor.bigframes_session.run,
+        lambda session: bigframes_processor._analyze_with_session(session, 'processed/stacks/stack.csv'),
+    )
+
+    assert report == 'reporte'
+    assert breaker.state == CLOSED
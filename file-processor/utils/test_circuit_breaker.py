@@ -0,0 +1,116 @@
+import time
+import pytest
+from google.api_core.exceptions import NotFound, ServiceUnavailable
+
+# Importación relativa para que funcione correctamente
+from .circuit_breaker import CircuitBreaker, DependencyUnavailable, CLOSED, OPEN, HALF_OPEN
+
+
+def _raise_outage():
+    raise ServiceUnavailable("Servicio no disponible")
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker('vertex', failure_threshold=2, reset_seconds=0.05, max_reset_seconds=1)
+
+
+def _open(breaker):
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(DependencyUnavailable):
+            breaker.call(_raise_outage)
+    assert breaker.state == OPEN
+
+
+def test_opens_after_threshold_and_fails_fast(breaker):
+    """
+    Tras los fallos consecutivos del umbral, las llamadas fallan sin llegar a la dependencia.
+    """
+    calls = []
+    _open(breaker)
+
+    with pytest.raises(DependencyUnavailable) as error:
+        breaker.call(lambda: calls.append(1))
+
+    assert calls == []
+    assert error.value.dependency == 'vertex'
+    assert 0 < error.value.retry_after <= 0.05
+
+
+def test_successful_probe_closes(breaker):
+    """
+    Vencida la espera, una llamada de prueba exitosa cierra el interruptor.
+    """
+    states = []
+    breaker.add_listener(lambda name, state: states.append(state))
+    _open(breaker)
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+
+    assert breaker.call(lambda: 'ok') == 'ok'
+
+    assert breaker.state == CLOSED
+    assert states == [OPEN, CLOSED]
+
+
+def test_failed_probe_doubles_wait(breaker):
+    """
+    Una llamada de prueba fallida vuelve a abrir el interruptor con el doble de espera.
+    """
+    _open(breaker)
+    time.sleep(0.06)
+
+    with pytest.raises(DependencyUnavailable) as error:
+        breaker.call(_raise_outage)
+
+    assert breaker.state == OPEN
+    assert 0.05 < error.value.retry_after <= 0.1
+
+
+def test_single_probe_in_flight(breaker):
+    """
+    Mientras una llamada de prueba está en curso, las demás fallan de inmediato.
+    """
+    _open(breaker)
+    time.sleep(0.06)
+
+    def concurrent_call():
+        with pytest.raises(DependencyUnavailable):
+            breaker.call(lambda: 'segunda')
+        return 'prueba'
+
+    assert breaker.call(concurrent_call) == 'prueba'
+    assert breaker.state == CLOSED
+
+
+def test_request_errors_count_as_responses(breaker):
+    """
+    Un error de la solicitud se propaga sin cambios y no suma fallos de caída.
+    """
+    def raise_not_found():
+        raise NotFound("No existe")
+
+    with pytest.raises(DependencyUnavailable):
+        breaker.call(_raise_outage)
+    with pytest.raises(NotFound):
+        breaker.call(raise_not_found)
+    with pytest.raises(DependencyUnavailable):
+        breaker.call(_raise_outage)
+
+    assert breaker.state == CLOSED
+
+
+def test_local_errors_release_probe(breaker):
+    """
+    Un error local durante la prueba libera la prueba sin cerrar el interruptor, y la
+    siguiente llamada puede volver a probar la dependencia.
+    """
+    _open(breaker)
+    time.sleep(0.06)
+
+    with pytest.raises(KeyError):
+        breaker.call(lambda: {}['clave'])
+
+    assert breaker.state == HALF_OPEN
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CLOSED
@@ -0,0 +1,123 @@
+import json
+import time
+import pytest
+from concurrent.futures import Future
+from google.api_core.exceptions import ServiceUnavailable
+
+# Importación relativa para que funcione correctamente
+from . import deferred_queue, circuit_breaker
+from .circuit_breaker import CircuitBreaker, DependencyUnavailable
+from .storage_backend import LocalStorageBackend
+
+
+class _InlineLanes:
+    """
+    Planificador que ejecuta cada trabajo en el momento en que se envía.
+    """
+
+    def submit(self, file_type, size, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    backend = LocalStorageBackend(str(tmp_path))
+    monkeypatch.setattr(deferred_queue, 'get_storage', lambda: backend)
+    monkeypatch.setattr(deferred_queue.config, 'DEFERRED_BASE_BACKOFF_SECONDS', 10)
+    monkeypatch.setattr(deferred_queue.config, 'DEFERRED_MAX_BACKOFF_SECONDS', 100)
+    monkeypatch.setattr(deferred_queue.config, 'DEFERRED_DRAIN_BATCH', 50)
+    monkeypatch.setattr(deferred_queue.random, 'uniform', lambda low, high: 1.0)
+    monkeypatch.setattr(deferred_queue, '_recovered', set())
+    return backend
+
+
+def _raise_outage():
+    raise ServiceUnavailable("Servicio no disponible")
+
+
+def _entry(storage, file_name):
+    blob_name = deferred_queue._entry_blob_name('origen', file_name)
+    return json.loads(storage.read_text(deferred_queue.DESTINATION_BUCKET, blob_name))
+
+
+def _make_due(storage, file_name):
+    entry = _entry(storage, file_name)
+    entry['next_attempt_at'] = time.time() - 1
+    blob_name = deferred_queue._entry_blob_name('origen', file_name)
+    storage.write(deferred_queue.DESTINATION_BUCKET, blob_name, json.dumps(entry), content_type='application/json')
+
+
+def test_defer_file_backs_off(storage):
+    """
+    Cada aplazamiento suma un intento y duplica la espera, sin bajar de la sugerida.
+    """
+    deferred_queue.defer_file('origen', 'a.txt', 'vertex', "caída")
+    first = _entry(storage, 'a.txt')
+    deferred_queue.defer_file('origen', 'a.txt', 'vertex', "caída", retry_after=50)
+    second = _entry(storage, 'a.txt')
+
+    assert first['attempts'] == 1
+    assert first['next_attempt_at'] - time.time() == pytest.approx(10, abs=1)
+    assert second['attempts'] == 2
+    assert second['next_attempt_at'] - time.time() == pytest.approx(50, abs=1)
+    assert second['first_deferred_at'] == first['first_deferred_at']
+
+
+def test_drain_resolves_due_entries(storage):
+    """
+    Solo se reintentan las entradas vencidas; las resueltas se eliminan y las demás se reprograman.
+    """
+    for file_name in ['listo.txt', 'fallido.txt', 'pendiente.txt']:
+        deferred_queue.defer_file('origen', file_name, None, "plazo agotado")
+    _make_due(storage, 'listo.txt')
+    _make_due(storage, 'fallido.txt')
+    statuses = {'listo.txt': 200, 'fallido.txt': 400}
+    processed = []
+
+    def process_fn(bucket_name, file_name):
+        processed.append(file_name)
+        return "mensaje", statuses[file_name]
+
+    assert deferred_queue.drain_deferred(process_fn, _InlineLanes()) == 2
+
+    assert sorted(processed) == ['fallido.txt', 'listo.txt']
+    assert not storage.exists(deferred_queue.DESTINATION_BUCKET, deferred_queue._entry_blob_name('origen', 'listo.txt'))
+    assert _entry(storage, 'fallido.txt')['attempts'] == 2
+    assert _entry(storage, 'pendiente.txt')['attempts'] == 1
+
+
+def test_open_breaker_allows_single_probe(storage, monkeypatch):
+    """
+    Con el interruptor abierto se reintenta un solo archivo de la dependencia; el resto se libera.
+    """
+    breaker = CircuitBreaker('vertex', failure_threshold=1, reset_seconds=60, max_reset_seconds=60)
+    monkeypatch.setitem(circuit_breaker._breakers, 'vertex', breaker)
+    with pytest.raises(DependencyUnavailable):
+        breaker.call(_raise_outage)
+    for file_name in ['a.txt', 'b.txt']:
+        deferred_queue.defer_file('origen', file_name, 'vertex', "caída")
+        _make_due(storage, file_name)
+    processed = []
+
+    def process_fn(bucket_name, file_name):
+        processed.append(file_name)
+        return "mensaje", deferred_queue.DEFERRED_STATUS
+
+    assert deferred_queue.drain_deferred(process_fn, _InlineLanes()) == 1
+
+    released = [name for name in ['a.txt', 'b.txt'] if name not in processed]
+    assert len(processed) == 1
+    assert _entry(storage, released[0])['claimed_until'] == 0
+
+
+def test_recovered_dependency_skips_backoff(storage):
+    """
+    Cuando el interruptor de la dependencia se cierra, sus entradas se reintentan sin esperar.
+    """
+    deferred_queue.defer_file('origen', 'a.txt', 'vision', "caída")
+    deferred_queue._on_breaker_change('vision', circuit_breaker.CLOSED)
+
+    assert deferred_queue.drain_deferred(lambda bucket, name: ("mensaje", 200), _InlineLanes()) == 1
+    assert deferred_queue._recovered == set()
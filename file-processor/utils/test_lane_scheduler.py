@@ -0,0 +1,80 @@
+import threading
+import pytest
+
+# Importación relativa para que funcione correctamente
+from .lane_scheduler import LaneScheduler, file_type_for
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = LaneScheduler(
+        workers=3,
+        lane_limits={'audio': {'small': 1, 'large': 1}, 'text': {'small': 2, 'large': 1}},
+        small_file_bytes=100,
+        name="prueba",
+    )
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_lane_for(scheduler):
+    """
+    El carril depende del tipo y del tamaño; el tamaño desconocido cuenta como grande y
+    los tipos sin carril propio usan 'other'.
+    """
+    assert scheduler.lane_for('audio', 50) == ('audio', 'small')
+    assert scheduler.lane_for('audio', 500) == ('audio', 'large')
+    assert scheduler.lane_for('text', None) == ('text', 'large')
+    assert scheduler.lane_for('image', 50) == ('other', 'small')
+    assert file_type_for('carpeta/nota.TXT') == 'text'
+    assert file_type_for('carpeta/archivo.xyz') == 'other'
+
+
+def test_saturated_lane_does_not_block_others(scheduler):
+    """
+    Un carril en su límite deja sus trabajos en cola sin ocupar los hilos de los demás carriles.
+    """
+    release = threading.Event()
+    running = []
+    running_lock = threading.Lock()
+
+    def slow_audio(name):
+        with running_lock:
+            running.append(name)
+        release.wait(2)
+        return name
+
+    audio = [scheduler.submit('audio', 500, slow_audio, f"audio-{i}") for i in range(2)]
+    text = scheduler.submit('text', 10, lambda: 'texto')
+
+    assert text.result(timeout=2) == 'texto'
+    assert scheduler.stats()['audio/large'] == {'queued': 1, 'running': 1}
+    assert running == ['audio-0']
+
+    release.set()
+    assert [future.result(timeout=2) for future in audio] == ['audio-0', 'audio-1']
+
+
+def test_errors_reach_the_future(scheduler):
+    """
+    La excepción de un trabajo se entrega en su `Future` y el carril queda libre.
+    """
+    def fail():
+        raise ValueError("archivo inválido")
+
+    with pytest.raises(ValueError):
+        scheduler.run('text', 10, fail)
+    assert scheduler.run('text', 10, lambda: 'ok') == 'ok'
+    assert scheduler.stats() == {}
+
+
+def test_shutdown_drains_queues(scheduler):
+    """
+    Al detenerse, el planificador termina los trabajos en cola y rechaza los nuevos.
+    """
+    futures = [scheduler.submit('text', 500, lambda i=i: i) for i in range(5)]
+    scheduler.shutdown()
+
+    assert [future.result(timeout=2) for future in futures] == list(range(5))
+    with pytest.raises(RuntimeError):
+        scheduler.submit('text', 10, lambda: None)
@@ -0,0 +1,113 @@
+import time
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Importación relativa para que funcione correctamente
+from .micro_batcher import MicroBatcher
+
+
+class _RecordingFlush:
+    """
+    Función de lote que registra cada lote recibido y retorna los elementos duplicados.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def __call__(self, items):
+        with self._lock:
+            self.batches.append(list(items))
+        return [item * 2 for item in items]
+
+
+def _wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "La condición no se cumplió a tiempo."
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield executor
+
+
+def test_weight_never_exceeds_max(executor):
+    """
+    Un elemento que no cabe en el lote en curso lo procesa y comienza un lote nuevo.
+    """
+    flush = _RecordingFlush()
+    batcher = MicroBatcher(flush, window_seconds=0.05, max_items=10, max_weight=10)
+
+    first = executor.submit(batcher.submit, 1, weight=6)
+    _wait_for(lambda: batcher._pending)
+    second = executor.submit(batcher.submit, 2, weight=6)
+
+    assert first.result(timeout=2) == 2
+    assert second.result(timeout=2) == 4
+    assert flush.batches == [[1], [2]]
+
+
+def test_oversized_item_runs_alone(executor):
+    """
+    Un elemento que supera el peso máximo por sí solo forma su propio lote sin esperar la ventana.
+    """
+    flush = _RecordingFlush()
+    batcher = MicroBatcher(flush, window_seconds=10, max_items=10, max_weight=10)
+
+    assert batcher.submit(3, weight=25, timeout=2) == 6
+    assert flush.batches == [[3]]
+    assert batcher._timer is None
+
+
+def test_full_batch_runs_before_window(executor):
+    """
+    Al alcanzar el máximo de elementos el lote se procesa sin esperar la ventana.
+    """
+    flush = _RecordingFlush()
+    batcher = MicroBatcher(flush, window_seconds=10, max_items=2)
+
+    results = [executor.submit(batcher.submit, item) for item in (1, 2)]
+
+    assert [result.result(timeout=2) for result in results] == [2, 4]
+    assert flush.batches == [[1, 2]]
+
+
+def test_stale_timer_does_not_flush_next_batch(executor):
+    """
+    El temporizador de un lote ya procesado no cierra el lote siguiente antes de su ventana.
+    """
+    flush = _RecordingFlush()
+    batcher = MicroBatcher(flush, window_seconds=10, max_items=2)
+
+    first = executor.submit(batcher.submit, 1)
+    _wait_for(lambda: batcher._timer is not None)
+    stale_timer = batcher._timer
+    executor.submit(batcher.submit, 2).result(timeout=2)
+    first.result(timeout=2)
+
+    third = executor.submit(batcher.submit, 3)
+    _wait_for(lambda: batcher._timer is not None)
+    batcher._flush_on_timer(stale_timer)
+    assert [item for item, _, _, _ in batcher._pending] == [3]
+
+    batcher._flush_on_timer(batcher._timer)
+    assert third.result(timeout=2) == 6
+    assert flush.batches == [[1, 2], [3]]
+
+
+def test_timeout_withdraws_pending_item():
+    """
+    Un elemento cuyo plazo vence antes de que su lote comience se retira del lote.
+    """
+    flush = _RecordingFlush()
+    batcher = MicroBatcher(flush, window_seconds=10, max_items=10, max_weight=10)
+
+    with pytest.raises(FutureTimeoutError):
+        batcher.submit(1, weight=4, timeout=0.01)
+
+    assert batcher._pending == []
+    assert batcher._pending_weight == 0
@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+# Importación relativa para que funcione correctamente
+from . import stack_writer
+from .storage_backend import LocalStorageBackend
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    backend = LocalStorageBackend(str(tmp_path))
+    monkeypatch.setattr(stack_writer, 'get_storage', lambda: backend)
+    monkeypatch.setattr(stack_writer.config, 'STACK_FORMAT', 'both')
+    return backend
+
+
+def test_save_stack_with_mixed_type_extra_column(storage):
+    """
+    Una columna fuera del esquema con tipos mezclados se guarda como texto en Parquet
+    y sin cambios en CSV.
+    """
+    df = pd.DataFrame({
+        'extra': [1, 'a', None],
+        'nested': [{'a': 1}, 'x', None],
+    })
+
+    blob_name = stack_writer.save_stack(df, 'bucket', 'processed/stacks/mixto')
+
+    assert blob_name == 'processed/stacks/mixto.parquet'
+    parquet = stack_writer.read_stack('bucket', blob_name)
+    assert parquet['extra'].tolist()[:2] == ['1', 'a']
+    assert parquet['nested'].tolist()[:2] == ['{"a": 1}', 'x']
+    assert parquet['extra'].isna().tolist() == [False, False, True]
+    csv = stack_writer.read_stack('bucket', 'processed/stacks/mixto.csv')
+    assert csv['extra'].tolist()[:2] == ['1', 'a']
@@ -0,0 +1,316 @@
+"""
+Trazas por etapa del procesamiento: duración, bytes leídos y escritos y tokens de Gemini.
+
+Cada etapa se envuelve en un span (`span` o `traced`); los spans de un mismo archivo
+comparten el identificador de traza y se anidan según el contexto del hilo. Las lecturas
+y escrituras del almacenamiento y las respuestas de Gemini suman sus bytes, su tiempo y
+sus tokens al span activo.
+
+Una operación compartida por varios archivos (un lote de Gemini o de BigFrames) se mide
+con `shared_span` en una traza propia; los bytes y tokens que registran ese span y sus
+hijos se reparten entre los spans de los archivos del lote.
+
+Los spans terminados se exportan como líneas JSON (a la salida estándar o a
+`TRACING_JSON_PATH`) y, si OpenTelemetry está instalado, también como spans de
+OpenTelemetry con los mismos atributos. Con `TRACING_SAMPLE_RATE` se muestrea por
+archivo: un span raíz no muestreado desactiva todos sus hijos.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import config
+
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry.trace import Status, StatusCode
+    OTEL_IMPORTED = True
+except ImportError:
+    OTEL_IMPORTED = False
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('tracing_span', default=None)
+_write_lock = threading.Lock()
+_json_file = None
+_otel_tracer = None
+
+
+class Span:
+    """
+    Un span en curso. Los atributos numéricos se acumulan con `add`.
+    """
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'attributes', 'start_ns', '_started_at', '_otel_span', '_shares')
+
+    def __init__(self, name: str, parent=None, attributes: dict = None, shares: list = None):
+        self.name = name
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        # Spans de otros archivos que reciben una fracción de lo que se suma a este span
+        self._shares = shares if shares is not None else (parent._shares if parent else None)
+        self.start_ns = time.time_ns()
+        self._started_at = time.perf_counter()
+        self._otel_span = None
+        if _use_otel():
+            parent_context = otel_trace.set_span_in_context(parent._otel_span) if parent and parent._otel_span else None
+            self._otel_span = _get_otel_tracer().start_span(name, context=parent_context, start_time=self.start_ns)
+            span_context = self._otel_span.get_span_context()
+        else:
+            span_context = None
+        if span_context is not None and span_context.is_valid:
+            self.trace_id = format(span_context.trace_id, '032x')
+            self.span_id = format(span_context.span_id, '016x')
+        else:
+            self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+            self.span_id = os.urandom(8).hex()
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def add(self, key: str, amount):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+        for member, fraction in self._shares or []:
+            member.add(key, amount * fraction)
+
+    def _finish(self, error: BaseException = None):
+        duration = time.perf_counter() - self._started_at
+        record = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': datetime.fromtimestamp(self.start_ns / 1e9, timezone.utc).isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'status': 'error' if error else 'ok',
+            'attributes': self.attributes,
+        }
+        if error:
+            record['error'] = f"{type(error).__name__}: {error}"
+        if 'json' in config.TRACING_EXPORTERS:
+            _export_json(record)
+        if self._otel_span is not None:
+            for key, value in self.attributes.items():
+                if isinstance(value, (str, bool, int, float)):
+                    self._otel_span.set_attribute(key, value)
+            if error:
+                self._otel_span.set_status(Status(StatusCode.ERROR, str(error)))
+            self._otel_span.end(end_time=self.start_ns + int(duration * 1e9))
+
+
+class _NoopSpan:
+    """
+    Span de un archivo no muestreado o con las trazas desactivadas.
+    """
+
+    def set(self, key: str, value):
+        pass
+
+    def add(self, key: str, amount):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def _use_otel() -> bool:
+    return OTEL_IMPORTED and 'otel' in config.TRACING_EXPORTERS
+
+
+def _get_otel_tracer():
+    global _otel_tracer
+    if _otel_tracer is None:
+        # El proveedor y su exportador se configuran fuera del código (SDK o variables OTEL_*)
+        _otel_tracer = otel_trace.get_tracer("file-processor")
+    return _otel_tracer
+
+
+def _export_json(record: dict):
+    global _json_file
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _write_lock:
+        if config.TRACING_JSON_PATH:
+            if _json_file is None:
+                _json_file = open(config.TRACING_JSON_PATH, 'a', encoding='utf-8')
+            stream = _json_file
+        else:
+            stream = sys.stdout
+        stream.write(line + "\n")
+        stream.flush()
+
+
+def current_span():
+    """
+    Retorna el span activo, o un span vacío si no hay uno o el archivo no se muestreó.
+    """
+    return _current.get() or _NOOP
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Mide una etapa como un span hijo del span activo.
+
+    Uso:
+        with tracing.span('ocr', file_name=file_name) as current:
+            current.add('bytes.out', len(text))
+    """
+    parent = _current.get()
+    if not config.TRACING_ENABLED or parent is _NOOP:
+        yield _NOOP
+        return
+    if parent is None and random.random() >= config.TRACING_SAMPLE_RATE:
+        # La decisión de muestreo de la raíz se hereda en todos los spans del archivo
+        token = _current.set(_NOOP)
+        try:
+            yield _NOOP
+        finally:
+            _current.reset(token)
+        return
+
+    current = Span(name, parent, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current._finish(e)
+        raise
+    else:
+        current._finish()
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def shared_span(name: str, members: list, weights: list = None, **attributes):
+    """
+    Mide una operación compartida por varios archivos, como el lote que los agrupa.
+
+    El span inicia una traza propia, porque puede ejecutarse en un hilo sin contexto (por
+    ejemplo, un temporizador). Los bytes y tokens que se suman a él o a sus hijos se reparten
+    entre `members` (los spans activos de cada archivo al enviar su elemento) en proporción
+    a `weights`, y cada archivo registra el identificador de la traza del lote.
+
+    Args:
+        name (str): Nombre del span.
+        members (list): Spans de los archivos del lote (los no muestreados se omiten).
+        weights (list): Peso de cada archivo en el lote (opcional; por omisión, partes iguales).
+    """
+    weights = weights or [1] * len(members)
+    total = sum(weights) or 1
+    shares = [(member, weight / total) for member, weight in zip(members, weights) if isinstance(member, Span)]
+    if not config.TRACING_ENABLED or not shares:
+        # Sin archivos muestreados, la operación no crea una traza huérfana
+        token = _current.set(_NOOP)
+        try:
+            yield _NOOP
+        finally:
+            _current.reset(token)
+        return
+
+    current = Span(name, None, {**attributes, 'batch.size': len(members), 'batch.shared': True}, shares)
+    for member, _ in shares:
+        member.set('batch.trace_id', current.trace_id)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current._finish(e)
+        raise
+    else:
+        current._finish()
+    finally:
+        _current.reset(token)
+
+
+def traced(name: str, result_attributes=None):
+    """
+    Decorador que mide cada llamada de la función como un span.
+
+    Args:
+        name (str): Nombre del span.
+        result_attributes: Función opcional que recibe el resultado y retorna atributos
+            adicionales para el span.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = fn(*args, **kwargs)
+                if result_attributes is not None:
+                    for key, value in result_attributes(result).items():
+                        current.set(key, value)
+                return result
+        return wrapper
+    return decorator
+
+
+def set_attributes(attributes: dict):
+    """
+    Agrega atributos al span activo.
+    """
+    current = current_span()
+    for key, value in attributes.items():
+        current.set(key, value)
+
+
+def record_usage(response, model_name: str = None):
+    """
+    Suma al span activo los tokens reportados en `usage_metadata` de una respuesta de Gemini.
+    """
+    current = current_span()
+    if current is _NOOP:
+        return
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is not None:
+        current.add('gen_ai.usage.input_tokens', getattr(usage, 'prompt_token_count', 0) or 0)
+        current.add('gen_ai.usage.output_tokens', getattr(usage, 'candidates_token_count', 0) or 0)
+    if model_name:
+        current.set('gen_ai.request.model', model_name)
+
+
+def _size(data) -> int:
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    return len(data) if data is not None else 0
+
+
+def storage_io(direction: str):
+    """
+    Decorador para las operaciones del backend de almacenamiento: suma los bytes y el
+    tiempo de cada lectura ('in') o escritura ('out') al span activo.
+    """
+    operation = 'read' if direction == 'in' else 'write'
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, bucket_name, name, *args, **kwargs):
+            current = current_span()
+            if current is _NOOP:
+                return fn(self, bucket_name, name, *args, **kwargs)
+            started_at = time.perf_counter()
+            result = fn(self, bucket_name, name, *args, **kwargs)
+            size = _size(result) if direction == 'in' else _size(args[0] if args else kwargs.get('data'))
+            current.add(f'bytes.{direction}', size)
+            current.add(f'storage.{operation}.seconds', round(time.perf_counter() - started_at, 6))
+            current.add(f'storage.{operation}.count', 1)
+            return result
+        return wrapper
+    return decorator
+
+
+def record_bytes(direction: str, size: int):
+    """
+    Suma bytes leídos ('in') o escritos ('out') al span activo, para las operaciones que
+    no pasan por `storage_io` (por ejemplo, las escrituras por partes).
+    """
+    current_span().add(f'bytes.{direction}', size)
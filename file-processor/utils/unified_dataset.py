@@ -0,0 +1,265 @@
+"""
+Conjunto de datos unificado en CSV, mantenido de forma incremental.
+
+Cada stack se alinea al conjunto completo de columnas de `dataframe_package` y se guarda
+como una parte inmutable, junto con un delta pequeño con sus agregados por columna
+(conteos, nulos, sumas, mínimos, máximos y un bosquejo KMV de valores distintos). El
+procesamiento de un archivo solo escribe esos dos objetos nuevos, sin modificar objetos
+compartidos.
+
+`merge_unified_dataset`, que corre fuera del procesamiento (con la compactación), agrega
+las partes al segmento activo con composiciones de Cloud Storage y suma sus deltas al
+archivo de agregados, de modo que los tableros leen los totales sin recorrer el conjunto.
+La fusión en curso se registra en el archivo de agregados antes de componer, para
+completarla sin duplicar filas ni totales si el proceso se interrumpe.
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import logging
+import pandas as pd
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+import config
+from .schema_validator import align_to_schema, COMPILED_DATAFRAME_SCHEMA
+from .storage_backend import get_storage
+
+logger = logging.getLogger(__name__)
+
+UNIFIED_FOLDER = "processed/unified/"
+PARTS_FOLDER = f"{UNIFIED_FOLDER}_parts/"
+SEGMENT_TEMPLATE = f"{UNIFIED_FOLDER}unified_dataset-{{:05d}}.csv"
+AGGREGATES_BLOB = f"{UNIFIED_FOLDER}aggregates.json"
+DELTAS_FOLDER = f"{UNIFIED_FOLDER}_deltas/"
+
+# Cloud Storage limita los objetos compuestos a 1024 componentes
+MAX_SEGMENT_COMPONENTS = 1000
+# Una composición acepta hasta 32 fuentes: el segmento y 31 partes
+COMPOSE_BATCH_SIZE = 31
+_HASH_SPACE = float(2 ** 64)
+
+
+def _value_hashes(series: pd.Series) -> list:
+    values = series.dropna().astype('string').unique()
+    return [int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big') for value in values]
+
+
+def _merge_sketch(sketch: list, hashes: list) -> list:
+    """
+    Une dos bosquejos KMV conservando los `UNIFIED_SKETCH_SIZE` valores de hash más pequeños.
+    """
+    return sorted(set(sketch) | set(hashes))[:config.UNIFIED_SKETCH_SIZE]
+
+
+def estimate_distinct(sketch: list) -> int:
+    """
+    Estima el número de valores distintos a partir de un bosquejo KMV.
+    """
+    if len(sketch) < config.UNIFIED_SKETCH_SIZE:
+        return len(sketch)
+    return int((len(sketch) - 1) / (sketch[-1] / _HASH_SPACE))
+
+
+def _stack_aggregates(aligned: pd.DataFrame) -> dict:
+    """
+    Calcula los agregados de un stack con operaciones vectorizadas por grupo de columnas.
+    """
+    counts = aligned.notna().sum()
+    numeric_cols = [col for col, kind in COMPILED_DATAFRAME_SCHEMA.items() if kind in ['integer', 'number'] and counts[col]]
+    datetime_cols = [col for col, kind in COMPILED_DATAFRAME_SCHEMA.items() if kind == 'datetime' and counts[col]]
+    sums = aligned[numeric_cols].sum() if numeric_cols else pd.Series(dtype='float64')
+    minimums = aligned[numeric_cols + datetime_cols].min() if numeric_cols or datetime_cols else pd.Series(dtype='object')
+    maximums = aligned[numeric_cols + datetime_cols].max() if numeric_cols or datetime_cols else pd.Series(dtype='object')
+
+    def _scalar(value):
+        if pd.isna(value):
+            return None
+        return value.isoformat() if isinstance(value, pd.Timestamp) else float(value)
+
+    columns = {}
+    for col in COMPILED_DATAFRAME_SCHEMA:
+        count = int(counts[col])
+        stats = {'count': count, 'null_count': int(len(aligned) - count)}
+        if col in numeric_cols:
+            stats['sum'] = _scalar(sums[col])
+        if col in numeric_cols or col in datetime_cols:
+            stats['min'] = _scalar(minimums[col])
+            stats['max'] = _scalar(maximums[col])
+        if count and COMPILED_DATAFRAME_SCHEMA[col] != 'number':
+            stats['sketch'] = _merge_sketch([], _value_hashes(aligned[col]))
+        columns[col] = stats
+    return columns
+
+
+def _merge_aggregates(state: dict, row_count: int, stack_columns: dict) -> dict:
+    state['row_count'] = state.get('row_count', 0) + row_count
+    state['stack_count'] = state.get('stack_count', 0) + 1
+    columns = state.setdefault('columns', {})
+    for col, stats in stack_columns.items():
+        current = columns.setdefault(col, {'count': 0, 'null_count': 0})
+        current['count'] += stats['count']
+        current['null_count'] += stats['null_count']
+        if 'sum' in stats and stats['sum'] is not None:
+            current['sum'] = current.get('sum', 0.0) + stats['sum']
+        for key, pick in [('min', min), ('max', max)]:
+            if stats.get(key) is not None:
+                current[key] = stats[key] if current.get(key) is None else pick(current[key], stats[key])
+        if 'sketch' in stats:
+            current['sketch'] = _merge_sketch(current.get('sketch', []), stats['sketch'])
+    return state
+
+
+def _load_state(bucket_name: str):
+    info = get_storage().metadata(bucket_name, AGGREGATES_BLOB)
+    if info is None:
+        return {'segment': 1}, 0
+    return json.loads(get_storage().read_text(bucket_name, AGGREGATES_BLOB)), info.generation
+
+
+def _save_state(bucket_name: str, state: dict, generation: int) -> int:
+    """
+    Guarda el archivo de agregados solo si nadie lo modificó desde `generation` y retorna
+    la nueva generación.
+    """
+    get_storage().write(
+        bucket_name, AGGREGATES_BLOB, json.dumps(state), content_type='application/json',
+        if_generation_match=generation,
+    )
+    return get_storage().metadata(bucket_name, AGGREGATES_BLOB).generation
+
+
+def append_to_unified_dataset(bucket_name: str, df: pd.DataFrame, source_file: str):
+    """
+    Guarda un stack como parte pendiente del conjunto de datos unificado, junto con sus
+    agregados. Las filas se agregan al segmento en la siguiente `merge_unified_dataset`.
+
+    Args:
+        bucket_name (str): Bucket de destino.
+        df (pd.DataFrame): El stack ya tipado.
+        source_file (str): Nombre del archivo de origen, guardado en la columna `source_file`.
+    """
+    aligned = align_to_schema(df)
+    aligned.insert(0, 'source_file', pd.Series(os.path.basename(source_file), index=aligned.index, dtype='string'))
+    part_id = uuid.uuid4().hex
+
+    get_storage().write(
+        bucket_name, f"{PARTS_FOLDER}{part_id}.csv", aligned.to_csv(index=False, header=False), content_type='text/csv'
+    )
+    # El delta se escribe después de la parte: su existencia indica que la parte está completa
+    delta = {
+        'id': part_id,
+        'source_file': os.path.basename(source_file),
+        'row_count': len(aligned),
+        'columns': _stack_aggregates(aligned),
+    }
+    get_storage().write(bucket_name, f"{DELTAS_FOLDER}{part_id}.json", json.dumps(delta), content_type='application/json')
+    logger.info(f"{len(aligned)} filas guardadas como parte pendiente del conjunto unificado ({part_id}).")
+
+
+def _active_segment(bucket_name: str, segment_number: int, part_count: int):
+    """
+    Retorna el número y el `ObjectInfo` del segmento que admite `part_count` componentes
+    más, creándolo con la fila de encabezados si aún no existe.
+    """
+    while True:
+        segment_name = SEGMENT_TEMPLATE.format(segment_number)
+        segment = get_storage().metadata(bucket_name, segment_name)
+        if segment is None:
+            header = pd.DataFrame(columns=['source_file', *COMPILED_DATAFRAME_SCHEMA]).to_csv(index=False)
+            try:
+                get_storage().write(bucket_name, segment_name, header, content_type='text/csv', if_generation_match=0)
+            except PreconditionFailed:
+                pass
+            continue
+        if (segment.component_count or 1) + part_count > MAX_SEGMENT_COMPONENTS:
+            segment_number += 1
+            continue
+        return segment_number, segment
+
+
+def _finish_merge(bucket_name: str, state: dict, generation: int):
+    """
+    Completa la fusión registrada en `state['merging']`: compone las partes en el segmento
+    si aún no se hizo, suma sus deltas a los agregados y elimina los objetos pendientes.
+    """
+    merging = state['merging']
+    segment_name = SEGMENT_TEMPLATE.format(merging['segment'])
+    segment = get_storage().metadata(bucket_name, segment_name)
+    # Si la generación cambió, la composición ya se hizo antes de una interrupción
+    if segment is not None and segment.generation == merging['base_generation']:
+        get_storage().compose(
+            bucket_name, segment_name, [segment_name] + [f"{PARTS_FOLDER}{part_id}.csv" for part_id in merging['ids']],
+            if_generation_match=merging['base_generation'],
+        )
+
+    row_count = 0
+    for part_id in merging['ids']:
+        delta = json.loads(get_storage().read_text(bucket_name, f"{DELTAS_FOLDER}{part_id}.json"))
+        state = _merge_aggregates(state, delta['row_count'], delta['columns'])
+        row_count += delta['row_count']
+    state['segment'] = merging['segment']
+    del state['merging']
+    generation = _save_state(bucket_name, state, generation)
+
+    # El delta se elimina antes que la parte para que una interrupción no deje un delta sin su parte
+    for part_id in merging['ids']:
+        for name in [f"{DELTAS_FOLDER}{part_id}.json", f"{PARTS_FOLDER}{part_id}.csv"]:
+            try:
+                get_storage().delete(bucket_name, name)
+            except NotFound:
+                pass
+    logger.info(f"{len(merging['ids'])} parte(s) con {row_count} filas agregadas al segmento {merging['segment']}.")
+    return state, generation
+
+
+def merge_unified_dataset(bucket_name: str, max_parts: int = None) -> dict:
+    """
+    Agrega las partes pendientes al conjunto unificado y sus deltas a los agregados.
+
+    Debe ejecutarse una sola vez a la vez (la compactación la llama con su turno exclusivo);
+    si otro proceso modifica el archivo de agregados, la escritura condicionada falla con
+    `PreconditionFailed` sin dejar totales duplicados.
+
+    Args:
+        bucket_name (str): Bucket del conjunto unificado.
+        max_parts (int): Número máximo de partes a fusionar en esta ejecución (opcional).
+
+    Returns:
+        dict: El estado final del archivo de agregados.
+    """
+    state, generation = _load_state(bucket_name)
+    if state.get('merging'):
+        logger.info("Completando la fusión pendiente del conjunto unificado.")
+        state, generation = _finish_merge(bucket_name, state, generation)
+
+    deltas = sorted(
+        get_storage().list(bucket_name, prefix=DELTAS_FOLDER),
+        key=lambda info: (info.updated.isoformat() if info.updated else '', info.name),
+    )
+    part_ids = [os.path.splitext(os.path.basename(info.name))[0] for info in deltas]
+    if max_parts:
+        part_ids = part_ids[:max_parts]
+
+    for start in range(0, len(part_ids), COMPOSE_BATCH_SIZE):
+        batch = part_ids[start:start + COMPOSE_BATCH_SIZE]
+        segment_number, segment = _active_segment(bucket_name, state.get('segment', 1), len(batch))
+        # Registra la fusión antes de componer para poder completarla si se interrumpe
+        state['merging'] = {'ids': batch, 'segment': segment_number, 'base_generation': segment.generation}
+        generation = _save_state(bucket_name, state, generation)
+        state, generation = _finish_merge(bucket_name, state, generation)
+    return state
+
+
+def read_unified_aggregates(bucket_name: str) -> dict:
+    """
+    Lee los totales acumulados del conjunto unificado con una sola descarga.
+    Los bosquejos se reemplazan por la estimación de valores distintos.
+    """
+    state, _ = _load_state(bucket_name)
+    state.pop('merging', None)
+    for stats in state.get('columns', {}).values():
+        if 'sketch' in stats:
+            stats['distinct_estimate'] = estimate_distinct(stats.pop('sketch'))
+    return state
@@ -0,0 +1,144 @@
+"""
+Trabajador de larga duración que consume las notificaciones de Cloud Storage con
+extracción continua (streaming pull) de Pub/Sub.
+
+El cliente de Pub/Sub mantiene a lo sumo `WORKER_MAX_MESSAGES` mensajes (o
+`WORKER_MAX_BYTES` bytes) sin confirmar y extiende automáticamente el plazo de
+confirmación mientras `process_file` espera a Gemini o a Speech-to-Text (hasta
+`WORKER_MAX_LEASE_SECONDS`). Los mensajes se ejecutan en `WORKER_THREADS` hilos
+repartidos en carriles por tipo de archivo y clase de tamaño, de modo que los archivos
+pequeños no esperan detrás de los trabajos pesados.
+
+Para probarlo con el emulador local de Pub/Sub basta con definir `PUBSUB_EMULATOR_HOST`
+(por ejemplo, `localhost:8085`); el cliente se conecta al emulador automáticamente.
+
+Uso:
+    python worker.py --subscription file-processor-sub
+"""
+
+import os
+import signal
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
+import config
+from main import process_file, parse_storage_event
+from utils.lane_scheduler import LaneScheduler, file_type_for
+from utils.deferred_queue import start_deferred_drainer
+
+logger = logging.getLogger(__name__)
+
+# Hilos que solo reciben los mensajes y los encolan en los carriles
+DISPATCH_THREADS = 2
+
+
+def _settle(message, file_name: str, future):
+    """
+    Confirma o rechaza el mensaje cuando termina su procesamiento.
+    """
+    try:
+        _, status = future.result()
+    except Exception as e:
+        logger.error(f"Error no controlado procesando {file_name}: {e}")
+        message.nack()
+        return
+
+    if status >= 500:
+        message.nack()
+    else:
+        message.ack()
+
+
+def handle_message(message, lanes: LaneScheduler):
+    """
+    Encola una notificación de Cloud Storage en su carril; el mensaje se confirma o se
+    rechaza según el resultado del procesamiento.
+
+    Los mensajes que no se pueden interpretar se confirman para no reintentarlos sin fin;
+    los errores de procesamiento (código 5xx) se rechazan para que Pub/Sub los reenvíe.
+    """
+    try:
+        bucket_name, file_name, file_size = parse_storage_event(message.data)
+    except (KeyError, ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Mensaje {message.message_id} descartado: no es un evento de Cloud Storage válido ({e}).")
+        message.ack()
+        return
+
+    # Las notificaciones de Cloud Storage también incluyen el objeto en los atributos
+    bucket_name = bucket_name or message.attributes.get('bucketId')
+    file_name = file_name or message.attributes.get('objectId')
+    if not bucket_name or not file_name:
+        logger.error(f"Mensaje {message.message_id} descartado: faltan el bucket o el nombre del archivo.")
+        message.ack()
+        return
+
+    # Los mensajes rechazados se reentregan, por lo que un plazo agotado puede retornar 503
+    future = lanes.submit(file_type_for(file_name), file_size, process_file, bucket_name, file_name, None, True)
+    future.add_done_callback(lambda done: _settle(message, file_name, done))
+
+
+def run_worker(subscription: str = None, threads: int = None):
+    """
+    Consume la suscripción hasta recibir SIGTERM o SIGINT.
+
+    Args:
+        subscription (str): Nombre corto o ruta completa de la suscripción (opcional).
+        threads (int): Número de hilos de trabajo (opcional).
+    """
+    subscription = subscription or config.PUBSUB_SUBSCRIPTION
+    threads = threads or config.WORKER_THREADS
+
+    subscriber = pubsub_v1.SubscriberClient()
+    subscription_path = subscription if subscription.startswith('projects/') else subscriber.subscription_path(config.PROJECT_ID, subscription)
+
+    flow_control = pubsub_v1.types.FlowControl(
+        max_messages=config.WORKER_MAX_MESSAGES,
+        max_bytes=config.WORKER_MAX_BYTES,
+        max_lease_duration=config.WORKER_MAX_LEASE_SECONDS,
+    )
+    lanes = LaneScheduler(threads, config.LANE_CONCURRENCY, config.LANE_SMALL_FILE_BYTES, name="worker")
+    # Los archivos diferidos por caídas de las dependencias se reintentan en los mismos carriles
+    start_deferred_drainer(process_file, lanes)
+    scheduler = ThreadScheduler(executor=ThreadPoolExecutor(max_workers=DISPATCH_THREADS, thread_name_prefix="dispatch"))
+
+    streaming_pull = subscriber.subscribe(
+        subscription_path, callback=lambda message: handle_message(message, lanes),
+        flow_control=flow_control, scheduler=scheduler, await_callbacks_on_shutdown=True,
+    )
+
+    def _shutdown(signum, frame):
+        logger.info(f"Señal {signum} recibida. Deteniendo el trabajador...")
+        streaming_pull.cancel()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    emulator = os.environ.get("PUBSUB_EMULATOR_HOST")
+    logger.info(
+        f"Trabajador escuchando {subscription_path} con {threads} hilo(s)"
+        f"{f' (emulador en {emulator})' if emulator else ''}."
+    )
+    with subscriber:
+        try:
+            streaming_pull.result()
+        except Exception as e:
+            # `cancel()` termina la extracción con una excepción que no es un error
+            if not streaming_pull.cancelled():
+                logger.error(f"La extracción continua de Pub/Sub terminó con un error: {e}")
+                raise
+        finally:
+            # Espera a que terminen los mensajes que ya están en los carriles
+            lanes.shutdown(wait=True)
+    logger.info("Trabajador detenido.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Procesa las notificaciones de Cloud Storage desde una suscripción de Pub/Sub.")
+    parser.add_argument("--subscription", default=None)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    run_worker(args.subscription, args.threads)